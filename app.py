@@ -0,0 +1,197 @@
+"""
+WSGI API for generating bills programmatically, as deployed by the Dockerfile:
+
+    gunicorn app:app
+
+POST /bills takes the workbook and the bill parameters and returns the same
+ZIP the Streamlit page offers. Either send multipart/form-data with the
+workbook in a "workbook" file field and the parameters as form fields:
+
+    curl -F workbook=@march.xlsx -F start_date=2024-04-01 -F completion_date=2025-03-31 \
+         -F work_order_amount=100000 -F premium_percent=4.5 -F premium_type=above \
+         -F amount_paid_last_bill=0 -F is_first_bill=true -o bill.zip http://localhost:5000/bills
+
+or JSON with the workbook base64 encoded:
+
+    {"workbook": "<base64>", "start_date": "2024-04-01", ...}
+
+The parameters are those in batch_generate.BILL_FIELDS. The query
+parameters pdf_mode (one of PDF_RENDER_MODES) and compression (one of
+ZIP_COMPRESSION_METHODS) are optional. Invalid parameters get a 400 with a
+JSON error and an invalid workbook a 422. The workbook is parsed and
+processed before the response starts, and the ZIP is then streamed as its
+members are built, so a worker never holds a whole archive. The parse and
+process times are sent in a Server-Timing header; the later stages are only
+logged.
+
+POST /jobs takes the same request but queues the bill (see bill_jobs) and
+answers 202 with the job; the X-User header names the submitter for the
+per-user limit and the priority query parameter orders the queue. Poll
+GET /jobs/<id> for its status, download GET /jobs/<id>/result once it is
+done, and POST /jobs/<id>/retry to run a failed job again.
+
+Everything that is expensive to set up (compiled templates, the wkhtmltopdf
+slots, the process pool and the result cache) is module-level state in
+streamlit_app. Each gunicorn worker sets it up once and shares it across
+its request threads; see gunicorn.conf.py.
+"""
+import base64
+import binascii
+import io
+import logging
+import os
+from typing import Any, Dict, Tuple
+
+from flask import Flask, Response, jsonify, request, send_file, url_for
+
+import streamlit_app
+from batch_generate import BILL_FIELDS
+from bill_jobs import get_job_queue
+from streamlit_app import BillGenerationError, process_workbook, stream_bill_outputs, validate_user_inputs
+
+logger = logging.getLogger(__name__)
+
+# Largest request accepted, workbook included
+MAX_UPLOAD_BYTES = int(float(os.environ.get("BILL_MAX_UPLOAD_MB", 50)) * 1024 * 1024)
+
+app = Flask(__name__)
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES
+
+class BadRequest(ValueError):
+    """The request is missing the workbook or has malformed parameters"""
+
+def read_bill_request() -> Tuple[bytes, Dict[str, Any]]:
+    """
+    Workbook bytes and raw bill parameters from a multipart or JSON request.
+
+    Raises:
+        BadRequest: If the workbook is missing or not valid base64
+    """
+    if request.is_json:
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            raise BadRequest("Request body must be a JSON object")
+        try:
+            workbook = base64.b64decode(body.get("workbook") or "", validate=True)
+        except (binascii.Error, TypeError):
+            raise BadRequest("workbook must be base64 encoded")
+        fields = body
+    else:
+        upload = request.files.get("workbook")
+        workbook = upload.read() if upload is not None else b""
+        fields = request.form
+    if not workbook:
+        raise BadRequest("Missing workbook")
+    return workbook, {field: fields[field] for field in BILL_FIELDS if field in fields}
+
+def server_timing(timings: Dict[str, float]) -> str:
+    """Server-Timing header value, with durations in milliseconds"""
+    return ", ".join(
+        f"{name.replace(':', '-').replace(' ', '_')};dur={seconds * 1000:.1f}" for name, seconds in timings.items()
+    )
+
+@app.errorhandler(BadRequest)
+def bad_request(error: BadRequest):
+    return jsonify(error=str(error)), 400
+
+@app.errorhandler(413)
+def too_large(error):
+    return jsonify(error=f"Request is larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB"), 413
+
+@app.get("/health")
+def health():
+    return jsonify(status="ok")
+
+def output_options() -> Tuple[str, str]:
+    """The pdf_mode and compression query parameters, or their defaults"""
+    mode = request.args.get("pdf_mode", streamlit_app.PDF_RENDER_MODE)
+    if mode not in streamlit_app.PDF_RENDER_MODES:
+        raise BadRequest(f"pdf_mode must be one of: {', '.join(streamlit_app.PDF_RENDER_MODES)}")
+    compression = request.args.get("compression", streamlit_app.ZIP_COMPRESSION)
+    if compression not in streamlit_app.ZIP_COMPRESSION_METHODS:
+        raise BadRequest(f"compression must be one of: {', '.join(streamlit_app.ZIP_COMPRESSION_METHODS)}")
+    return mode, compression
+
+def job_response(job: Dict[str, Any]) -> Dict[str, Any]:
+    job = dict(job, status_url=url_for("job_status", job_id=job["id"]))
+    if job["status"] == "done":
+        job["result_url"] = url_for("job_result", job_id=job["id"])
+    return job
+
+@app.post("/bills")
+def create_bill():
+    mode, compression = output_options()
+    workbook, fields = read_bill_request()
+    try:
+        user_inputs = validate_user_inputs(fields)
+    except ValueError as e:
+        raise BadRequest(str(e))
+
+    source = io.BytesIO(workbook)
+    try:
+        bill, timings = process_workbook(source, user_inputs, streamlit_app.RESULT_CACHE)
+    except BillGenerationError as e:
+        # Raised while reading and validating the workbook
+        return jsonify(error=str(e)), 422
+    except ValueError as e:
+        # pandas cannot open the upload as a workbook
+        return jsonify(error=f"Could not read workbook: {str(e)}"), 422
+    except Exception as e:
+        logger.error(f"Error generating bill: {str(e)}")
+        return jsonify(error=f"Error generating bill: {str(e)}"), 500
+
+    def archive_chunks():
+        # The status is already sent, so a failure here can only end the body early
+        try:
+            yield from stream_bill_outputs(
+                source, user_inputs, mode, cache=streamlit_app.RESULT_CACHE, compression=compression, bill=bill
+            )
+        except Exception as e:
+            logger.error(f"Error generating bill: {str(e)}")
+            raise
+
+    response = Response(archive_chunks(), mimetype="application/zip")
+    response.headers["Content-Disposition"] = "attachment; filename=bill_output.zip"
+    response.headers["Server-Timing"] = server_timing(timings)
+    return response
+
+@app.post("/jobs")
+def create_job():
+    mode, compression = output_options()
+    workbook, fields = read_bill_request()
+    try:
+        priority = int(request.args.get("priority", 0))
+    except ValueError:
+        raise BadRequest("priority must be an integer")
+    queue = get_job_queue()
+    try:
+        job_id = queue.submit(workbook, fields, request.headers.get("X-User", ""), priority, mode, compression)
+    except ValueError as e:
+        raise BadRequest(str(e))
+    return jsonify(job_response(queue.status(job_id))), 202
+
+@app.get("/jobs/<job_id>")
+def job_status(job_id: str):
+    job = get_job_queue().status(job_id)
+    if job is None:
+        return jsonify(error="No such job"), 404
+    return jsonify(job_response(job))
+
+@app.get("/jobs/<job_id>/result")
+def job_result(job_id: str):
+    queue = get_job_queue()
+    job = queue.status(job_id)
+    if job is None:
+        return jsonify(error="No such job"), 404
+    if job["status"] != "done":
+        return jsonify(job_response(job)), 409
+    return send_file(queue.result_path(job_id), mimetype="application/zip", as_attachment=True, download_name="bill_output.zip")
+
+@app.post("/jobs/<job_id>/retry")
+def retry_job(job_id: str):
+    queue = get_job_queue()
+    if queue.status(job_id) is None:
+        return jsonify(error="No such job"), 404
+    if not queue.retry(job_id):
+        return jsonify(error="Only failed jobs can be retried"), 409
+    return jsonify(job_response(queue.status(job_id))), 202
@@ -0,0 +1,212 @@
+"""
+Generate bills from the command line, without the Streamlit form.
+
+Every workbook in a directory can share one set of bill parameters:
+
+    python batch_generate.py bills/ --output out/ --premium-percent 4.5 \
+        --premium-type above --work-order-amount 100000 \
+        --start-date 2024-04-01 --completion-date 2025-03-31
+
+or a CSV manifest can give each bill its own. The manifest needs a
+"workbook" column (paths relative to the manifest), and may have any of the
+columns in BILL_FIELDS; blank or missing values fall back to the command
+line options:
+
+    python batch_generate.py --manifest march.csv --output out/ --workers 8
+
+One ZIP per bill is written to the output directory, named after its
+workbook, together with summary.csv listing the status, error and stage
+timings of every bill. The exit status is 1 if any bill failed.
+
+With --profile, each bill is also profiled: <name>.prof (cProfile, for
+pstats or snakeviz) and <name>.allocations.txt (the top tracemalloc
+allocation sites) are written next to its ZIP.
+"""
+import argparse
+import concurrent.futures
+import csv
+import logging
+import os
+import sys
+import time
+from contextlib import nullcontext
+from typing import Any, Dict, List, Optional
+
+import streamlit_app
+from streamlit_app import PdfRenderer, profile_bill, validate_user_inputs, write_bill_archive
+
+logger = logging.getLogger(__name__)
+
+# Per-bill parameters, as accepted by validate_user_inputs
+BILL_FIELDS = (
+    "start_date", "completion_date", "work_order_amount", "premium_percent", "premium_type",
+    "amount_paid_last_bill", "is_first_bill", "work_name", "bill_serial", "agreement_no", "work_order_ref"
+)
+
+WORKBOOK_EXTENSIONS = (".xlsx", ".xls")
+
+SUMMARY_FILE = "summary.csv"
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Generate contractor bills for a directory or manifest of workbooks.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("directory", nargs="?", help="Directory of .xlsx/.xls workbooks")
+    source.add_argument("--manifest", help="CSV manifest with a workbook column and per-bill parameters")
+    parser.add_argument("--output", required=True, help="Directory for the bill ZIPs and summary.csv")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Bills generated at once")
+    parser.add_argument("--pdf-mode", default=streamlit_app.PDF_RENDER_MODE, choices=streamlit_app.PDF_RENDER_MODES)
+    parser.add_argument("--profile", action="store_true", help="Write a cProfile and allocation report next to each ZIP")
+    parser.add_argument("--start-date", help="YYYY-MM-DD")
+    parser.add_argument("--completion-date", help="YYYY-MM-DD")
+    parser.add_argument("--work-order-amount")
+    parser.add_argument("--premium-percent")
+    parser.add_argument("--premium-type", choices=["above", "below"])
+    parser.add_argument("--amount-paid-last-bill", default="0")
+    parser.add_argument("--first-bill", dest="is_first_bill", action="store_const", const="true", default="false")
+    parser.add_argument("--work-name")
+    parser.add_argument("--bill-serial")
+    parser.add_argument("--agreement-no")
+    parser.add_argument("--work-order-ref")
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    return args
+
+def load_jobs(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """
+    List the bills to generate, each with its workbook path, ZIP name and the
+    raw parameters to validate.
+
+    Args:
+        args: Parsed command line
+
+    Returns:
+        List of jobs with "workbook", "name" and "inputs" keys
+    """
+    defaults = {field: getattr(args, field) for field in BILL_FIELDS if getattr(args, field) is not None}
+    if args.manifest:
+        base_dir = os.path.dirname(os.path.abspath(args.manifest))
+        with open(args.manifest, newline="", encoding="utf-8-sig") as f:
+            rows = list(csv.DictReader(f))
+        if rows and "workbook" not in rows[0]:
+            raise ValueError("Manifest must have a 'workbook' column")
+        entries = []
+        for row in rows:
+            inputs = dict(defaults)
+            inputs.update({field: row[field].strip() for field in BILL_FIELDS if (row.get(field) or "").strip()})
+            entries.append((os.path.join(base_dir, row["workbook"].strip()), inputs))
+    else:
+        entries = [
+            (os.path.join(args.directory, name), dict(defaults))
+            for name in sorted(os.listdir(args.directory))
+            if name.lower().endswith(WORKBOOK_EXTENSIONS) and not name.startswith("~$")
+        ]
+
+    jobs, used = [], set()
+    for workbook, inputs in entries:
+        # Bills from same-named workbooks in different folders get numbered ZIPs
+        stem = name = os.path.splitext(os.path.basename(workbook))[0]
+        count = 1
+        while name in used:
+            count += 1
+            name = f"{stem}_{count}"
+        used.add(name)
+        jobs.append({"workbook": workbook, "name": name, "inputs": inputs})
+    return jobs
+
+def _init_worker() -> None:
+    # The batch pool already runs bills side by side: keep each bill's stages
+    # in threads and give every worker one wkhtmltopdf process
+    streamlit_app.PIPELINE_PROCESSES = 0
+    streamlit_app.PDF_RENDERER = PdfRenderer(max_workers=1)
+
+def generate_bill(job: Dict[str, Any], output_dir: str, mode: str, profile: bool = False) -> Dict[str, Any]:
+    """
+    Generate one bill's ZIP as output_dir/<name>.zip.
+
+    Args:
+        job: Job from load_jobs
+        output_dir: Directory for the ZIP
+        mode: One of PDF_RENDER_MODES
+        profile: Also write output_dir/<name>.prof and <name>.allocations.txt
+
+    Returns:
+        Summary row: bill, workbook, status, error, output ZIP path and stage timings
+    """
+    started = time.perf_counter()
+    result = {"bill": job["name"], "workbook": job["workbook"], "status": "ok", "error": "", "output": ""}
+    try:
+        user_inputs = validate_user_inputs(job["inputs"])
+        zip_path = os.path.join(output_dir, f"{job['name']}.zip")
+        try:
+            with (profile_bill() if profile else nullcontext()) as capture, open(zip_path, "wb") as f:
+                timings = write_bill_archive(job["workbook"], user_inputs, f, mode)
+        except Exception:
+            os.remove(zip_path)
+            raise
+        if capture is not None:
+            for name, data in capture.files(job["name"]).items():
+                with open(os.path.join(output_dir, name), "wb") as f:
+                    f.write(data)
+        result["output"] = zip_path
+        result.update({name: round(seconds, 3) for name, seconds in timings.items()})
+    except Exception as e:
+        logger.error(f"Error generating bill {job['name']}: {str(e)}")
+        result.update({"status": "failed", "error": str(e), "total": round(time.perf_counter() - started, 3)})
+    return result
+
+def write_summary(results: List[Dict[str, Any]], path: str) -> None:
+    """Write one summary.csv row per bill; timing columns are the union of the stages seen"""
+    columns = ["bill", "workbook", "status", "error", "output", "total"]
+    for result in results:
+        columns.extend(key for key in result if key not in columns)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(results)
+
+def run_batch(jobs: List[Dict[str, Any]], output_dir: str, workers: int, mode: str, profile: bool = False) -> List[Dict[str, Any]]:
+    """
+    Generate every job across a pool of worker processes.
+
+    Args:
+        jobs: Jobs from load_jobs
+        output_dir: Directory for the ZIPs and summary.csv
+        workers: Number of worker processes
+        mode: One of PDF_RENDER_MODES
+        profile: Profile each bill, see generate_bill
+
+    Returns:
+        Summary rows in job order
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    results = [None] * len(jobs)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        futures = {executor.submit(generate_bill, job, output_dir, mode, profile): i for i, job in enumerate(jobs)}
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            result = results[futures[future]] = future.result()
+            print(f"[{done}/{len(jobs)}] {result['bill']}: {result['status']} in {result['total']:.2f}s"
+                  + (f" ({result['error'].splitlines()[0]})" if result["error"] else ""))
+    write_summary(results, os.path.join(output_dir, SUMMARY_FILE))
+    return results
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    try:
+        jobs = load_jobs(args)
+    except (OSError, ValueError) as e:
+        print(f"Error: {str(e)}", file=sys.stderr)
+        return 2
+    if not jobs:
+        print("No workbooks to process", file=sys.stderr)
+        return 2
+
+    started = time.perf_counter()
+    results = run_batch(jobs, args.output, min(args.workers, len(jobs)), args.pdf_mode, args.profile)
+    failed = [result for result in results if result["status"] != "ok"]
+    print(f"Generated {len(results) - len(failed)} of {len(results)} bills in {time.perf_counter() - started:.2f}s; "
+          f"summary written to {os.path.join(args.output, SUMMARY_FILE)}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,388 @@
+"""
+Benchmark bill generation on synthetic workbooks of increasing size.
+
+Each workbook has the layout the app reads: 21 header rows on Work Order and
+Bill Quantity with items from row 22 (numbered items and lettered sub-items),
+and 6 header rows on Extra Items. Every stage is timed on its own:
+
+    excel_read    read_excel_sheets
+    process_bill  process_bill, with memoized steps cleared first
+    html          the composed bill document
+    pdf           wkhtmltopdf (skipped when it is not installed)
+    docx          one Word document per section
+    zip           the output archive
+
+    python benchmark_bills.py                      # 100, 1k, 10k and 50k rows
+    python benchmark_bills.py --rows 1000 --repeat 3 --compare
+    python benchmark_bills.py --words 100000      # number_to_words against num2words
+    python benchmark_bills.py --import-time       # cold import of streamlit_app
+
+Timings are the best of --repeat runs. A further run under tracemalloc records
+each stage's peak Python allocations, and the process's peak RSS is noted once
+all stages have run. Each run appends one record per workbook size to the
+results file (JSON lines, tagged with the git commit), and --compare prints
+the change against the latest record from a different commit.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import streamlit_app
+from streamlit_app import (WORD_SECTIONS, PdfRenderer, bill_section_data, number_to_words, output_file_name,
+                           process_bill, read_excel_sheets, validate_user_inputs, word_doc_bytes,
+                           wkhtmltopdf_configuration)
+
+try:
+    from num2words import num2words
+except ImportError:
+    num2words = None
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DEFAULT_SIZES = (100, 1000, 10000, 50000)
+
+STAGES = ("excel_read", "process_bill", "html", "pdf", "docx", "zip")
+
+RESULTS_FILE = os.environ.get("BILL_BENCHMARK_RESULTS", "benchmark_results.jsonl")
+
+# Workbooks are reused between runs; generating the 50k row one takes a while
+WORKBOOK_DIR = os.environ.get("BILL_BENCHMARK_DIR", os.path.join(tempfile.gettempdir(), "rajbill_benchmark"))
+
+# Every fifth Work Order row is a numbered item followed by lettered sub-items
+SUB_ITEMS_PER_ITEM = 4
+
+# One Extra Items row per this many Work Order rows
+EXTRA_ITEMS_RATIO = 10
+
+BENCHMARK_INPUTS = {
+    "start_date": "2024-04-01", "completion_date": "2025-03-31", "work_order_amount": "10000000",
+    "premium_percent": "4.5", "premium_type": "above", "amount_paid_last_bill": "0", "is_first_bill": "true",
+    "work_name": "Benchmark works", "bill_serial": "1", "agreement_no": "BM/1", "work_order_ref": "WO/1"
+}
+
+def _header_rows(count: int, width: int, title: str) -> List[List[Any]]:
+    rows = [[None] * width for _ in range(count)]
+    rows[0][0] = title
+    return rows
+
+def synthetic_sheets(rows: int, seed: int = 0) -> Dict[str, pd.DataFrame]:
+    """
+    Work Order, Bill Quantity and Extra Items sheets with rows item rows.
+
+    Bill Quantity repeats the Work Order items with quantities moved up to
+    25% either way, so the Deviation Statement has both excess and saving.
+    """
+    rng = np.random.default_rng(seed)
+    positions = np.arange(rows)
+    numbered = positions % (SUB_ITEMS_PER_ITEM + 1) == 0
+    serials = np.where(numbered, (positions // (SUB_ITEMS_PER_ITEM + 1) + 1).astype(object), None)
+    quantity = np.round(rng.uniform(1, 500, rows), 2)
+    rate = np.round(rng.uniform(10, 5000, rows), 2)
+    billed = np.round(quantity * rng.uniform(0.75, 1.25, rows), 2)
+    units = rng.choice(["Nos", "Mtr", "Sqm", "Cum", "Each"], rows)
+    descriptions = [f"Item {i + 1}: supply and fixing of material as per specification" for i in range(rows)]
+
+    header = _header_rows(21, 7, "WORK ORDER")
+    header[19][0], header[19][4] = "TENDER PREMIUM %", 4.5
+    header[20] = ["Item", "Description", "Unit", "Quantity", "Rate", "Amount", "Remark"]
+    work_order = pd.DataFrame(header + [
+        [serials[i], descriptions[i], units[i], quantity[i], rate[i], None, None] for i in range(rows)
+    ], dtype=object)
+    bill_quantity = work_order.copy()
+    bill_quantity.iloc[0, 0] = "BILL QUANTITY"
+    bill_quantity.iloc[21:, 3] = billed
+
+    extra_count = max(1, rows // EXTRA_ITEMS_RATIO)
+    extra_rows = _header_rows(6, 6, "EXTRA ITEMS")
+    extra_rows[5] = ["S.No.", "Remark", "Description", "Quantity", "Unit", "Rate"]
+    extra_items = pd.DataFrame(extra_rows + [
+        [i + 1, "", f"Extra item {i + 1}", float(np.round(rng.uniform(1, 50), 2)), "Nos",
+         float(np.round(rng.uniform(10, 2000), 2))]
+        for i in range(extra_count)
+    ], dtype=object)
+    return {"Work Order": work_order, "Bill Quantity": bill_quantity, "Extra Items": extra_items}
+
+def synthetic_workbook(rows: int, directory: str = WORKBOOK_DIR, seed: int = 0) -> str:
+    """Path of the synthetic workbook with rows item rows, writing it if it does not exist yet"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"synthetic_{rows}_{seed}.xlsx")
+    if not os.path.exists(path):
+        partial = os.path.join(directory, f".{os.getpid()}_{os.path.basename(path)}")
+        with pd.ExcelWriter(partial, engine="openpyxl") as writer:
+            for name, sheet in synthetic_sheets(rows, seed).items():
+                sheet.to_excel(writer, sheet_name=name, header=False, index=False)
+        os.replace(partial, path)
+    return path
+
+def _peak_rss_bytes() -> Optional[int]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if platform.system() == "Darwin" else peak * 1024
+
+def _pdf_renderer() -> Optional[PdfRenderer]:
+    try:
+        wkhtmltopdf_configuration()
+    except OSError:
+        return None
+    return PdfRenderer(max_workers=1)
+
+def bill_stages(path: str, user_inputs: Dict[str, Any], renderer: Optional[PdfRenderer]) -> List[Tuple[str, Callable[[Dict[str, Any]], Any]]]:
+    """
+    The stages of one bill, in order. Each takes the results of the stages
+    before it, keyed by stage name.
+    """
+    def run_process_bill(results):
+        sheets = results["excel_read"]
+        streamlit_app.clear_bill_step_memo()
+        return bill_section_data(*process_bill(
+            sheets["Work Order"], sheets["Bill Quantity"], sheets["Extra Items"],
+            user_inputs["premium_percent"], user_inputs["premium_type"], user_inputs["amount_paid_last_bill"],
+            user_inputs["is_first_bill"], dict(user_inputs)
+        ))
+
+    def write_zip(results):
+        members = {output_file_name(f"docx:{name}"): data for name, data in results["docx"].items()}
+        if results["pdf"] is not None:
+            members[output_file_name("pdf")] = results["pdf"]
+        output = io.BytesIO()
+        with zipfile.ZipFile(output, "w", streamlit_app.ZIP_COMPRESSION_METHODS[streamlit_app.ZIP_COMPRESSION]) as zipf:
+            for name, data in members.items():
+                zipf.writestr(name, data)
+        return output.getbuffer().nbytes
+
+    return [
+        ("excel_read", lambda results: read_excel_sheets(path)[0]),
+        ("process_bill", run_process_bill),
+        ("html", lambda results: "".join(streamlit_app.bill_document_chunks(results["process_bill"]))),
+        ("pdf", lambda results: renderer.render_bytes(results["html"]) if renderer else None),
+        ("docx", lambda results: {name: word_doc_bytes(name, results["process_bill"][name]) for name in WORD_SECTIONS}),
+        ("zip", write_zip),
+    ]
+
+def _run_stages(stages, trace_memory: bool) -> Tuple[Dict[str, float], Dict[str, int], Dict[str, Any]]:
+    timings, peaks, results = {}, {}, {}
+    for name, stage in stages:
+        if trace_memory:
+            tracemalloc.reset_peak()
+        started = time.perf_counter()
+        results[name] = stage(results)
+        timings[name] = time.perf_counter() - started
+        if trace_memory:
+            peaks[name] = tracemalloc.get_traced_memory()[1]
+    return timings, peaks, results
+
+def benchmark_workbook(rows: int, repeat: int = 1, memory: bool = True, renderer: Optional[PdfRenderer] = None,
+                       directory: str = WORKBOOK_DIR) -> Dict[str, Any]:
+    """
+    Benchmark one synthetic workbook size.
+
+    Args:
+        rows: Work Order item rows
+        repeat: Timed runs; each stage reports its best
+        memory: Also run once under tracemalloc for per-stage allocation peaks
+        renderer: PDF renderer, or None to skip the pdf stage
+        directory: Where synthetic workbooks are kept
+
+    Returns:
+        Record with rows, per-stage seconds, per-stage peak bytes, peak RSS
+        and output sizes
+    """
+    path = synthetic_workbook(rows, directory)
+    user_inputs = validate_user_inputs(BENCHMARK_INPUTS)
+    stages = bill_stages(path, user_inputs, renderer)
+
+    best = {}
+    for _ in range(repeat):
+        timings, _, results = _run_stages(stages, trace_memory=False)
+        best = {name: min(seconds, best.get(name, seconds)) for name, seconds in timings.items()}
+    if renderer is None:
+        best["pdf"] = None
+
+    peaks = {}
+    if memory:
+        tracemalloc.start()
+        try:
+            _, peaks, _ = _run_stages(stages, trace_memory=True)
+        finally:
+            tracemalloc.stop()
+
+    return {
+        "rows": rows,
+        "seconds": {name: round(seconds, 4) if seconds is not None else None for name, seconds in best.items()},
+        "peak_bytes": peaks,
+        "peak_rss_bytes": _peak_rss_bytes(),
+        "workbook_bytes": os.path.getsize(path),
+        "html_bytes": len(results["html"].encode("utf-8")),
+        "zip_bytes": results["zip"]
+    }
+
+def benchmark_number_words(count: int, repeat: int = 1, seed: int = 0) -> Dict[str, Any]:
+    """
+    Time number_to_words against num2words on random amounts below a
+    hundred crore, and check that they agree.
+
+    Returns:
+        Seconds per run for each converter (best of repeat), and the amounts
+        whose words differ once num2words' commas and hyphens are removed
+
+    Raises:
+        RuntimeError: If num2words is not installed
+    """
+    if num2words is None:
+        raise RuntimeError("num2words is not installed")
+    amounts = np.random.default_rng(seed).integers(0, 10 ** 9, size=count).tolist()
+    converters = {
+        "number_to_words": number_to_words,
+        "num2words": lambda amount: num2words(amount, lang="en_IN").title().replace(",", "").replace("-", " "),
+    }
+    seconds, words = {}, {}
+    for name, convert in converters.items():
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            words[name] = [convert(amount) for amount in amounts]
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        seconds[name] = best
+    mismatches = [amount for amount, ours, theirs in zip(amounts, words["number_to_words"], words["num2words"]) if ours != theirs]
+    return {"count": count, "seconds": seconds, "mismatches": mismatches}
+
+# Imported before the app is timed: every Streamlit page pays for these
+IMPORT_BASELINE = ("streamlit", "pandas", "numpy")
+
+_IMPORT_PROBE = """
+import json, sys, time
+{baseline}
+before = set(sys.modules)
+start = time.perf_counter()
+import {module}
+print(json.dumps({{"seconds": time.perf_counter() - start, "modules": sorted(set(sys.modules) - before)}}))
+"""
+
+def measure_import(module: str = "streamlit_app", repeat: int = 3) -> Dict[str, Any]:
+    """
+    Time a cold import of module in fresh interpreters, after IMPORT_BASELINE.
+
+    Returns:
+        The best time in seconds and the modules the import loaded
+    """
+    code = _IMPORT_PROBE.format(baseline="\n".join(f"import {name}" for name in IMPORT_BASELINE), module=module)
+    best = None
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        if best is None or result["seconds"] < best["seconds"]:
+            best = result
+    return best
+
+def git_commit() -> str:
+    """Short hash of the checked-out commit, with '+' if the tree has changes"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=here, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=here, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + ("+" if dirty else "")
+
+def load_results(path: str) -> List[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def save_results(records: List[Dict[str, Any]], path: str) -> None:
+    with open(path, "a", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+def previous_record(history: List[Dict[str, Any]], record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Latest stored record for the same size from another commit"""
+    for old in reversed(history):
+        if old["rows"] == record["rows"] and old["commit"] != record["commit"]:
+            return old
+    return None
+
+def format_record(record: Dict[str, Any], previous: Optional[Dict[str, Any]] = None) -> str:
+    cells = []
+    for stage in STAGES:
+        seconds = record["seconds"].get(stage)
+        cell = f"{stage} {'-' if seconds is None else f'{seconds:.3f}s'}"
+        old = previous["seconds"].get(stage) if previous else None
+        if seconds is not None and old:
+            cell += f" ({(seconds - old) / old * 100:+.0f}%)"
+        cells.append(cell)
+    peak_rss = record.get("peak_rss_bytes")
+    memory = f", peak RSS {peak_rss / 2 ** 20:.0f} MiB" if peak_rss else ""
+    against = f" vs {previous['commit']}" if previous else ""
+    return f"{record['rows']:>6} rows: " + ", ".join(cells) + memory + against
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark bill generation on synthetic workbooks.")
+    parser.add_argument("--rows", type=int, nargs="+", default=list(DEFAULT_SIZES), help="Work Order item rows per workbook")
+    parser.add_argument("--repeat", type=int, default=1, help="Timed runs per size; the best is kept")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="Skip the tracemalloc run")
+    parser.add_argument("--no-pdf", dest="pdf", action="store_false", help="Skip wkhtmltopdf")
+    parser.add_argument("--results", default=RESULTS_FILE, help="JSON lines file the records are appended to")
+    parser.add_argument("--no-save", dest="save", action="store_false", help="Do not append to the results file")
+    parser.add_argument("--compare", action="store_true", help="Show the change against the latest other commit")
+    parser.add_argument("--workdir", default=WORKBOOK_DIR, help="Directory for the synthetic workbooks")
+    parser.add_argument("--import-time", action="store_true", help="Time a cold import of streamlit_app instead of workbooks")
+    parser.add_argument("--words", type=int, metavar="COUNT",
+                        help="Benchmark number_to_words against num2words on COUNT amounts instead of workbooks")
+    args = parser.parse_args(argv)
+    if args.repeat < 1 or min(args.rows) < 1:
+        parser.error("--rows and --repeat must be at least 1")
+    return args
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    if args.import_time:
+        result = measure_import(repeat=args.repeat)
+        lazy = [name for name in streamlit_app.LAZY_IMPORTS if name in result["modules"]]
+        print(f"import streamlit_app: {result['seconds'] * 1000:.0f} ms, {len(result['modules'])} modules"
+              + (f", loaded {', '.join(lazy)} eagerly" if lazy else ""))
+        return 1 if lazy else 0
+    if args.words:
+        result = benchmark_number_words(args.words, args.repeat)
+        ours, theirs = result["seconds"]["number_to_words"], result["seconds"]["num2words"]
+        print(f"{result['count']} amounts: number_to_words {ours:.3f}s, num2words {theirs:.3f}s "
+              f"({theirs / ours:.1f}x), {len(result['mismatches'])} mismatches")
+        return 1 if result["mismatches"] else 0
+
+    renderer = _pdf_renderer() if args.pdf else None
+    if args.pdf and renderer is None:
+        print("wkhtmltopdf not found; the pdf stage is skipped", file=sys.stderr)
+
+    history = load_results(args.results) if args.compare else []
+    commit, recorded_at = git_commit(), datetime.now().isoformat(timespec="seconds")
+    records = []
+    for rows in args.rows:
+        record = {"commit": commit, "recorded_at": recorded_at, "python": platform.python_version(),
+                  **benchmark_workbook(rows, args.repeat, args.memory, renderer, args.workdir)}
+        records.append(record)
+        print(format_record(record, previous_record(history, record) if args.compare else None))
+    if args.save:
+        save_results(records, args.results)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
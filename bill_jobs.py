@@ -0,0 +1,375 @@
+"""
+Background queue for bill generation.
+
+Submitting a bill stores its workbook and parameters in a SQLite-backed
+queue and returns a job id straight away; worker threads build the ZIP and
+clients poll the job's status and download the result later. The queue
+lives in a directory that several server processes can share:
+
+    jobs.sqlite     one row per job
+    workbooks/      uploaded workbooks, by job id
+    results/        finished ZIPs, by job id
+    cache/          ResultCache for the jobs' parsed sheets, bills and files
+
+The directory holds uploads and unpickled cache entries, so it must belong
+to the user the servers run as and be closed to everyone else (mode 0700);
+JobQueue refuses any other directory.
+
+Jobs run highest priority first, then oldest first, skipping users who
+already have JOB_USER_LIMIT jobs running. A job whose workbook or parameters
+are invalid fails at once. A job that fails while rendering is retried up
+to JOB_MAX_ATTEMPTS times; its parsed workbook, processed bill and every
+file already built come back from the cache, so only the failed stages run
+again.
+"""
+import json
+import logging
+import os
+import platform
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import streamlit_app
+from streamlit_app import ResultCache, private_directory, process_workbook, user_cache_dir, validate_user_inputs, write_bill_archive
+
+logger = logging.getLogger(__name__)
+
+JOB_DIR = os.environ.get("BILL_JOB_DIR") or user_cache_dir("jobs")
+
+# Worker threads per process; wkhtmltopdf runs are still bounded by the shared PdfRenderer
+JOB_WORKERS = int(os.environ.get("BILL_JOB_WORKERS", 2))
+
+# Jobs one user may have running at once
+JOB_USER_LIMIT = int(os.environ.get("BILL_JOB_USER_LIMIT", 1))
+
+# Runs of a job before a rendering failure is final
+JOB_MAX_ATTEMPTS = int(os.environ.get("BILL_JOB_MAX_ATTEMPTS", 3))
+
+# Seconds before a failed job is retried, doubled on each further attempt
+JOB_RETRY_DELAY = float(os.environ.get("BILL_JOB_RETRY_DELAY", 5))
+
+# Seconds an idle worker waits before looking for new jobs again
+JOB_POLL_INTERVAL = float(os.environ.get("BILL_JOB_POLL_INTERVAL", 1))
+
+# Finished jobs, with their workbook and ZIP, are deleted after this many hours
+JOB_RETENTION_HOURS = float(os.environ.get("BILL_JOB_RETENTION_HOURS", 24))
+
+JOB_STATUSES = ("queued", "running", "done", "failed")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    user TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    inputs TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    compression TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    available_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    worker TEXT,
+    error TEXT,
+    timings TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority DESC, created_at);
+"""
+
+# Fields of a job returned by JobQueue.status
+JOB_FIELDS = ("id", "user", "priority", "status", "attempts", "max_attempts", "created_at",
+              "started_at", "finished_at", "error", "timings")
+
+class JobQueue:
+    """
+    SQLite-backed bill queue with a pool of worker threads.
+
+    Claims happen in an immediate transaction, so any number of processes
+    can run workers against the same directory.
+    """
+
+    def __init__(
+        self,
+        directory: str = JOB_DIR,
+        workers: int = JOB_WORKERS,
+        user_limit: int = JOB_USER_LIMIT,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+        renderer: Optional[streamlit_app.PdfRenderer] = None
+    ):
+        self.directory = directory
+        self.workers = workers
+        self.user_limit = user_limit
+        self.max_attempts = max_attempts
+        self.renderer = renderer
+        private_directory(directory)
+        self.cache = ResultCache(os.path.join(directory, "cache"))
+        self._worker_id = f"{platform.node()}:{os.getpid()}"
+        self._threads = []
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        for subdirectory in ("workbooks", "results"):
+            private_directory(os.path.join(directory, subdirectory))
+        with self._connect() as db:
+            db.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # Autocommit: every statement is its own transaction unless BEGIN is issued
+        db = sqlite3.connect(os.path.join(self.directory, "jobs.sqlite"), timeout=30, isolation_level=None)
+        try:
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            yield db
+        finally:
+            db.close()
+
+    def workbook_path(self, job_id: str) -> str:
+        return os.path.join(self.directory, "workbooks", f"{job_id}.xlsx")
+
+    def result_path(self, job_id: str) -> str:
+        return os.path.join(self.directory, "results", f"{job_id}.zip")
+
+    def submit(
+        self,
+        workbook: bytes,
+        inputs: Dict[str, Any],
+        user: str = "",
+        priority: int = 0,
+        mode: str = streamlit_app.PDF_RENDER_MODE,
+        compression: str = streamlit_app.ZIP_COMPRESSION
+    ) -> str:
+        """
+        Queue a bill.
+
+        Args:
+            workbook: Workbook file contents
+            inputs: Raw bill parameters, as accepted by validate_user_inputs
+            user: Who submitted it, for the per-user limit
+            priority: Higher runs first
+            mode: One of PDF_RENDER_MODES
+            compression: One of ZIP_COMPRESSION_METHODS
+
+        Returns:
+            The job id
+
+        Raises:
+            ValueError: If the parameters, mode or compression are invalid
+        """
+        validate_user_inputs(inputs)
+        if mode not in streamlit_app.PDF_RENDER_MODES:
+            raise ValueError(f"PDF mode must be one of: {', '.join(streamlit_app.PDF_RENDER_MODES)}")
+        if compression not in streamlit_app.ZIP_COMPRESSION_METHODS:
+            raise ValueError(f"ZIP compression must be one of: {', '.join(streamlit_app.ZIP_COMPRESSION_METHODS)}")
+
+        job_id = uuid.uuid4().hex
+        with open(self.workbook_path(job_id), "wb") as f:
+            f.write(workbook)
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO jobs (id, user, priority, status, inputs, mode, compression, max_attempts, available_at, created_at)"
+                " VALUES (?, ?, ?, 'queued', ?, ?, ?, ?, ?, ?)",
+                (job_id, user, int(priority), json.dumps(inputs, default=str), mode, compression, self.max_attempts, now, now)
+            )
+        logger.info(f"Queued bill job {job_id} for user '{user}' at priority {priority}")
+        self._wakeup.set()
+        return job_id
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """The job's fields (see JOB_FIELDS), or None if there is no such job"""
+        with self._connect() as db:
+            row = db.execute(f"SELECT {', '.join(JOB_FIELDS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["timings"] = json.loads(job["timings"]) if job["timings"] else {}
+        return job
+
+    def jobs(self, user: str) -> List[Dict[str, Any]]:
+        """Every job of a user, newest first"""
+        with self._connect() as db:
+            ids = [row["id"] for row in db.execute("SELECT id FROM jobs WHERE user = ? ORDER BY created_at DESC", (user,))]
+        return [job for job in map(self.status, ids) if job is not None]
+
+    def retry(self, job_id: str) -> bool:
+        """
+        Queue a failed job again with a fresh set of attempts.
+
+        Returns:
+            False if the job does not exist or has not failed
+        """
+        with self._connect() as db:
+            updated = db.execute(
+                "UPDATE jobs SET status = 'queued', attempts = 0, error = NULL, available_at = ? WHERE id = ? AND status = 'failed'",
+                (time.time(), job_id)
+            ).rowcount
+        if updated:
+            self._wakeup.set()
+        return bool(updated)
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """
+        Mark the next runnable job as running and return it: the highest
+        priority, then oldest, queued job whose user is under the limit.
+        """
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute(
+                    "SELECT * FROM jobs AS job WHERE status = 'queued' AND available_at <= ?"
+                    " AND (SELECT COUNT(*) FROM jobs AS other WHERE other.user = job.user AND other.status = 'running') < ?"
+                    " ORDER BY priority DESC, created_at LIMIT 1",
+                    (time.time(), self.user_limit)
+                ).fetchone()
+                if row is not None:
+                    db.execute(
+                        "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, worker = ? WHERE id = ?",
+                        (time.time(), self._worker_id, row["id"])
+                    )
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        job = dict(row)
+        job["attempts"] += 1
+        return job
+
+    def _finish(self, job_id: str, status: str, error: Optional[str] = None, timings: Optional[Dict[str, float]] = None,
+                available_at: Optional[float] = None) -> None:
+        with self._connect() as db:
+            db.execute(
+                "UPDATE jobs SET status = ?, error = ?, timings = ?, finished_at = ?, available_at = COALESCE(?, available_at)"
+                " WHERE id = ?",
+                (status, error, json.dumps(timings) if timings else None, time.time() if status in ("done", "failed") else None,
+                 available_at, job_id)
+            )
+
+    def run_job(self, job: Dict[str, Any]) -> None:
+        """
+        Build a claimed job's ZIP and record the outcome.
+
+        The workbook is parsed and processed first, through the cache; a
+        failure there is final. Failures while rendering requeue the job
+        until it runs out of attempts.
+        """
+        job_id = job["id"]
+        workbook = self.workbook_path(job_id)
+        try:
+            user_inputs = validate_user_inputs(json.loads(job["inputs"]))
+            process_workbook(workbook, user_inputs, self.cache)
+        except Exception as e:
+            logger.error(f"Bill job {job_id} failed: {str(e)}")
+            self._finish(job_id, "failed", str(e))
+            return
+
+        result_path = self.result_path(job_id)
+        partial = f"{result_path}.{self._worker_id.replace(':', '_')}.tmp"
+        try:
+            with open(partial, "wb") as f:
+                timings = write_bill_archive(workbook, user_inputs, f, job["mode"], self.renderer, self.cache, job["compression"])
+            os.replace(partial, result_path)
+        except Exception as e:
+            if os.path.exists(partial):
+                os.remove(partial)
+            if job["attempts"] < job["max_attempts"]:
+                delay = JOB_RETRY_DELAY * 2 ** (job["attempts"] - 1)
+                logger.warning(f"Bill job {job_id} attempt {job['attempts']} failed, retrying in {delay:.0f}s: {str(e)}")
+                self._finish(job_id, "queued", str(e), available_at=time.time() + delay)
+            else:
+                logger.error(f"Bill job {job_id} failed after {job['attempts']} attempts: {str(e)}")
+                self._finish(job_id, "failed", str(e))
+            return
+        self._finish(job_id, "done", timings={name: round(seconds, 3) for name, seconds in timings.items()})
+        logger.info(f"Bill job {job_id} done in {timings['total']:.2f}s")
+
+    def run_pending(self) -> int:
+        """Run queued jobs on the calling thread until none is runnable; returns how many ran"""
+        count = 0
+        while not self._stop.is_set():
+            job = self.claim()
+            if job is None:
+                break
+            self.run_job(job)
+            count += 1
+        return count
+
+    def _work(self) -> None:
+        while not self._stop.is_set():
+            if not self.run_pending():
+                self._wakeup.wait(JOB_POLL_INTERVAL)
+                self._wakeup.clear()
+
+    def recover(self) -> int:
+        """Queue again the jobs left running by processes on this host that have exited"""
+        host = self._worker_id.rsplit(":", 1)[0]
+        with self._connect() as db:
+            stale = [
+                row["id"] for row in db.execute("SELECT id, worker FROM jobs WHERE status = 'running'")
+                if row["worker"] and row["worker"].rsplit(":", 1)[0] == host and not _process_alive(int(row["worker"].rsplit(":", 1)[1]))
+            ]
+            for job_id in stale:
+                db.execute("UPDATE jobs SET status = 'queued', worker = NULL WHERE id = ? AND status = 'running'", (job_id,))
+        return len(stale)
+
+    def purge(self, older_than_hours: float = JOB_RETENTION_HOURS) -> int:
+        """Delete finished jobs, with their workbooks and ZIPs, older than the retention period"""
+        cutoff = time.time() - older_than_hours * 3600
+        with self._connect() as db:
+            ids = [row["id"] for row in db.execute(
+                "SELECT id FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?", (cutoff,)
+            )]
+            db.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in ids])
+        for job_id in ids:
+            for path in (self.workbook_path(job_id), self.result_path(job_id)):
+                if os.path.exists(path):
+                    os.remove(path)
+        return len(ids)
+
+    def start(self) -> None:
+        """Start the worker threads, after recovering abandoned jobs and purging old ones"""
+        if self._threads:
+            return
+        self.recover()
+        self.purge()
+        self._stop.clear()
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"bill-job-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stop the workers once their current jobs finish"""
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+def get_job_queue() -> JobQueue:
+    """Shared queue for this process, with its workers started on first use"""
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue()
+            _job_queue.start()
+        return _job_queue
@@ -0,0 +1,62 @@
+"""
+Jinja2 setup for the bill section templates in templates/.
+
+Kept apart from streamlit_app so scripts that render the templates can share
+the same environment settings without importing the Streamlit page and its
+module-level setup.
+"""
+import os
+from typing import TYPE_CHECKING, Optional, Union
+
+if TYPE_CHECKING:
+    from jinja2 import Environment
+
+# Template settings: compiled templates are cached on disk so reruns and new
+# worker processes skip parsing; templates are only re-checked for edits in dev mode.
+# Without BILL_TEMPLATE_CACHE_DIR, Jinja2's own per-user cache directory is used
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+TEMPLATE_CACHE_DIR = os.environ.get("BILL_TEMPLATE_CACHE_DIR") or None
+DEV_MODE = os.environ.get("BILL_DEV_MODE", "").lower() in ("1", "true", "yes")
+
+# Template used for each bill section
+SECTION_TEMPLATES = {
+    "First Page": "first_page.html",
+    "Last Page": "last_page.html",
+    "Extra Items": "extra_items.html",
+    "Deviation Statement": "deviation_statement.html",
+    "Note Sheet": "note_sheet.html",
+    "Certificate III": "certificate_iii.html"
+}
+
+def format_percent(value: Union[int, float]) -> str:
+    """Format a percentage value such as 4.5 as '4.50%'"""
+    return f"{value:.2f}%"
+
+def create_template_environment(template_dir: str = TEMPLATE_DIR, cache_dir: Optional[str] = TEMPLATE_CACHE_DIR, auto_reload: bool = DEV_MODE) -> "Environment":
+    """
+    Create the Jinja2 environment used for all bill sections.
+
+    Compiled template bytecode is stored in cache_dir, or in Jinja2's private
+    per-user cache directory when cache_dir is None, and loaded templates are
+    kept in memory; template files are only checked for changes when
+    auto_reload is set.
+    """
+    from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, select_autoescape
+    if cache_dir:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    else:
+        bytecode_cache = FileSystemBytecodeCache()
+    environment = Environment(
+        loader=FileSystemLoader(template_dir),
+        bytecode_cache=bytecode_cache,
+        auto_reload=auto_reload,
+        autoescape=select_autoescape(["html"])
+    )
+    environment.filters["format_percent"] = format_percent
+    return environment
+
+def warm_templates(environment: "Environment") -> None:
+    """Compile every section template up front so the first bill is not slowed by parsing"""
+    for template_name in SECTION_TEMPLATES.values():
+        environment.get_template(template_name)
@@ -14,7 +14,7 @@ import tempfile
 import pdfkit
 from PyPDF2 import PdfMerger
 import base64
-from jinja2 import Environment, FileSystemLoader
+from bill_templates import create_template_environment, warm_templates
 from pypdf import PdfReader, PdfWriter
 import num2words
 import platform
@@ -31,8 +31,9 @@ if platform.system() == "Windows":
 else:
     config = pdfkit.configuration()
 
-# Set up Jinja2 environment
-env = Environment(loader=FileSystemLoader("templates"), cache_size=0)
+# Set up Jinja2 environment (shared settings: on-disk bytecode cache, reload only in dev mode)
+env = create_template_environment()
+warm_templates(env)
 
 # Helper functions
 def number_to_words(number):
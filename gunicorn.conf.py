@@ -0,0 +1,20 @@
+"""
+gunicorn settings for app:app, picked up from the working directory.
+
+Bills spend most of their time in wkhtmltopdf and python-docx, so each worker
+process serves several requests on threads that share its warm templates,
+PDF renderer slots, process pool and result cache. The app is loaded before
+forking so pandas and the templates are imported once.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get("WEB_CONCURRENCY", max(2, multiprocessing.cpu_count())))
+worker_class = "gthread"
+threads = int(os.environ.get("BILL_WEB_THREADS", 4))
+# Large workbooks can take minutes to render
+timeout = int(os.environ.get("BILL_WEB_TIMEOUT", 300))
+graceful_timeout = 30
+preload_app = True
+accesslog = "-"
@@ -1,47 +1,88 @@
 import streamlit as st
+from streamlit import runtime
 import pandas as pd
-import pdfkit
-from docx import Document
-from docx.shared import Pt, Inches
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from num2words import num2words
+import numpy as np
 import os
-import shutil
 from datetime import datetime, date
 import zipfile
+from xml.sax.saxutils import escape as xml_escape
 import tempfile
-from PyPDF2 import PdfMerger
+import threading
+import queue
+import time
 import concurrent.futures
-from functools import lru_cache, partial
-from typing import Dict, List, Tuple, Union, Any, Callable
+import multiprocessing
+import pickle
+import copy
+import hashlib
+import io
+import json
+import contextvars
+import functools
+import cProfile
+import pstats
+import marshal
+import linecache
+import tracemalloc
+from functools import partial
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from typing import TYPE_CHECKING, Dict, List, Tuple, Union, Any, BinaryIO, Callable, Iterable, Iterator, Optional, Sequence
 import logging
 import traceback
 import platform
-from jinja2 import Environment, FileSystemLoader
-from pypdf import PdfReader, PdfWriter
-import platform
-import traceback
-from lxml import etree
+import re
+import sys
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+import uuid
 
-# Temporary directory
-TEMP_DIR = tempfile.mkdtemp()
+from bill_templates import SECTION_TEMPLATES, TEMPLATE_DIR, create_template_environment, format_percent, warm_templates
 
-# Configure wkhtmltopdf
-if platform.system() == "Windows":
-    wkhtmltopdf_path = r"C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe"
-    config = pdfkit.configuration(wkhtmltopdf=wkhtmltopdf_path)
-else:
-    config = pdfkit.configuration()
+# Document libraries imported where they are used, so the page loads without
+# them and they are paid for on the first bill
+LAZY_IMPORTS = ("jinja2", "docx", "pdfkit", "PyPDF2")
+if TYPE_CHECKING:
+    from jinja2 import Environment
 
-# Set up Jinja2 environment
-env = Environment(loader=FileSystemLoader("templates"), cache_size=0)
+def shared_resource(func: Callable) -> Callable:
+    """
+    Decorator for one-time setup shared by every session and rerun.
 
-# Helper functions
-def number_to_words(number):
-    try:
-        return num2words(number, lang='en_IN')
-    except:
-        return str(number)
+    Streamlit executes this script again on each widget interaction, so
+    module-level objects would be rebuilt every time. Under Streamlit the
+    result is held by st.cache_resource; elsewhere (the API, batch runs,
+    tests) it is created once per process. The wrapper's clear() drops it.
+    """
+    results = {}
+    cached = []
+    lock = threading.Lock()
+
+    @functools.wraps(func)
+    def get(*args):
+        with lock:
+            if runtime.exists():
+                # Wrapped on first use: st.cache_resource reads the function's source
+                if not cached:
+                    cached.append(st.cache_resource(show_spinner=False)(func))
+            elif args not in results:
+                results[args] = func(*args)
+        return cached[0](*args) if cached else results[args]
+
+    def clear():
+        with lock:
+            if cached:
+                cached[0].clear()
+            results.clear()
+
+    get.clear = clear
+    return get
+
+@shared_resource
+def template_environment() -> "Environment":
+    """The section templates' environment, created and warmed on first use"""
+    environment = create_template_environment()
+    warm_templates(environment)
+    return environment
 
 # Configure logging
 logging.basicConfig(
@@ -54,12 +95,265 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Create a temporary directory
-TEMP_DIR = tempfile.mkdtemp()
+# Stage metrics are logged as one JSON object per line, to the log file and console
+metrics_logger = logging.getLogger("bill_metrics")
+
+# Show the timing breakdown panel after generating a bill by default
+SHOW_TIMINGS = os.environ.get("BILL_SHOW_TIMINGS", "").lower() in ("1", "true", "yes")
+
+try:
+    import resource
+except ImportError:  # Windows: peak RSS is not reported
+    resource = None
+
+_stage_metrics = contextvars.ContextVar("stage_metrics", default=None)
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident memory of this process so far, in MiB"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and KiB elsewhere
+    return round(peak / (1024 * 1024 if platform.system() == "Darwin" else 1024), 1)
+
+def record_stage_metrics(metrics: Dict[str, Any]) -> None:
+    """Log a stage's metrics and add them to the enclosing collect_stage_metrics, if any"""
+    metrics_logger.info(json.dumps(metrics))
+    records = _stage_metrics.get()
+    if records is not None:
+        records.append(metrics)
+
+@contextmanager
+def collect_stage_metrics() -> Iterator[List[Dict[str, Any]]]:
+    """
+    Collect the metrics of every stage recorded in this context, e.g. to show
+    a timing breakdown after generating a bill.
+
+    Yields:
+        List that receives each stage's metrics as it finishes
+    """
+    records = []
+    token = _stage_metrics.set(records)
+    try:
+        yield records
+    finally:
+        _stage_metrics.reset(token)
+
+def _measure(func: Callable, args: Tuple[Any, ...], kwargs: Dict[str, Any], stage: str) -> Tuple[Any, Dict[str, Any]]:
+    # CPU time is the calling thread's, so stages running side by side are
+    # not charged for each other; peak RSS is that of the process the stage ran in
+    wall, cpu = time.perf_counter(), time.thread_time()
+    status = "failed"
+    try:
+        result = func(*args, **kwargs)
+        status = "ok"
+    finally:
+        metrics = {
+            "stage": stage,
+            "status": status,
+            "wall_s": round(time.perf_counter() - wall, 4),
+            "cpu_s": round(time.thread_time() - cpu, 4),
+            "peak_rss_mb": peak_rss_mb(),
+            "pid": os.getpid()
+        }
+        if status != "ok":
+            record_stage_metrics(metrics)
+    return result, metrics
+
+def stage_metrics_frame(records: List[Dict[str, Any]]) -> pd.DataFrame:
+    """
+    Timing breakdown of collected stage metrics: one row per stage in the
+    order stages first finished, with calls, total wall and CPU seconds and
+    the highest peak RSS seen.
+    """
+    columns = ["stage", "calls", "wall_s", "cpu_s", "peak_rss_mb"]
+    if not records:
+        return pd.DataFrame(columns=columns)
+    frame = pd.DataFrame(records)
+    if "peak_rss_mb" not in frame:
+        frame["peak_rss_mb"] = None
+    breakdown = frame.groupby("stage", sort=False).agg(
+        calls=("stage", "size"), wall_s=("wall_s", "sum"), cpu_s=("cpu_s", "sum"), peak_rss_mb=("peak_rss_mb", "max")
+    ).reset_index()
+    return breakdown[columns]
+
+def measured_chunks(stage: str, chunks: Iterable[str]) -> Iterator[str]:
+    """
+    Yield chunks while recording the time spent producing them as one
+    stage's metrics, logged once the chunks run out. Used for HTML that is
+    rendered lazily inside whichever stage consumes it.
+    """
+    iterator = iter(chunks)
+    wall = cpu = 0.0
+    status = "failed"
+    try:
+        while True:
+            started, cpu_started = time.perf_counter(), time.thread_time()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                wall += time.perf_counter() - started
+                cpu += time.thread_time() - cpu_started
+            yield chunk
+        status = "ok"
+    finally:
+        record_stage_metrics({
+            "stage": stage,
+            "status": status,
+            "wall_s": round(wall, 4),
+            "cpu_s": round(cpu, 4),
+            "peak_rss_mb": peak_rss_mb(),
+            "pid": os.getpid()
+        })
 
-# Set the path to wkhtmltopdf
-path_wkhtmltopdf = r'C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe' # raw string is important here.
-config = pdfkit.configuration(wkhtmltopdf=path_wkhtmltopdf)
+def instrumented(stage: Optional[str] = None) -> Callable[[Callable], Callable]:
+    """Decorator recording wall time, CPU time and peak RSS of every call, under stage or the function name"""
+    def decorate(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            result, metrics = _measure(func, args, kwargs, stage or func.__name__)
+            record_stage_metrics(metrics)
+            return result
+        return wrapper
+    return decorate
+
+# Profiling a bill run: enabled per run with BILL_PROFILE=1 (read on every run,
+# so no restart is needed) or the ?profile=1 query parameter in the app
+PROFILE_TOP_N = int(os.environ.get("BILL_PROFILE_TOP", 25))
+
+_active_profile = contextvars.ContextVar("active_profile", default=None)
+
+# Profiled runs in progress, so tracemalloc is stopped only when the last one ends
+_tracing_lock = threading.Lock()
+_tracing_runs = 0
+_tracing_started = False
+
+def profiling_requested() -> bool:
+    return os.environ.get("BILL_PROFILE", "").lower() in ("1", "true", "yes")
+
+def _profiler_active() -> bool:
+    # From Python 3.12 cProfile hooks sys.monitoring, which covers every thread
+    # and takes one profiler at a time; before that it hooks one thread
+    monitoring = getattr(sys, "monitoring", None)
+    if monitoring is not None:
+        return monitoring.get_tool(monitoring.PROFILER_ID) is not None
+    return sys.getprofile() is not None
+
+def _start_tracing() -> None:
+    global _tracing_runs, _tracing_started
+    with _tracing_lock:
+        if _tracing_runs == 0:
+            _tracing_started = not tracemalloc.is_tracing()
+            if _tracing_started:
+                tracemalloc.start()
+        _tracing_runs += 1
+
+def _stop_tracing() -> None:
+    global _tracing_runs
+    with _tracing_lock:
+        _tracing_runs -= 1
+        if _tracing_runs == 0 and _tracing_started:
+            tracemalloc.stop()
+
+class BillProfile:
+    """
+    cProfile and tracemalloc capture of one bill run.
+
+    Before Python 3.12 cProfile only sees the thread it is enabled in, so
+    run_pipeline runs each stage of a profiled run through run() on its own
+    profiler; the profiles are merged when the .prof data is written. From
+    3.12 one profiler sees every thread and no second one can be enabled, so
+    run() and profile_bill leave it to the profiler already running.
+    """
+
+    def __init__(self, top_n: int = PROFILE_TOP_N):
+        self.top_n = top_n
+        self.snapshot = None
+        self._profiles = []
+        self._lock = threading.Lock()
+
+    def _profiler(self) -> cProfile.Profile:
+        profiler = cProfile.Profile()
+        with self._lock:
+            self._profiles.append(profiler)
+        return profiler
+
+    def run(self, func: Callable, *args: Any, **kwargs: Any) -> Any:
+        """Call func under a profiler of its own, for use from another thread, unless one is already active"""
+        if _profiler_active():
+            return func(*args, **kwargs)
+        return self._profiler().runcall(func, *args, **kwargs)
+
+    def prof_bytes(self) -> bytes:
+        """The merged profiles in the .prof format read by pstats and snakeviz"""
+        with self._lock:
+            stats = pstats.Stats(*self._profiles)
+        return marshal.dumps(stats.stats)
+
+    def files(self, name: str) -> Dict[str, bytes]:
+        """Output files for a run saved under name: name.prof and name.allocations.txt"""
+        return {f"{name}.prof": self.prof_bytes(), f"{name}.allocations.txt": self.allocations_text().encode("utf-8")}
+
+    def allocations_text(self) -> str:
+        """The top_n source lines by memory still allocated when the run ended"""
+        if self.snapshot is None:
+            return ""
+        top = self.snapshot.statistics("lineno")
+        lines = [f"Top {min(self.top_n, len(top))} of {len(top)} allocation sites, "
+                 f"{sum(stat.size for stat in top) / 1024:.1f} KiB in total"]
+        for rank, stat in enumerate(top[:self.top_n], 1):
+            frame = stat.traceback[0]
+            lines.append(f"#{rank}: {frame.filename}:{frame.lineno}: {stat.size / 1024:.1f} KiB in {stat.count} blocks")
+            source = linecache.getline(frame.filename, frame.lineno).strip()
+            if source:
+                lines.append(f"    {source}")
+        return "\n".join(lines) + "\n"
+
+@contextmanager
+def profile_bill(top_n: int = PROFILE_TOP_N) -> Iterator[BillProfile]:
+    """
+    Profile everything run in this context, including pipeline stages.
+
+    Memoized bill steps are rebuilt rather than reused, so the capture
+    covers the whole build. Several runs may be profiled at once: tracemalloc
+    keeps tracing until the last of them ends, and where a profiler is
+    already active (on Python 3.12+, another run's) it is not enabled twice.
+
+    Yields:
+        BillProfile, complete once the context exits
+    """
+    profile = BillProfile(top_n)
+    token = _active_profile.set(profile)
+    _start_tracing()
+    profiler = None
+    if _profiler_active():
+        logger.info("A profiler is already active; this run's calls are captured by it")
+    else:
+        profiler = profile._profiler()
+        profiler.enable()
+    try:
+        yield profile
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        try:
+            profile.snapshot = tracemalloc.take_snapshot()
+        finally:
+            _stop_tracing()
+            _active_profile.reset(token)
+
+# Upper bound on wkhtmltopdf processes running at once in this server process
+MAX_PDF_RENDERERS = int(os.environ.get("BILL_PDF_RENDERERS", max(1, (os.cpu_count() or 2) // 2)))
+
+# Seconds a render may wait for a free renderer before failing (unset: wait indefinitely)
+PDF_QUEUE_TIMEOUT = float(os.environ["BILL_PDF_QUEUE_TIMEOUT"]) if os.environ.get("BILL_PDF_QUEUE_TIMEOUT") else None
+
+# Bills are built in memory; HTML documents and archives larger than this
+# are spilled to temporary files in SPOOL_DIR (unset: the system temp dir)
+IN_MEMORY_MAX_BYTES = int(float(os.environ.get("BILL_IN_MEMORY_MAX_MB", 32)) * 1024 * 1024)
+SPOOL_DIR = os.environ.get("BILL_SPOOL_DIR") or None
 
 class BillGenerationError(Exception):
     """Custom exception for bill generation errors"""
@@ -79,65 +373,151 @@ def handle_error(error: Exception, context: str = "") -> None:
     st.error(error_msg)
     raise BillGenerationError(error_msg)
 
-def cleanup_temp_files() -> None:
-    """Clean up temporary files and directories"""
-    try:
-        if os.path.exists(TEMP_DIR):
-            shutil.rmtree(TEMP_DIR)
-            logger.info("Temporary files cleaned up successfully")
-    except Exception as e:
-        handle_error(e, "cleanup_temp_files")
+# Sheets every bill workbook must provide, with their minimum column counts
+REQUIRED_SHEETS = {"Work Order": 7, "Bill Quantity": 4, "Extra Items": 6}
 
-def validate_excel_sheets(xls: pd.ExcelFile) -> None:
+@instrumented()
+def validate_excel_sheets(sheets: Dict[str, pd.DataFrame]) -> None:
     """
-    Validate the Excel file structure.
+    Validate the structure of the parsed workbook sheets.
     
     Args:
-        xls: The Excel file to validate
+        sheets: Parsed sheets keyed by sheet name, as returned by read_excel_sheets
         
     Raises:
-        ValueError: If the Excel file is invalid
+        BillGenerationError: If a sheet is missing, empty or too narrow
     """
     try:
-        required_sheets = ["Work Order", "Bill Quantity", "Extra Items"]
-        missing_sheets = [sheet for sheet in required_sheets if sheet not in xls.sheet_names]
+        missing_sheets = [sheet for sheet in REQUIRED_SHEETS if sheet not in sheets]
         if missing_sheets:
             raise ValueError(f"Missing required sheets: {', '.join(missing_sheets)}")
         
         # Validate sheet structure
-        for sheet_name in required_sheets:
-            df = pd.read_excel(xls, sheet_name, header=None)
+        for sheet_name, min_columns in REQUIRED_SHEETS.items():
+            df = sheets[sheet_name]
             if df.empty:
                 raise ValueError(f"Sheet '{sheet_name}' is empty")
-            if sheet_name == "Work Order" and df.shape[1] < 7:
-                raise ValueError("Work Order sheet must have at least 7 columns")
-            if sheet_name == "Bill Quantity" and df.shape[1] < 4:
-                raise ValueError("Bill Quantity sheet must have at least 4 columns")
-            if sheet_name == "Extra Items" and df.shape[1] < 6:
-                raise ValueError("Extra Items sheet must have at least 6 columns")
+            if df.shape[1] < min_columns:
+                raise ValueError(f"{sheet_name} sheet must have at least {min_columns} columns")
                 
         logger.info("Excel file validation successful")
     except Exception as e:
         handle_error(e, "validate_excel_sheets")
 
-@lru_cache(maxsize=128)
-def number_to_words(number: Union[int, float]) -> str:
+@instrumented()
+def read_excel_sheets(source: Union[pd.ExcelFile, str, Any]) -> Tuple[Dict[str, pd.DataFrame], Dict[str, float]]:
     """
-    Convert a number to words in Indian number system.
-    Cached for better performance.
+    Parse each required sheet of a bill workbook exactly once and validate it.
+
+    pandas opens the workbook with openpyxl in read-only mode, so rows are
+    streamed rather than loaded as a full object model.
     
     Args:
-        number: The number to convert to words
+        source: An open pd.ExcelFile, or a path / file-like object to open
         
     Returns:
-        str: The number in words (Indian system)
+        Tuple of (sheets keyed by name, parse time in seconds per sheet)
         
+    Raises:
+        BillGenerationError: If the workbook fails validation
+    """
+    if not isinstance(source, pd.ExcelFile):
+        with pd.ExcelFile(source) as xls:
+            return _parse_excel_sheets(xls)
+    return _parse_excel_sheets(source)
+
+def _parse_excel_sheets(source: pd.ExcelFile) -> Tuple[Dict[str, pd.DataFrame], Dict[str, float]]:
+    sheets = {}
+    parse_times = {}
+    for sheet_name in REQUIRED_SHEETS:
+        if sheet_name not in source.sheet_names:
+            continue
+        started = time.perf_counter()
+        sheets[sheet_name] = source.parse(sheet_name, header=None)
+        parse_times[sheet_name] = time.perf_counter() - started
+        logger.info(f"Parsed sheet '{sheet_name}' in {parse_times[sheet_name]:.3f}s")
+
+    validate_excel_sheets(sheets)
+    return sheets, parse_times
+
+_UNITS = ("Zero", "One", "Two", "Three", "Four", "Five", "Six", "Seven", "Eight", "Nine", "Ten", "Eleven", "Twelve",
+          "Thirteen", "Fourteen", "Fifteen", "Sixteen", "Seventeen", "Eighteen", "Nineteen")
+_TENS = ("", "", "Twenty", "Thirty", "Forty", "Fifty", "Sixty", "Seventy", "Eighty", "Ninety")
+
+# Words for 0-99 and 0-999, built once; "And" joins the hundreds to the rest
+_BELOW_HUNDRED = tuple(
+    _UNITS[n] if n < 20 else _TENS[n // 10] + (f" {_UNITS[n % 10]}" if n % 10 else "") for n in range(100)
+)
+_BELOW_THOUSAND = tuple(
+    _BELOW_HUNDRED[n] if n < 100
+    else f"{_UNITS[n // 100]} Hundred" + (f" And {_BELOW_HUNDRED[n % 100]}" if n % 100 else "")
+    for n in range(1000)
+)
+
+# Indian place groups below a crore: (divisor, name), largest first
+_INDIAN_GROUPS = ((100000, "Lakh"), (1000, "Thousand"))
+
+def _indian_words(number: int) -> str:
+    parts = []
+    crores, number = divmod(number, 10000000)
+    if crores:
+        # Crores are counted in words themselves: "One Hundred Crore", "Ten Thousand Crore"
+        parts.append(f"{_indian_words(crores)} Crore")
+    for divisor, name in _INDIAN_GROUPS:
+        count, number = divmod(number, divisor)
+        if count:
+            parts.append(f"{_BELOW_HUNDRED[count]} {name}")
+    if number:
+        # "One Lakh And Five", as num2words writes a remainder below a hundred
+        parts.append(f"And {_BELOW_HUNDRED[number]}" if parts and number < 100 else _BELOW_THOUSAND[number])
+    return " ".join(parts)
+
+def number_to_words(number: Union[int, float]) -> str:
+    """
+    Convert a number to words in the Indian numbering system (lakh, crore).
+
+    Any fraction is dropped. The words are those of num2words' en_IN
+    cardinals, title cased, without commas or hyphens.
+
+    Args:
+        number: The number to convert to words
+
+    Returns:
+        str: The number in words, e.g. "One Lakh Twenty Three Thousand Four Hundred And Fifty Six"
+
     Raises:
         ValueError: If the number is negative
     """
     if number < 0:
         raise ValueError("Number must be non-negative")
-    return num2words(int(number), lang='en_IN').title()
+    number = int(number)
+    return _indian_words(number) if number else "Zero"
+
+def rupees_to_words(amount: Union[int, float, str, Decimal]) -> str:
+    """
+    Write an amount of money in words, rounding to the nearest paisa.
+
+    Args:
+        amount: Amount in rupees
+
+    Returns:
+        str: e.g. "Rupees One Thousand Two Hundred And Five And Paise Fifty Only",
+        "Rupees One Thousand Two Hundred And Five Only" or "Paise Fifty Only"
+
+    Raises:
+        ValueError: If the amount is negative or not a number
+    """
+    try:
+        paise = int(Decimal(str(amount)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP) * 100)
+    except (InvalidOperation, ValueError):
+        raise ValueError(f"Amount is not a number: {amount!r}")
+    if paise < 0:
+        raise ValueError("Amount must be non-negative")
+    rupees, paise = divmod(paise, 100)
+    parts = [f"Rupees {number_to_words(rupees)}"] if rupees or not paise else []
+    if paise:
+        parts.append(f"Paise {_BELOW_HUNDRED[paise]}")
+    return f"{' And '.join(parts)} Only"
 
 def process_bill_items_parallel(items: List[Dict[str, Any]], process_func: Callable) -> List[Dict[str, Any]]:
     """
@@ -154,6 +534,666 @@ def process_bill_items_parallel(items: List[Dict[str, Any]], process_func: Calla
         futures = [executor.submit(process_func, item) for item in items]
         return [future.result() for future in concurrent.futures.as_completed(futures)]
 
+class ItemColumns:
+    """
+    Struct-of-arrays store for bill item rows.
+
+    Each field is one column: a NumPy array for numbers and an object array
+    of the sheet's strings for text, so a row costs a few array slots rather
+    than a dict. A row only becomes a dict when it is read, i.e. when a
+    template, the Word writer or the preview iterates over the items, and
+    view() shares the columns instead of copying them.
+
+    Args:
+        columns: One array (or list) per field in FIELDS, all the same length
+        start: First row of the columns this store covers
+        stop: End of the rows it covers; defaults to the columns' length
+    """
+
+    FIELDS: Tuple[str, ...] = ()
+
+    def __init__(self, columns: Dict[str, Sequence[Any]], start: int = 0, stop: Optional[int] = None):
+        self.columns = columns
+        self.start = start
+        self.stop = len(columns[self.FIELDS[0]]) if stop is None else stop
+
+    def __len__(self) -> int:
+        return self.stop - self.start
+
+    def column(self, field: str) -> Sequence[Any]:
+        """The field's values for this store's rows; a view for NumPy columns"""
+        return self.columns[field][self.start:self.stop]
+
+    def _row(self, index: int) -> Dict[str, Any]:
+        index += self.start
+        row = {}
+        for field in self.FIELDS:
+            value = self.columns[field][index]
+            # NumPy scalars become Python numbers, so templates and str() print them as before
+            row[field] = value.item() if isinstance(value, np.generic) else value
+        return row
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._row(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("item index out of range")
+        return self._row(index)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for index in range(len(self)):
+            yield self._row(index)
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, ItemColumns):
+            return NotImplemented
+        return type(self) is type(other) and list(self) == list(other)
+
+    __hash__ = None
+
+class LineItems(ItemColumns):
+    """
+    Columnar store for bill line items: the First Page and the Extra Items.
+
+    Quantities, rates and amounts are held as parallel columns so totals are
+    computed in bulk.
+    """
+
+    FIELDS = ("serial_no", "description", "unit", "quantity", "rate", "remark", "amount", "is_divider")
+
+    def __init__(self, columns: Dict[str, Sequence[Any]], total: int = 0, start: int = 0, stop: Optional[int] = None):
+        super().__init__(columns, start, stop)
+        self.total = total
+
+    @classmethod
+    def empty(cls) -> "LineItems":
+        return cls({
+            "serial_no": np.empty(0, dtype=object), "description": np.empty(0, dtype=object),
+            "unit": np.empty(0, dtype=object), "quantity": np.empty(0), "rate": np.empty(0),
+            "remark": np.empty(0, dtype=object), "amount": np.empty(0, dtype=np.int64),
+            "is_divider": np.empty(0, dtype=bool)
+        })
+
+    @classmethod
+    def divider(cls, description: str) -> "LineItems":
+        """Single bold, underlined heading row such as 'Extra Items (With Premium)'"""
+        return cls({
+            "serial_no": np.array([""], dtype=object), "description": np.array([description], dtype=object),
+            "unit": np.array([""], dtype=object), "quantity": np.zeros(1), "rate": np.zeros(1),
+            "remark": np.array([""], dtype=object), "amount": np.zeros(1, dtype=np.int64),
+            "is_divider": np.ones(1, dtype=bool)
+        })
+
+    @classmethod
+    def concat(cls, *parts: "LineItems") -> "LineItems":
+        # Text columns copy pointers only; the strings are shared with the parts
+        columns = {field: np.concatenate([np.asarray(part.column(field)) for part in parts]) for field in cls.FIELDS}
+        return cls(columns, sum(part.total for part in parts))
+
+    def view(self, start: int, stop: int, total: int) -> "LineItems":
+        """Rows start..stop-1 of these items, sharing their columns"""
+        return LineItems(self.columns, total, self.start + start, self.start + stop)
+
+    def _row(self, index: int) -> Dict[str, Any]:
+        item = super()._row(index)
+        if item["is_divider"]:
+            item["bold"] = True
+            item["underline"] = True
+        return item
+
+class DeviationItems(ItemColumns):
+    """
+    Columnar store for Deviation Statement rows. The serial number,
+    description and unit columns hold the same string objects as the First
+    Page's Work Order items.
+    """
+
+    FIELDS = ("serial_no", "description", "unit", "qty_wo", "rate", "amt_wo", "qty_bill", "amt_bill",
+              "excess_qty", "excess_amt", "saving_qty", "saving_amt")
+
+def _sheet_column(sheet: pd.DataFrame, start: int, stop: int, col: int) -> pd.Series:
+    """
+    Positional slice of one sheet column covering rows start..stop-1.
+
+    Rows and columns the sheet does not have are returned as blanks, matching
+    the row-by-row loop which treated a short Bill Quantity sheet as zero quantity.
+    """
+    length = max(stop - start, 0)
+    if sheet.shape[0] <= start or sheet.shape[1] <= col or length == 0:
+        return pd.Series([np.nan] * length, dtype=object)
+    column = sheet.iloc[start:stop, col].reset_index(drop=True)
+    return column.reindex(range(length))
+
+def _coerce_numeric(values: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Convert a quantity or rate column to floats in one pass.
+
+    Blank cells become 0 and text is parsed after stripping commas and spaces,
+    as the per-row loop did. Only cells pandas cannot convert directly are
+    revisited in Python.
+
+    Returns:
+        Tuple of (float values, mask of text cells that could not be parsed)
+    """
+    # Copied: for a float column to_numpy() is a view of the caller's cells
+    result = pd.to_numeric(values, errors="coerce").to_numpy(dtype=float, na_value=np.nan, copy=True)
+    present = values.notna().to_numpy()
+    invalid = np.zeros(len(values), dtype=bool)
+    for pos in np.flatnonzero(np.isnan(result) & present):
+        raw = values.iat[pos]
+        if isinstance(raw, str):
+            try:
+                result[pos] = float(raw.strip().replace(',', '').replace(' ', ''))
+            except ValueError:
+                invalid[pos] = True
+        elif isinstance(raw, (int, float, np.number)):
+            result[pos] = float(raw)
+        else:
+            result[pos] = 0.0
+    result[~present] = 0.0
+    return result, invalid
+
+def _round_like_python(values: np.ndarray, digits: int) -> np.ndarray:
+    """
+    np.round(values, digits), except that values near a rounding tie are
+    rounded with Python's round(), which rounds the exact binary value
+    (round(2.675, 2) is 2.67 where numpy gives 2.68).
+    """
+    rounded = np.round(values, digits)
+    scaled = values * 10.0 ** digits
+    near_tie = np.abs(np.abs(scaled - np.trunc(scaled)) - 0.5) < 1e-6
+    for pos in np.flatnonzero(near_tie):
+        rounded[pos] = round(float(values[pos]), digits)
+    return rounded
+
+def _text_column(values: pd.Series) -> np.ndarray:
+    """Cell values as strings, with blank cells as ''"""
+    return values.astype(object).where(values.notna(), "").astype(str).to_numpy(dtype=object)
+
+def work_order_text(ws_wo: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """
+    Serial number, description, unit and remark of Work Order rows 22
+    onwards as strings, converted once per workbook so the First Page and
+    the Deviation Statement share the same string objects.
+    """
+    last_row = ws_wo.shape[0]
+    return {field: _text_column(_sheet_column(ws_wo, 21, last_row, col))
+            for field, col in (("serial_no", 0), ("description", 1), ("unit", 2), ("remark", 6))}
+
+def _build_line_items(
+    qty: pd.Series,
+    rate: pd.Series,
+    text: Dict[str, np.ndarray],
+    first_row: int,
+    qty_sheet: str,
+    rate_sheet: str
+) -> LineItems:
+    """
+    Compute quantities, rates and amounts for a block of sheet rows at once.
+
+    Rows with unparseable quantity or rate text are skipped with a warning,
+    and amounts are rounded half-to-even exactly like Python's round().
+
+    Args:
+        qty: Raw quantity cells
+        rate: Raw rate cells
+        text: serial_no, description, unit and remark as strings (see _text_column)
+        first_row: Zero-based sheet row of the first cell, used in warnings
+        qty_sheet: Sheet name reported for invalid quantities
+        rate_sheet: Sheet name reported for invalid rates
+    """
+    quantity, bad_qty = _coerce_numeric(qty)
+    rate_values, bad_rate = _coerce_numeric(rate)
+    skipped = bad_qty | bad_rate
+    for pos in np.flatnonzero(skipped):
+        if bad_qty[pos]:
+            bill_warning(f"Skipping invalid quantity at {qty_sheet} row {first_row + pos + 1}: '{qty.iat[pos]}'")
+        else:
+            bill_warning(f"Skipping invalid rate at {rate_sheet} row {first_row + pos + 1}: '{rate.iat[pos]}'")
+
+    keep = ~skipped
+    quantity = quantity[keep]
+    rate_values = rate_values[keep]
+    amount = np.where((quantity != 0) & (rate_values != 0), np.rint(quantity * rate_values), 0).astype(np.int64)
+
+    columns = {field: values[keep] for field, values in text.items()}
+    columns["quantity"] = quantity
+    columns["rate"] = rate_values
+    columns["amount"] = amount
+    columns["is_divider"] = np.zeros(len(amount), dtype=bool)
+    return LineItems(columns, int(amount.sum()))
+
+# Bill steps kept by memoized_bill_step, least recently used dropped first
+BILL_STEP_MEMO_SIZE = 64
+
+@shared_resource
+def _bill_step_state() -> Tuple[OrderedDict, threading.Lock]:
+    return OrderedDict(), threading.Lock()
+
+_bill_step_memo, _bill_step_lock = _bill_step_state()
+
+# Warnings shown while the current memoized bill step runs
+_step_warnings = contextvars.ContextVar("step_warnings", default=None)
+
+def bill_warning(message: str) -> None:
+    """
+    Show a warning about the workbook. Warnings raised inside a memoized
+    bill step are stored with its result and shown again when it is reused.
+    """
+    recorded = _step_warnings.get()
+    if recorded is not None:
+        recorded.append(message)
+    st.warning(message)
+
+def clear_bill_step_memo() -> None:
+    """Forget every memoized bill step, so the next bill is built from scratch"""
+    with _bill_step_lock:
+        _bill_step_memo.clear()
+
+def _shared_parts(value: Any, shared: Dict[int, Any]) -> None:
+    # Arrays and frames of a memoized result are shared by every caller
+    # instead of copied; arrays are made read-only so none can change them
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+        shared[id(value)] = value
+    elif isinstance(value, (pd.Series, pd.DataFrame)):
+        shared[id(value)] = value
+    elif isinstance(value, dict):
+        for item in value.values():
+            _shared_parts(item, shared)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _shared_parts(item, shared)
+    elif isinstance(value, (ItemColumns, QuantityIndex)):
+        _shared_parts(vars(value), shared)
+
+def frame_digest(frame: Optional[pd.DataFrame]) -> Optional[str]:
+    """Content hash of a sheet, used to memoize the steps built from it"""
+    if not isinstance(frame, pd.DataFrame):
+        return None
+    digest = hashlib.sha256(repr((frame.shape, list(frame.columns))).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(frame, index=True).values.tobytes())
+    return digest.hexdigest()
+
+def memoized_bill_step(name: str, key: Any, func: Callable, *args: Any) -> Any:
+    """
+    Return func(*args), reusing the result of an earlier call of step name
+    with the same key.
+
+    Every caller gets its own copy of the result's dicts, lists and objects,
+    while its NumPy arrays and pandas objects are shared read-only. Warnings
+    the step raised through bill_warning are shown again on reuse. Inside
+    profile_bill the memo is bypassed.
+
+    Args:
+        name: Step name
+        key: Hashable summary of every input that affects the step's result
+        func: Builds the step's result
+        *args: Arguments for func
+
+    Returns:
+        The step's result
+    """
+    if _active_profile.get() is not None:
+        # A profiled run builds every step, so the profile shows the full cost
+        return func(*args)
+    memo_key = (name, key)
+    with _bill_step_lock:
+        entry = _bill_step_memo.get(memo_key)
+        if entry is not None:
+            _bill_step_memo.move_to_end(memo_key)
+    if entry is None:
+        outer = _step_warnings.get()
+        token = _step_warnings.set([])
+        try:
+            result = func(*args)
+        finally:
+            warnings = tuple(_step_warnings.get())
+            _step_warnings.reset(token)
+        if outer is not None:
+            outer.extend(warnings)
+        shared = {}
+        _shared_parts(result, shared)
+        entry = (result, shared, warnings)
+        with _bill_step_lock:
+            _bill_step_memo[memo_key] = entry
+            while len(_bill_step_memo) > BILL_STEP_MEMO_SIZE:
+                _bill_step_memo.popitem(last=False)
+    else:
+        for warning in entry[2]:
+            bill_warning(warning)
+    result, shared, _ = entry
+    return copy.deepcopy(result, dict(shared))
+
+# How Bill Quantity rows are matched to Work Order items: by row position, by
+# serial number, or "auto" (by serial number when Bill Quantity has them)
+QUANTITY_ALIGNMENTS = ("auto", "position", "serial")
+QUANTITY_ALIGNMENT = os.environ.get("BILL_QUANTITY_ALIGN", "auto")
+
+# Alignment issues and rejected rows shown as warnings; the rest are counted
+ALIGNMENT_WARNINGS_SHOWN = 20
+
+def _serial_keys(values: pd.Series) -> np.ndarray:
+    """Serial numbers as comparable text: '3', 3 and 3.0 are the same item, blanks are ''"""
+    numeric = pd.to_numeric(values, errors="coerce")
+    whole = numeric.notna() & (numeric == np.floor(numeric))
+    keys = values.astype(object).where(values.notna(), "").astype(str).str.strip()
+    keys[whole] = numeric[whole].astype(np.int64).astype(str)
+    return keys.to_numpy(dtype=object)
+
+def _item_keys(sheet: pd.DataFrame, stop: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Key the item rows (22 onwards) of a Work Order or Bill Quantity sheet.
+
+    Sub-items leave the serial blank and belong to the numbered row above
+    them, so a row is identified by that serial, which occurrence of the
+    serial it falls under (repeats are matched in order) and its offset below
+    the numbered row.
+
+    Returns:
+        Tuple of (unique row keys, serial each row falls under, mask of
+        numbered rows repeating an earlier serial)
+    """
+    serials = pd.Series(_serial_keys(_sheet_column(sheet, 21, stop, 0)), dtype=object)
+    numbered = serials != ""
+    heads = serials.where(numbered).ffill().fillna("")
+    occurrence = serials[numbered].groupby(serials[numbered]).cumcount().reindex(serials.index).ffill().fillna(0)
+    offset = serials.groupby(numbered.cumsum()).cumcount()
+    keys = heads + "\x1f" + occurrence.astype(int).astype(str) + "\x1f" + offset.astype(str)
+    return keys.to_numpy(dtype=object), heads.to_numpy(dtype=object), (numbered & (occurrence > 0)).to_numpy()
+
+class QuantityIndex:
+    """
+    Bill Quantity cells lined up with the Work Order item rows (22 onwards).
+
+    Built once per workbook by build_quantity_index and shared by the First
+    Page and the Deviation Statement.
+
+    Attributes:
+        align: Alignment used, "position" or "serial"
+        quantities: Bill Quantity cell for each Work Order row, blank when unmatched
+        matched: Mask of Work Order rows that have a Bill Quantity row
+        issues: Unmatched and repeated keys, each with sheet, row, serial_no and reason
+    """
+
+    def __init__(self, align: str, quantities: pd.Series, matched: np.ndarray, issues: List[Dict[str, Any]]):
+        self.align = align
+        self.quantities = quantities
+        self.matched = matched
+        self.issues = issues
+
+def build_quantity_index(ws_wo: pd.DataFrame, ws_bq: pd.DataFrame, align: str = QUANTITY_ALIGNMENT) -> QuantityIndex:
+    """
+    Match Bill Quantity rows to Work Order items in one pass.
+
+    By serial number, both sheets are keyed with _item_keys and joined with a
+    hash lookup, so inserted or reordered Bill Quantity rows still find their
+    items.
+
+    Args:
+        ws_wo: Work Order sheet
+        ws_bq: Bill Quantity sheet
+        align: One of QUANTITY_ALIGNMENTS
+
+    Returns:
+        QuantityIndex for the Work Order rows
+
+    Raises:
+        ValueError: If align is not one of QUANTITY_ALIGNMENTS
+    """
+    if align not in QUANTITY_ALIGNMENTS:
+        raise ValueError(f"Quantity alignment must be one of: {', '.join(QUANTITY_ALIGNMENTS)}")
+    last_row_wo, last_row_bq = ws_wo.shape[0], ws_bq.shape[0]
+    if align == "auto":
+        align = "serial" if _sheet_column(ws_bq, 21, last_row_bq, 0).notna().any() else "position"
+    # Rows without any content (trailing blanks, spacing) are never reported
+    wo_content = ~ws_wo.iloc[21:last_row_wo].isna().all(axis=1).to_numpy()
+    issues = []
+
+    if align == "position":
+        quantities = _sheet_column(ws_bq, 21, last_row_wo, 3)
+        matched = np.arange(21, max(last_row_wo, 21)) < last_row_bq
+        for pos in np.flatnonzero(~matched & wo_content):
+            issues.append({"sheet": "Work Order", "row": 22 + int(pos), "serial_no": "",
+                           "reason": "no matching Bill Quantity row"})
+        return QuantityIndex(align, quantities, matched, issues)
+
+    wo_keys, wo_heads, wo_repeats = _item_keys(ws_wo, last_row_wo)
+    bq_keys, bq_heads, bq_repeats = _item_keys(ws_bq, last_row_bq)
+    bq_index = pd.Index(bq_keys)
+    bq_pos = bq_index.get_indexer(wo_keys)
+    matched = bq_pos >= 0
+    bq_qty = _sheet_column(ws_bq, 21, last_row_bq, 3)
+    quantities = pd.Series([np.nan] * len(wo_keys), dtype=object)
+    quantities[matched] = bq_qty.to_numpy()[bq_pos[matched]]
+
+    unbilled = ~bq_index.isin(wo_keys) & bq_qty.notna().to_numpy()
+    for sheet, positions, heads, reason in (
+        ("Work Order", np.flatnonzero(~matched & wo_content), wo_heads, "no Bill Quantity row for this item"),
+        ("Work Order", np.flatnonzero(wo_repeats), wo_heads, "serial number repeats an earlier item"),
+        ("Bill Quantity", np.flatnonzero(unbilled), bq_heads, "no Work Order item for this row; quantity ignored"),
+        ("Bill Quantity", np.flatnonzero(bq_repeats), bq_heads, "serial number repeats an earlier item")
+    ):
+        issues.extend({"sheet": sheet, "row": 22 + int(pos), "serial_no": heads[pos], "reason": reason} for pos in positions)
+    return QuantityIndex(align, quantities, matched, issues)
+
+def build_line_items(
+    ws_wo: pd.DataFrame,
+    ws_bq: pd.DataFrame,
+    ws_extra: Optional[pd.DataFrame],
+    index: Optional[QuantityIndex] = None,
+    text: Optional[Dict[str, np.ndarray]] = None
+) -> Tuple[LineItems, LineItems]:
+    """
+    Build the Work Order items (rows 22 onwards, quantities from Bill
+    Quantity) and the Extra Items (rows 7 onwards).
+
+    Args:
+        ws_wo: Work Order sheet
+        ws_bq: Bill Quantity sheet
+        ws_extra: Extra Items sheet, if any
+        index: Bill Quantity alignment; built with the default alignment if omitted
+        text: Work Order text from work_order_text; converted here if omitted
+
+    Returns:
+        Tuple of (work order items, extra items)
+    """
+    if index is None:
+        index = build_quantity_index(ws_wo, ws_bq)
+    if text is None:
+        text = work_order_text(ws_wo)
+    last_row_wo = ws_wo.shape[0]
+    work_order_items = _build_line_items(
+        qty=index.quantities,
+        rate=_sheet_column(ws_wo, 21, last_row_wo, 4),
+        text=text,
+        first_row=21,
+        qty_sheet="Bill Quantity" if index.align == "position" else "Bill Quantity for Work Order",
+        rate_sheet="Work Order"
+    )
+
+    last_row_extra = ws_extra.shape[0] if isinstance(ws_extra, pd.DataFrame) else 0
+    extra_items = _build_line_items(
+        qty=_sheet_column(ws_extra, 6, last_row_extra, 3),
+        rate=_sheet_column(ws_extra, 6, last_row_extra, 5),
+        text={field: _text_column(_sheet_column(ws_extra, 6, last_row_extra, col))
+              for field, col in (("serial_no", 0), ("description", 2), ("unit", 4), ("remark", 1))},
+        first_row=6,
+        qty_sheet="Extra Items",
+        rate_sheet="Extra Items"
+    ) if last_row_extra > 6 else LineItems.empty()
+    return work_order_items, extra_items
+
+def build_bill_totals(items_total: float, premium_percent: float, premium_type: str) -> Dict[str, Any]:
+    """First Page totals: grand total, tender premium and payable amount"""
+    total_amount = round(items_total)
+    premium_amount = round(total_amount * (premium_percent / 100))
+    return {
+        "grand_total": total_amount,
+        "premium": {
+            "percent": premium_percent,
+            "type": premium_type,
+            "amount": premium_amount
+        },
+        "payable": round(total_amount + premium_amount)
+    }
+
+def build_bill_header(user_inputs: Dict[str, Any], premium_percent: float, amount_paid_last_bill: float) -> List[List[Any]]:
+    """First Page header rows from the user inputs"""
+    return [
+        ["Start Date:", user_inputs.get("start_date", "")],
+        ["Completion Date:", user_inputs.get("completion_date", "")],
+        ["Actual Completion Date:", user_inputs.get("actual_completion_date", "")],
+        ["Order Date:", user_inputs.get("order_date", "")],
+        ["Contractor Name:", user_inputs.get("contractor_name", "")],
+        ["Work Name:", user_inputs.get("work_name", "")],
+        ["Bill Serial:", user_inputs.get("bill_serial", "")],
+        ["Agreement No:", user_inputs.get("agreement_no", "")],
+        ["Work Order Ref:", user_inputs.get("work_order_ref", "")],
+        ["Work Order Amount:", user_inputs.get("work_order_amount", "")],
+        ["Premium Percent:", premium_percent],
+        ["Amount Paid Last Bill:", amount_paid_last_bill],
+        ["Bill Type:", user_inputs.get("bill_type", "")],
+        ["Bill Number:", user_inputs.get("bill_number", "")],
+        ["Last Bill Reference:", user_inputs.get("last_bill_reference", "")]
+    ]
+
+def build_deviation(
+    ws_wo: pd.DataFrame,
+    ws_bq: pd.DataFrame,
+    premium_percent: float,
+    premium_type: str,
+    index: Optional[QuantityIndex] = None,
+    text: Optional[Dict[str, np.ndarray]] = None
+) -> Dict[str, Any]:
+    """
+    Deviation Statement rows (work order against billed quantities) and
+    their summary with the tender premium, computed column-wise.
+
+    Work Order rows 22 onwards take their billed quantity from the
+    QuantityIndex. Quantities are rounded to 2 places and amounts
+    half-to-even, as Python's round() does.
+
+    Args:
+        ws_wo: Work Order sheet
+        ws_bq: Bill Quantity sheet
+        premium_percent: Tender premium percentage
+        premium_type: 'above' or 'below'
+        index: Bill Quantity alignment; built with the default alignment if omitted
+        text: Work Order text from work_order_text; converted here if omitted
+
+    Returns:
+        Dict with "items" (DeviationItems), "summary", and "rejected": the
+        Work Order rows left out, each with its sheet row number, serial_no
+        and reason
+    """
+    if index is None:
+        index = build_quantity_index(ws_wo, ws_bq)
+    if text is None:
+        text = work_order_text(ws_wo)
+    last_row = ws_wo.shape[0]
+    serial_cells = _sheet_column(ws_wo, 21, last_row, 0)
+    qty_wo_cells = _sheet_column(ws_wo, 21, last_row, 3)
+    rate_cells = _sheet_column(ws_wo, 21, last_row, 4)
+    qty_bill_cells = index.quantities
+    in_bq = index.matched
+
+    qty_wo, bad_qty_wo = _coerce_numeric(qty_wo_cells)
+    rate, bad_rate = _coerce_numeric(rate_cells)
+    qty_bill, bad_qty_bill = _coerce_numeric(qty_bill_cells)
+
+    # Rows without a Bill Quantity are only reported when the Work Order row has content
+    has_content = ~ws_wo.iloc[21:last_row].isna().all(axis=1).to_numpy()
+    rejected = []
+    for pos in np.flatnonzero(~in_bq & has_content | in_bq & (bad_qty_wo | bad_rate | bad_qty_bill)):
+        if not in_bq[pos]:
+            reason = "no matching Bill Quantity row"
+        elif bad_qty_wo[pos]:
+            reason = f"Work Order quantity is not a number: '{qty_wo_cells.iat[pos]}'"
+        elif bad_rate[pos]:
+            reason = f"rate is not a number: '{rate_cells.iat[pos]}'"
+        else:
+            reason = f"Bill Quantity is not a number: '{qty_bill_cells.iat[pos]}'"
+        serial_no = serial_cells.iat[pos]
+        rejected.append({"row": 22 + int(pos), "serial_no": "" if pd.isna(serial_no) else str(serial_no), "reason": reason})
+
+    keep = in_bq & ~(bad_qty_wo | bad_rate | bad_qty_bill)
+    qty_wo = _round_like_python(qty_wo[keep], 2)
+    rate = rate[keep]
+    qty_bill = _round_like_python(qty_bill[keep], 2)
+    amt_wo = np.rint(qty_wo * rate).astype(np.int64)
+    amt_bill = np.rint(qty_bill * rate).astype(np.int64)
+    excess_qty = np.where(qty_bill > qty_wo, _round_like_python(qty_bill - qty_wo, 2), 0.0)
+    excess_amt = np.where(excess_qty > 0, np.rint(excess_qty * rate), 0).astype(np.int64)
+    saving_qty = np.where(qty_bill < qty_wo, _round_like_python(qty_wo - qty_bill, 2), 0.0)
+    saving_amt = np.where(saving_qty > 0, np.rint(saving_qty * rate), 0).astype(np.int64)
+
+    def shown(values, blank_cells=None, zero=""):
+        # Blank quantities display as 0 and non-positive excess/saving as ''
+        column = values.astype(object)
+        if blank_cells is not None:
+            column[blank_cells[keep]] = 0
+        else:
+            column[values <= 0] = zero
+        return column
+
+    items = DeviationItems({
+        **{field: text[field][keep] for field in ("serial_no", "description", "unit")},
+        "qty_wo": shown(qty_wo, qty_wo_cells.isna().to_numpy()),
+        "rate": shown(rate, rate_cells.isna().to_numpy()),
+        "amt_wo": amt_wo,
+        "qty_bill": shown(qty_bill, qty_bill_cells.isna().to_numpy()),
+        "amt_bill": amt_bill,
+        "excess_qty": shown(excess_qty),
+        "excess_amt": shown(excess_amt),
+        "saving_qty": shown(saving_qty),
+        "saving_amt": shown(saving_amt)
+    })
+
+    work_order_total = int(amt_wo.sum())
+    executed_total = int(amt_bill.sum())
+    overall_excess = int(excess_amt[excess_amt > 0].sum())
+    overall_saving = int(saving_amt[saving_amt > 0].sum())
+
+    # Tender premium on each total (columns F, H, J and L), with 2 decimal places
+    sign = 1 if premium_type == "above" else -1
+    tender_premium_f, tender_premium_h, tender_premium_j, tender_premium_l = (
+        sign * round(total * (premium_percent / 100), 2)
+        for total in (work_order_total, executed_total, overall_excess, overall_saving)
+    )
+    grand_total_f = int(round(work_order_total + tender_premium_f))
+    grand_total_h = int(round(executed_total + tender_premium_h))
+    grand_total_j = int(round(overall_excess + tender_premium_j))
+    grand_total_l = int(round(overall_saving + tender_premium_l))
+
+    net_difference = grand_total_j - grand_total_l
+    net_difference_percent = (net_difference / work_order_total * 100) if work_order_total > 0 else 0
+
+    summary = {
+        "work_order_total": work_order_total,
+        "executed_total": executed_total,
+        "overall_excess": overall_excess,
+        "overall_saving": overall_saving,
+        "premium": {
+            "percent": premium_percent / 100,
+            "type": premium_type
+        },
+        "tender_premium_f": tender_premium_f,
+        "tender_premium_h": tender_premium_h,
+        "tender_premium_j": tender_premium_j,
+        "tender_premium_l": tender_premium_l,
+        "grand_total_f": grand_total_f,
+        "grand_total_h": grand_total_h,
+        "grand_total_j": grand_total_j,
+        "grand_total_l": grand_total_l,
+        "net_difference": net_difference,
+        "net_difference_percent": net_difference_percent
+    }
+    return {"items": items, "summary": summary, "rejected": rejected}
+
+@instrumented()
 def process_bill(
     ws_wo: pd.DataFrame,
     ws_bq: pd.DataFrame,
@@ -166,7 +1206,10 @@ def process_bill(
 ) -> Tuple[Dict[str, Any], Dict[str, Any], Dict[str, Any], List[Dict[str, Any]], Dict[str, Any], Dict[str, Any]]:
     """
     Process bill data and generate all required documents.
-    Optimized for performance with parallel processing.
+
+    The line items, totals, deviation statement and notes are memoized bill
+    steps keyed on the sheets and inputs they depend on, so editing a header
+    field such as work_name or a date only rebuilds the header.
     
     Args:
         ws_wo: Work order DataFrame
@@ -226,306 +1269,131 @@ def process_bill(
             if field not in user_inputs:
                 user_inputs[field] = default_value
 
-        # Initialize data structures
-        first_page_data = {
-            "header": [],
-            "items": [],  # Initialize as empty list
-            "totals": {}
-        }
-        last_page_data = {"payable_amount": 0, "amount_words": ""}
-        deviation_data = {
-            "items": [],  # Initialize as empty list
-            "summary": {},
-            "header": []
-        }
-        extra_items_data = {"items": []}
-        note_sheet_data = {"notes": []}
+        # Each part of the bill is built by its own step and memoized on the
+        # inputs it depends on, so an edit only recomputes the parts it feeds
+        sheets_key = (frame_digest(ws_wo), frame_digest(ws_bq), frame_digest(ws_extra))
+        quantity_index = memoized_bill_step(
+            "quantity_index", (sheets_key[:2], QUANTITY_ALIGNMENT), build_quantity_index,
+            ws_wo, ws_bq, QUANTITY_ALIGNMENT
+        )
+        text = memoized_bill_step("work_order_text", sheets_key[0], work_order_text, ws_wo)
+        work_order_items, extra_items = memoized_bill_step(
+            "line_items", (sheets_key, QUANTITY_ALIGNMENT), build_line_items, ws_wo, ws_bq, ws_extra, quantity_index, text
+        )
+        # Work Order items, the Extra Items divider, then Extra Items; the
+        # Extra Items section is a view of the same columns
+        items = memoized_bill_step(
+            "first_page_items", (sheets_key, QUANTITY_ALIGNMENT), LineItems.concat,
+            work_order_items, LineItems.divider("Extra Items (With Premium)"), extra_items
+        )
+        extra_items = items.view(len(items) - len(extra_items), len(items), extra_items.total)
+        totals = memoized_bill_step(
+            "totals", (items.total, premium_percent, premium_type), build_bill_totals,
+            items.total, premium_percent, premium_type
+        )
+        deviation = memoized_bill_step(
+            "deviation", (sheets_key, premium_percent, premium_type, QUANTITY_ALIGNMENT), build_deviation,
+            ws_wo, ws_bq, premium_percent, premium_type, quantity_index, text
+        )
+        # Unmatched rows are reported once, by the index
+        unmatched_rows = {issue["row"] for issue in quantity_index.issues if issue["sheet"] == "Work Order"}
+        alignment_warnings = [f"{issue['sheet']} row {issue['row']}: {issue['reason']}" for issue in quantity_index.issues]
+        alignment_warnings.extend(
+            f"Deviation Statement skips Work Order row {rejected['row']}: {rejected['reason']}"
+            for rejected in deviation["rejected"] if rejected["row"] not in unmatched_rows
+        )
+        for warning in alignment_warnings[:ALIGNMENT_WARNINGS_SHOWN]:
+            st.warning(warning)
+        if len(alignment_warnings) > ALIGNMENT_WARNINGS_SHOWN:
+            st.warning(f"... and {len(alignment_warnings) - ALIGNMENT_WARNINGS_SHOWN} more row warnings")
+        work_order_amount = user_inputs.get("work_order_amount", 0)
+        notes = memoized_bill_step(
+            "notes", (totals["payable"], work_order_amount, extra_items.total), generate_bill_notes,
+            totals["payable"], work_order_amount, extra_items.total
+        )["notes"]
+        header = build_bill_header(user_inputs, premium_percent, amount_paid_last_bill)
+
+        payable_amount = totals["payable"]
+        amount_words = number_to_words(payable_amount)
+        current_date = bill_date()
 
-        # Header (A1:G19)
-        header_data = ws_wo.iloc[:19, :7].replace(pd.NA, "").values.tolist()
-        
-        # Format dates in header_data
-        for i in range(len(header_data)):
-            for j in range(len(header_data[i])):
-                val = header_data[i][j]
-                if isinstance(val, (pd.Timestamp, datetime, date)):
-                    header_data[i][j] = val.strftime("%d-%m-%Y")
-
-        # Assign header to both first_page_data and deviation_data
-        first_page_data["header"] = header_data
-        deviation_data["header"] = header_data
-
-        # Process Work Order items
-        last_row_wo = ws_wo.shape[0]
-        for i in range(21, last_row_wo):
-            qty_raw = ws_bq.iloc[i, 3] if i < ws_bq.shape[0] and pd.notnull(ws_bq.iloc[i, 3]) else None
-            rate_raw = ws_wo.iloc[i, 4] if pd.notnull(ws_wo.iloc[i, 4]) else None
-
-            qty = 0
-            if isinstance(qty_raw, (int, float)):
-                qty = float(qty_raw)
-            elif isinstance(qty_raw, str):
-                cleaned_qty = qty_raw.strip().replace(',', '').replace(' ', '')
-                try:
-                    qty = float(cleaned_qty)
-                except ValueError:
-                    st.warning(f"Skipping invalid quantity at Bill Quantity row {i+1}: '{qty_raw}'")
-                    continue
-
-            rate = 0
-            if isinstance(rate_raw, (int, float)):
-                rate = float(rate_raw)
-            elif isinstance(rate_raw, str):
-                cleaned_rate = rate_raw.strip().replace(',', '').replace(' ', '')
-                try:
-                    rate = float(cleaned_rate)
-                except ValueError:
-                    st.warning(f"Skipping invalid rate at Work Order row {i+1}: '{rate_raw}'")
-                    continue
-
-            item = {
-                "serial_no": str(ws_wo.iloc[i, 0]) if pd.notnull(ws_wo.iloc[i, 0]) else "",
-                "description": str(ws_wo.iloc[i, 1]) if pd.notnull(ws_wo.iloc[i, 1]) else "",
-                "unit": str(ws_wo.iloc[i, 2]) if pd.notnull(ws_wo.iloc[i, 2]) else "",
-                "quantity": qty,
-                "rate": rate,
-                "remark": str(ws_wo.iloc[i, 6]) if pd.notnull(ws_wo.iloc[i, 6]) else "",
-                "amount": round(qty * rate) if qty and rate else 0,
-                "is_divider": False
-            }
-            first_page_data["items"].append(item)
-
-        # Add Extra Items divider
-        first_page_data["items"].append({
-            "description": "Extra Items (With Premium)",
-            "bold": True,
-            "underline": True,
-            "amount": 0,
-            "quantity": 0,
-            "rate": 0,
-            "serial_no": "",
-            "unit": "",
-            "remark": "",
-            "is_divider": True
-        })
-
-        # Process Extra Items
-        last_row_extra = ws_extra.shape[0]
-        for j in range(6, last_row_extra):
-            qty_raw = ws_extra.iloc[j, 3] if pd.notnull(ws_extra.iloc[j, 3]) else None
-            rate_raw = ws_extra.iloc[j, 5] if pd.notnull(ws_extra.iloc[j, 5]) else None
-
-            qty = 0
-            if isinstance(qty_raw, (int, float)):
-                qty = float(qty_raw)
-            elif isinstance(qty_raw, str):
-                cleaned_qty = qty_raw.strip().replace(',', '').replace(' ', '')
-                try:
-                    qty = float(cleaned_qty)
-                except ValueError:
-                    st.warning(f"Skipping invalid quantity at Extra Items row {j+1}: '{qty_raw}'")
-                    continue
-
-            rate = 0
-            if isinstance(rate_raw, (int, float)):
-                rate = float(rate_raw)
-            elif isinstance(rate_raw, str):
-                cleaned_rate = rate_raw.strip().replace(',', '').replace(' ', '')
-                try:
-                    rate = float(cleaned_rate)
-                except ValueError:
-                    st.warning(f"Skipping invalid rate at Extra Items row {j+1}: '{rate_raw}'")
-                    continue
-
-            item = {
-                "serial_no": str(ws_extra.iloc[j, 0]) if pd.notnull(ws_extra.iloc[j, 0]) else "",
-                "description": str(ws_extra.iloc[j, 2]) if pd.notnull(ws_extra.iloc[j, 2]) else "",
-                "unit": str(ws_extra.iloc[j, 4]) if pd.notnull(ws_extra.iloc[j, 4]) else "",
-                "quantity": qty,
-                "rate": rate,
-                "remark": str(ws_extra.iloc[j, 1]) if pd.notnull(ws_extra.iloc[j, 1]) else "",
-                "amount": round(qty * rate) if qty and rate else 0,
-                "is_divider": False
-            }
-            first_page_data["items"].append(item)
-            extra_items_data["items"].append(item.copy())
-
-        # Calculate totals
-        data_items = [item for item in first_page_data["items"] if not item.get("is_divider", False)]
-        total_amount = round(sum(item.get("amount", 0) for item in data_items))
-        premium_amount = round(total_amount * (premium_percent / 100))
-        payable_amount = round(total_amount + premium_amount)
+        # First Page
+        first_page_data = {"header": header, "items": items, "totals": totals}
 
-        # Initialize last_page_data with amount_words
+        # Last Page
         last_page_data = {
             "payable_amount": payable_amount,
-            "amount_words": number_to_words(payable_amount)
+            "amount_words": amount_words,
+            "current_date": current_date
         }
 
-        first_page_data["totals"] = {
-            "grand_total": total_amount,
-            "premium": {
-                "percent": premium_percent,
-                "amount": premium_amount
-            },
-            "payable": payable_amount
+        # Deviation Statement
+        deviation_data = {
+            "items": deviation["items"],
+            "summary": deviation["summary"],
+            "rejected": deviation["rejected"],
+            "alignment_issues": quantity_index.issues,
+            "current_date": current_date
+        }
+
+        # Note Sheet
+        note_sheet_data = {
+            "notes": notes,
+            "current_date": current_date
         }
 
         # Calculate Certificate III data
         certificate_iii_data = {
             "payable_amount": payable_amount,
-            "total_123": total_amount,
+            "total_123": totals["grand_total"],
             "balance_4_minus_5": payable_amount,
             "amount_paid_last_bill": int(amount_paid_last_bill),
             "payment_now": payable_amount,
             "by_cheque": payable_amount,
-            "cheque_amount_words": number_to_words(payable_amount),
+            "cheque_amount_words": amount_words,
             "certificate_items": [
-                {"name": "Total value of work", "percentage": "100%", "value": total_amount},
+                {"name": "Total value of work", "percentage": "100%", "value": totals["grand_total"]},
                 {"name": "Less: Amount Paid Last Bill", "percentage": "-", "value": int(amount_paid_last_bill)},
                 {"name": "Net Payable", "percentage": "-", "value": payable_amount}
             ],
             "total_recovery": 0,  # Add logic for recovery items if needed
-            "current_date": datetime.now().strftime("%d-%m-%Y")
-        }
-
-        # First Page
-        first_page_data["header"] = [
-            ["Start Date:", user_inputs.get("start_date", "")],
-            ["Completion Date:", user_inputs.get("completion_date", "")],
-            ["Actual Completion Date:", user_inputs.get("actual_completion_date", "")],
-            ["Order Date:", user_inputs.get("order_date", "")],
-            ["Contractor Name:", user_inputs.get("contractor_name", "")],
-            ["Work Name:", user_inputs.get("work_name", "")],
-            ["Bill Serial:", user_inputs.get("bill_serial", "")],
-            ["Agreement No:", user_inputs.get("agreement_no", "")],
-            ["Work Order Ref:", user_inputs.get("work_order_ref", "")],
-            ["Work Order Amount:", user_inputs.get("work_order_amount", "")],
-            ["Premium Percent:", premium_percent],
-            ["Amount Paid Last Bill:", amount_paid_last_bill],
-            ["Bill Type:", user_inputs.get("bill_type", "")],
-            ["Bill Number:", user_inputs.get("bill_number", "")],
-            ["Last Bill Reference:", user_inputs.get("last_bill_reference", "")]
-        ]
-
-        # Last Page
-        last_page_data = {
-            "payable_amount": payable_amount,
-            "amount_words": number_to_words(payable_amount),
-            "current_date": datetime.now().strftime("%d-%m-%Y")
+            # Memorandum figures: items 1-4 cover the work order, item 6 the extra items
+            "totals": {
+                "grand_total": work_order_items.total,
+                "total_123": work_order_items.total,
+                "extra_items_sum": extra_items.total,
+                "payable": payable_amount,
+                "balance_4_minus_5": payable_amount
+            },
+            "current_date": current_date
         }
 
-        # Deviation Statement
-        deviation_data = {
-            "items": [],  # Will be populated with bill items
-            "summary": {},
-            "current_date": datetime.now().strftime("%d-%m-%Y")
-        }
+        return first_page_data, last_page_data, deviation_data, extra_items, note_sheet_data, certificate_iii_data
 
-        # Process deviation items
-        deviation_items = []
-        try:
-            for i in range(21, ws_wo.shape[0]):
-                if i < ws_bq.shape[0]:
-                    try:
-                        # Get values safely using iloc with bounds checking
-                        qty_wo_val = ws_wo.iloc[i, 3] if 3 < ws_wo.shape[1] else None
-                        rate_val = ws_wo.iloc[i, 4] if 4 < ws_wo.shape[1] else None
-                        qty_bill_val = ws_bq.iloc[i, 3] if 3 < ws_bq.shape[1] else None
-                        
-                        # Convert and handle null values
-                        qty_wo = round(float(qty_wo_val), 2) if pd.notnull(qty_wo_val) else 0
-                        rate = float(rate_val) if pd.notnull(rate_val) else 0
-                        qty_bill = round(float(qty_bill_val), 2) if pd.notnull(qty_bill_val) else 0
-
-                        # Calculate amounts as integers
-                        amt_wo = int(round(qty_wo * rate))
-                        amt_bill = int(round(qty_bill * rate))
-                        excess_qty = round(qty_bill - qty_wo, 2) if qty_bill > qty_wo else 0
-                        excess_amt = int(round(excess_qty * rate)) if excess_qty > 0 else 0
-                        saving_qty = round(qty_wo - qty_bill, 2) if qty_bill < qty_wo else 0
-                        saving_amt = int(round(saving_qty * rate)) if saving_qty > 0 else 0
-
-                        # Get text values safely with bounds checking
-                        serial_no = str(ws_wo.iloc[i, 0]) if 0 < ws_wo.shape[1] and pd.notnull(ws_wo.iloc[i, 0]) else ""
-                        description = str(ws_wo.iloc[i, 1]) if 1 < ws_wo.shape[1] and pd.notnull(ws_wo.iloc[i, 1]) else ""
-                        unit = str(ws_wo.iloc[i, 2]) if 2 < ws_wo.shape[1] and pd.notnull(ws_wo.iloc[i, 2]) else ""
-
-                        item = {
-                            "serial_no": serial_no,
-                            "description": description,
-                            "unit": unit,
-                            "qty_wo": qty_wo,
-                            "rate": rate,
-                            "amt_wo": amt_wo,
-                            "qty_bill": qty_bill,
-                            "amt_bill": amt_bill,
-                            "excess_qty": excess_qty if excess_qty > 0 else "",
-                            "excess_amt": excess_amt if excess_amt > 0 else "",
-                            "saving_qty": saving_qty if saving_qty > 0 else "",
-                            "saving_amt": saving_amt if saving_amt > 0 else ""
-                        }
-                        deviation_items.append(item)
-                    except (ValueError, TypeError, IndexError):
-                        continue  # Skip this row if any conversion fails
-        except Exception as e:
-            raise ValueError(f"Error processing deviation items: {str(e)}")
+    except Exception as e:
+        raise Exception(f"Error processing bill data: {str(e)}")
 
-        # Calculate deviation summary
-        try:
-            work_order_total = sum(item["amt_wo"] for item in deviation_items)
-            executed_total = sum(item["amt_bill"] for item in deviation_items)
-            overall_excess = sum(item["excess_amt"] for item in deviation_items if isinstance(item["excess_amt"], (int, float)))
-            overall_saving = sum(item["saving_amt"] for item in deviation_items if isinstance(item["saving_amt"], (int, float)))
-        except Exception as e:
-            raise ValueError(f"Error calculating deviation summary: {str(e)}")
-
-        # Calculate tender premium with 2 decimal places
-        tender_premium_f = round(work_order_total * (premium_percent / 100), 2) if premium_type == "above" else -round(work_order_total * (premium_percent / 100), 2)
-        tender_premium_h = round(executed_total * (premium_percent / 100), 2) if premium_type == "above" else -round(executed_total * (premium_percent / 100), 2)
-        tender_premium_j = round(overall_excess * (premium_percent / 100), 2) if premium_type == "above" else -round(overall_excess * (premium_percent / 100), 2)
-        tender_premium_l = round(overall_saving * (premium_percent / 100), 2) if premium_type == "above" else -round(overall_saving * (premium_percent / 100), 2)
-
-        # Calculate grand totals as integers
-        grand_total_f = int(round(work_order_total + tender_premium_f))
-        grand_total_h = int(round(executed_total + tender_premium_h))
-        grand_total_j = int(round(overall_excess + tender_premium_j))
-        grand_total_l = int(round(overall_saving + tender_premium_l))
-
-        net_difference = grand_total_j - grand_total_l
-        net_difference_percent = (net_difference / work_order_total * 100) if work_order_total > 0 else 0
-
-        deviation_data["summary"] = {
-            "work_order_total": work_order_total,
-            "executed_total": executed_total,
-            "overall_excess": overall_excess,
-            "overall_saving": overall_saving,
-            "premium": {
-                "percent": premium_percent / 100,
-                "type": premium_type
-            },
-            "tender_premium_f": tender_premium_f,
-            "tender_premium_h": tender_premium_h,
-            "tender_premium_j": tender_premium_j,
-            "tender_premium_l": tender_premium_l,
-            "grand_total_f": grand_total_f,
-            "grand_total_h": grand_total_h,
-            "grand_total_j": grand_total_j,
-            "grand_total_l": grand_total_l,
-            "net_difference": net_difference,
-            "net_difference_percent": net_difference_percent
-        }
+def bill_date() -> str:
+    """Today's date as printed on the bill"""
+    return datetime.now().strftime("%d-%m-%Y")
 
-        # Note Sheet
-        note_sheet_data = {
-            "notes": generate_bill_notes(payable_amount, user_inputs.get("work_order_amount", 0), sum(item.get("amount", 0) for item in extra_items_data["items"])),
-            "current_date": datetime.now().strftime("%d-%m-%Y")
-        }
+def dated_bill(bill: Tuple[Any, ...], current_date: Optional[str] = None) -> Tuple[Any, ...]:
+    """
+    process_bill's output with current_date set on every section that prints it.
 
-        return first_page_data, last_page_data, deviation_data, extra_items_data["items"], note_sheet_data, certificate_iii_data
+    Args:
+        bill: process_bill's output
+        current_date: Date to print; defaults to bill_date()
 
-    except Exception as e:
-        raise Exception(f"Error processing bill data: {str(e)}")
+    Returns:
+        Tuple: The bill with copies of the dated section dicts
+    """
+    if current_date is None:
+        current_date = bill_date()
+    return tuple(
+        dict(part, current_date=current_date) if isinstance(part, dict) and "current_date" in part else part
+        for part in bill
+    )
 
 def generate_bill_notes(payable_amount, work_order_amount, extra_item_amount):
     percentage_work_done = (payable_amount / work_order_amount * 100) if work_order_amount > 0 else 0
@@ -564,507 +1432,1169 @@ def generate_bill_notes(payable_amount, work_order_amount, extra_item_amount):
     return {"notes": note}
 
 def merge_pdfs(pdf_files, output_file):
+    from PyPDF2 import PdfMerger
     merger = PdfMerger()
     for pdf in pdf_files:
         merger.append(pdf)
     merger.write(output_file)
     merger.close()
 
+# Rows serialized and parsed together when writing large Word tables
+WORD_TABLE_BATCH_ROWS = 500
+
+_W_NAMESPACE = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+
+# Characters XML 1.0 cannot carry; python-docx would reject them outright
+_XML_INVALID_RE = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+def _word_cell_xml(text: Optional[str], width: int, bold: bool) -> str:
+    """XML for one table cell, matching what python-docx writes for cell.text = text"""
+    tc_pr = f'<w:tcPr><w:tcW w:type="dxa" w:w="{width}"/></w:tcPr>'
+    if text is None:
+        return f"<w:tc>{tc_pr}<w:p/></w:tc>"
+    run = []
+    for line_no, line in enumerate(_XML_INVALID_RE.sub("", text).split("\n")):
+        if line_no:
+            run.append("<w:br/>")
+        for part_no, part in enumerate(line.split("\t")):
+            if part_no:
+                run.append("<w:tab/>")
+            if part:
+                space = ' xml:space="preserve"' if part != part.strip() else ""
+                run.append(f"<w:t{space}>{xml_escape(part)}</w:t>")
+    r_pr = '<w:rPr><w:b/></w:rPr>' if bold and text else ""
+    return f"<w:tc>{tc_pr}<w:p><w:r>{r_pr}{''.join(run) or '<w:t/>'}</w:r></w:p></w:tc>"
+
+def add_bulk_table(doc, cols: int, rows: Iterable[Tuple[Sequence[Optional[str]], bool]], style: str = "Table Grid"):
+    """
+    Append a table to doc, writing its rows as raw WordprocessingML.
+
+    Setting cell text through python-docx rebuilds the row's cell list on
+    every access, which dominates for tables with thousands of rows. Here rows
+    are serialized in batches of WORD_TABLE_BATCH_ROWS and parsed with lxml
+    straight into the table, while borders come from the table style rather
+    than per-cell properties.
+
+    Args:
+        doc: python-docx Document
+        cols: Number of columns
+        rows: (cell texts, bold) pairs; a None cell is left empty
+        style: Table style name
+
+    Returns:
+        The python-docx Table
+    """
+    from docx.oxml import parse_xml
+    table = doc.add_table(rows=0, cols=cols)
+    table.style = style
+    widths = [grid_col.w.twips for grid_col in table._tbl.tblGrid.gridCol_lst]
+    batch = []
+
+    def flush():
+        fragment = parse_xml(f'<w:tbl xmlns:w="{_W_NAMESPACE}">{"".join(batch)}</w:tbl>')
+        table._tbl.extend(list(fragment))
+        batch.clear()
+
+    for cells, bold in rows:
+        cells = list(cells) + [None] * (cols - len(cells))
+        batch.append("<w:tr>" + "".join(_word_cell_xml(text, width, bold) for text, width in zip(cells, widths)) + "</w:tr>")
+        if len(batch) >= WORD_TABLE_BATCH_ROWS:
+            flush()
+    if batch:
+        flush()
+    return table
+
+@instrumented()
 def create_word_doc(sheet_name, data, doc_path):
+    from docx import Document
     doc = Document()
     if sheet_name == "First Page":
-        table = doc.add_table(rows=len(data["items"]) + 3, cols=9)
-        table.style = "Table Grid"
-        for i, item in enumerate(data["items"]):
-            row = table.rows[i]
-            row.cells[0].text = str(item.get("unit", ""))
-            row.cells[2].text = str(item.get("quantity", ""))
-            row.cells[3].text = str(item.get("serial_no", ""))
-            row.cells[4].text = str(item.get("description", ""))
-            row.cells[5].text = str(item.get("rate", ""))
-            row.cells[6].text = str(item.get("amount", ""))
-            row.cells[8].text = str(item.get("remark", ""))
-            if item.get("bold"):
-                for cell in row.cells:
-                    cell.paragraphs[0].runs[0].bold = True
+        rows = [
+            ([str(item.get("unit", "")), None, str(item.get("quantity", "")), str(item.get("serial_no", "")),
+              str(item.get("description", "")), str(item.get("rate", "")), str(item.get("amount", "")), None,
+              str(item.get("remark", ""))], bool(item.get("bold")))
+            for item in data["items"]
+        ]
         # Totals
-        row = table.rows[-3]
-        row.cells[4].text = "Grand Total"
-        row.cells[6].text = str(data["totals"]["grand_total"])
-        row = table.rows[-2]
+        rows.append(([None, None, None, None, "Grand Total", None, str(data["totals"]["grand_total"])], False))
+        rows.extend([([], False), ([], False)])
+        add_bulk_table(doc, 9, rows)
     elif sheet_name == "Last Page":
         doc.add_paragraph(f"Payable Amount: {data['payable_amount']}")
         doc.add_paragraph(f"Total in Words: {data['amount_words']}")
     elif sheet_name == "Extra Items":
-        table = doc.add_table(rows=len(data["items"]) + 1, cols=7)
-        table.style = "Table Grid"
         headers = ["Serial No.", "Remark", "Description", "Quantity", "Unit", "Rate", "Amount"]
-        for j, header in enumerate(headers):
-            table.rows[0].cells[j].text = header
-        for i, item in enumerate(data["items"]):
-            row = table.rows[i + 1]
-            row.cells[0].text = str(item["serial_no"])
-            row.cells[1].text = str(item["remark"])
-            row.cells[2].text = str(item["description"])
-            row.cells[3].text = str(item["quantity"])
-            row.cells[4].text = str(item["unit"])
-            row.cells[5].text = str(item["rate"])
-            row.cells[6].text = str(item["amount"])
+        rows = [(headers, False)]
+        rows.extend(
+            ([str(item["serial_no"]), str(item["remark"]), str(item["description"]), str(item["quantity"]),
+              str(item["unit"]), str(item["rate"]), str(item["amount"])], False)
+            for item in data["items"]
+        )
+        add_bulk_table(doc, 7, rows)
     elif sheet_name == "Deviation Statement":
-        table = doc.add_table(rows=len(data["items"]) + 5, cols=12)
-        table.style = "Table Grid"
         headers = ["Serial No.", "Description", "Unit", "Qty WO", "Rate", "Amt WO", "Qty Bill", "Amt Bill", "Excess Qty", "Excess Amt", "Saving Qty", "Saving Amt"]
-        for j, header in enumerate(headers):
-            table.rows[0].cells[j].text = header
-        for i, item in enumerate(data["items"]):
-            row = table.rows[i + 1]
-            row.cells[0].text = str(item["serial_no"])
-            row.cells[1].text = str(item["description"])
-            row.cells[2].text = str(item["unit"])
-            row.cells[3].text = str(item["qty_wo"])
-            row.cells[4].text = str(item["rate"])
-            row.cells[5].text = str(item["amt_wo"])
-            row.cells[6].text = str(item["qty_bill"])
-            row.cells[7].text = str(item["amt_bill"])
-            row.cells[8].text = str(item["excess_qty"])
-            row.cells[9].text = str(item["excess_amt"])
-            row.cells[10].text = str(item["saving_qty"])
-            row.cells[11].text = str(item["saving_amt"])
+        rows = [(headers, False)]
+        rows.extend(
+            ([str(item[key]) for key in ("serial_no", "description", "unit", "qty_wo", "rate", "amt_wo", "qty_bill",
+                                         "amt_bill", "excess_qty", "excess_amt", "saving_qty", "saving_amt")], False)
+            for item in data["items"]
+        )
         # Summary
-        row = table.rows[-4]
-        row.cells[1].text = "Grand Total"
-        row.cells[5].text = str(data["summary"]["work_order_total"])
-        row.cells[7].text = str(data["summary"]["executed_total"])
-        row.cells[9].text = str(data["summary"]["overall_excess"])
-        row.cells[11].text = str(data["summary"]["overall_saving"])
-        row = table.rows[-3]
-        row.cells[1].text = f"Add Tender Premium ({data['summary']['premium']['percent']:.2%} {data['summary']['premium']['type']})"
-        row.cells[5].text = str(data["summary"]["tender_premium_f"])
-        row.cells[7].text = str(data["summary"]["tender_premium_h"])
-        row.cells[9].text = str(data["summary"]["tender_premium_j"])
-        row.cells[11].text = str(data["summary"]["tender_premium_l"])
-        row = table.rows[-2]
-        row.cells[1].text = "Grand Total including Tender Premium"
-        row.cells[5].text = str(data["summary"]["grand_total_f"])
-        row.cells[7].text = str(data["summary"]["grand_total_h"])
-        row.cells[9].text = str(data["summary"]["grand_total_j"])
-        row.cells[11].text = str(data["summary"]["grand_total_l"])
-        row = table.rows[-1]
-        if data["summary"]["net_difference"] > 0:
-            row.cells[1].text = "Overall Excess With Respect to the Work Order Amount Rs."
-            row.cells[7].text = str(round(data["summary"]["net_difference"]))
-            row.cells[9].text = f"{data['summary']['net_difference_percent']:2f}%"
+        summary = data["summary"]
+        rows.append(([None, "Grand Total", None, None, None, str(summary["work_order_total"]), None,
+                      str(summary["executed_total"]), None, str(summary["overall_excess"]), None,
+                      str(summary["overall_saving"])], False))
+        rows.append(([None, f"Add Tender Premium ({summary['premium']['percent']:.2%} {summary['premium']['type']})",
+                      None, None, None, str(summary["tender_premium_f"]), None, str(summary["tender_premium_h"]), None,
+                      str(summary["tender_premium_j"]), None, str(summary["tender_premium_l"])], False))
+        rows.append(([None, "Grand Total including Tender Premium", None, None, None, str(summary["grand_total_f"]),
+                      None, str(summary["grand_total_h"]), None, str(summary["grand_total_j"]), None,
+                      str(summary["grand_total_l"])], False))
+        if summary["net_difference"] > 0:
+            label = "Overall Excess With Respect to the Work Order Amount Rs."
+            difference = round(summary["net_difference"])
         else:
-            row.cells[1].text = "Overall Saving With Respect to the Work Order Amount Rs."
-            row.cells[7].text = str(round(-data["summary"]["net_difference"]))
-            row.cells[9].text = f"{data['summary']['net_difference_percent']:2f}%"
+            label = "Overall Saving With Respect to the Work Order Amount Rs."
+            difference = round(-summary["net_difference"])
+        rows.append(([None, label, None, None, None, None, None, str(difference), None,
+                      f"{summary['net_difference_percent']:2f}%"], False))
+        add_bulk_table(doc, 12, rows)
     elif sheet_name == "Note Sheet":
         for note in data["notes"]:
             p = doc.add_paragraph(note)
-            p.runs[0].font.name = "Arial Rounded MT Bold"
+            if p.runs:
+                p.runs[0].font.name = "Arial Rounded MT Bold"
     doc.save(doc_path)
+    return doc_path
 
-# Remove @lru_cache decorator from functions that use dictionaries
-def get_first_page_html(data):
-    html = """
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <style>
-            table {
-                width: 100%;
-                border-collapse: collapse;
-                font-family: Arial, sans-serif;
-                font-size: 12px;
-            }
-            th, td {
-                border: 1px solid black;
-                padding: 5px;
-                text-align: center;
-            }
-            .bold {
-                font-weight: bold;
-            }
-            .underline {
-                text-decoration: underline;
-            }
-            .header {
-                font-size: 14px;
-                font-weight: bold;
-                margin-bottom: 10px;
-            }
-            .footer {
-                margin-top: 20px;
-                text-align: right;
-            }
-        </style>
-    </head>
-    <body>
-        <div class="header">
-            <p>STATE OF RAJASTHAN</p>
-            <p>DEPARTMENT OF PUBLIC WORKS</p>
-            <p>Udaipur Division</p>
-        </div>
-
-        <table>
-            <tr class="bold">
-                <th>Unit</th>
-                <th>Quantity</th>
-                <th>Serial No.</th>
-                <th>Description</th>
-                <th>Rate</th>
-                <th>Amount</th>
-                <th>Remark</th>
-            </tr>
+def word_doc_bytes(sheet_name: str, data: Dict[str, Any]) -> bytes:
+    """Build a section's Word document in memory, as create_word_doc does on disk"""
+    buffer = io.BytesIO()
+    create_word_doc(sheet_name, data, buffer)
+    return buffer.getvalue()
+
+def stream_section_html(sheet_name: str, data: Dict[str, Any]) -> Iterator[str]:
     """
-    
-    for item in data["items"]:
-        html += "<tr>"
-        html += f"<td>{item.get('unit', '')}</td>"
-        html += f"<td>{item.get('quantity', '')}</td>"
-        html += f"<td>{item.get('serial_no', '')}</td>"
-        html += f'<td class="left-align">{item.get("description", "")}</td>'
-        html += f"<td>{item.get('rate', '')}</td>"
-        html += f"<td>{item.get('amount', '')}</td>"
-        html += f'<td class="left-align">{item.get("remark", "")}</td>'
-        html += "</tr>"
-    
-    # Totals
-    html += f"""
-        <tr class="bold">
-            <td colspan="5" class="right-align">Grand Total</td>
-            <td>{data["totals"]["grand_total"]}</td>
-            <td></td>
-        </tr>
+    Render a bill section through its template in templates/, chunk by chunk.
+
+    Item rows are produced as the template loop reaches them, so a caller
+    writing the chunks to a file never holds the whole page in memory. The
+    time spent rendering is recorded as stage "html:<sheet_name>".
+
+    Raises:
+        ValueError: If the section has no template
     """
-    
-    html += """
-        </table>
-
-        <div class="footer">
-            <p>Prepared by:</p>
-            <p>Checked by:</p>
-            <p>Verified by:</p>
-        </div>
-    </body>
-    </html>
-    """
-    return html
-
-def get_last_page_html(data):
-    html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <style>
-            body {{
-                font-family: Arial, sans-serif;
-                font-size: 14px;
-                padding: 20px;
-            }}
-            .bold {{
-                font-weight: bold;
-            }}
-        </style>
-    </head>
-    <body>
-        <p class="bold">Payable Amount: {data["payable_amount"]}</p>
-        <p class="bold">Total in Words: {data["amount_words"]}</p>
-    </body>
-    </html>
-    """
-    return html
-
-def get_extra_items_html(data):
-    html = """
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <style>
-            table {
-                width: 100%;
-                border-collapse: collapse;
-                font-family: Arial, sans-serif;
-                font-size: 12px;
-            }
-            th, td {
-                border: 1px solid black;
-                padding: 5px;
-                text-align: center;
-            }
-            .bold {
-                font-weight: bold;
-            }
-            .underline {
-                text-decoration: underline;
-            }
-            .header {
-                font-size: 14px;
-                font-weight: bold;
-                margin-bottom: 10px;
-            }
-            .footer {
-                margin-top: 20px;
-                text-align: right;
-            }
-        </style>
-    </head>
-    <body>
-        <div class="header">
-            <p>STATE OF RAJASTHAN</p>
-            <p>DEPARTMENT OF PUBLIC WORKS</p>
-            <p>Udaipur Division</p>
-        </div>
-
-        <table>
-            <tr class="bold">
-                <th>Serial No.</th>
-                <th>Remark</th>
-                <th>Description</th>
-                <th>Quantity</th>
-                <th>Unit</th>
-                <th>Rate</th>
-                <th>Amount</th>
-            </tr>
+    if sheet_name not in SECTION_TEMPLATES:
+        raise ValueError(f"No HTML template found for sheet: {sheet_name}")
+    template = template_environment().get_template(SECTION_TEMPLATES[sheet_name])
+    return measured_chunks(f"html:{sheet_name}", template.generate(data=data))
+
+def render_section_html(sheet_name: str, data: Dict[str, Any]) -> str:
+    """Render a bill section through its template in templates/"""
+    return "".join(stream_section_html(sheet_name, data))
+
+def wkhtmltopdf_configuration():
     """
-    
-    for item in data["items"]:
-        html += "<tr>"
-        html += f"<td>{item['serial_no']}</td>"
-        html += f'<td class="left-align">{item["remark"]}</td>'
-        html += f'<td class="left-align">{item["description"]}</td>'
-        html += f"<td>{item['quantity']}</td>"
-        html += f"<td>{item['unit']}</td>"
-        html += f"<td>{item['rate']}</td>"
-        html += f"<td>{item['amount']}</td>"
-        html += "</tr>"
-    
-    html += """
-        </table>
-
-        <div class="footer">
-            <p>Prepared by:</p>
-            <p>Checked by:</p>
-            <p>Verified by:</p>
-        </div>
-    </body>
-    </html>
-    """
-    return html
-
-def get_deviation_statement_html(data):
-    html = """
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <style>
-            table {
-                width: 100%;
-                border-collapse: collapse;
-                font-family: Arial, sans-serif;
-                font-size: 12px;
-            }
-            th, td {
-                border: 1px solid black;
-                padding: 5px;
-                text-align: center;
-            }
-            .bold {
-                font-weight: bold;
-            }
-            .underline {
-                text-decoration: underline;
-            }
-            .header {
-                font-size: 14px;
-                font-weight: bold;
-                margin-bottom: 10px;
-            }
-            .footer {
-                margin-top: 20px;
-                text-align: right;
-            }
-        </style>
-    </head>
-    <body>
-        <div class="header">
-            <p>STATE OF RAJASTHAN</p>
-            <p>DEPARTMENT OF PUBLIC WORKS</p>
-            <p>Udaipur Division</p>
-        </div>
-
-        <table>
-            <tr class="bold">
-                <th>Serial No.</th>
-                <th>Description</th>
-                <th>Unit</th>
-                <th>Qty WO</th>
-                <th>Rate</th>
-                <th>Amt WO</th>
-                <th>Qty Bill</th>
-                <th>Amt Bill</th>
-                <th>Excess Qty</th>
-                <th>Excess Amt</th>
-                <th>Saving Qty</th>
-                <th>Saving Amt</th>
-            </tr>
+    Locate wkhtmltopdf: the WKHTMLTOPDF_PATH environment variable, the default
+    install location on Windows, or the executable on PATH.
     """
-    
-    for item in data["items"]:
-        html += "<tr>"
-        html += f"<td>{item['serial_no']}</td>"
-        html += f"<td>{item['description']}</td>"
-        html += f"<td>{item['unit']}</td>"
-        html += f"<td>{item['qty_wo']}</td>"
-        html += f"<td>{item['rate']}</td>"
-        html += f"<td>{item['amt_wo']}</td>"
-        html += f"<td>{item['qty_bill']}</td>"
-        html += f"<td>{item['amt_bill']}</td>"
-        html += f"<td>{item['excess_qty']}</td>"
-        html += f"<td>{item['excess_amt']}</td>"
-        html += f"<td>{item['saving_qty']}</td>"
-        html += f"<td>{item['saving_amt']}</td>"
-        html += "</tr>"
-    
-    # Summary
-    html += f"""
-        <tr class="bold">
-            <td colspan="5" class="right-align">Grand Total</td>
-            <td>{data["summary"]["work_order_total"]}</td>
-            <td>{data["summary"]["executed_total"]}</td>
-            <td></td>
-            <td>{data["summary"]["overall_excess"]}</td>
-            <td></td>
-            <td>{data["summary"]["overall_saving"]}</td>
-        </tr>
-        <tr class="bold">
-            <td colspan="5" class="right-align">Add Tender Premium ({data["summary"]["premium"]["percent"]:.2%} {data["summary"]["premium"]["type"]})</td>
-            <td>{data["summary"]["tender_premium_f"]}</td>
-            <td>{data["summary"]["tender_premium_h"]}</td>
-            <td></td>
-            <td>{data["summary"]["tender_premium_j"]}</td>
-            <td></td>
-            <td>{data["summary"]["tender_premium_l"]}</td>
-        </tr>
-        <tr class="bold">
-            <td colspan="5" class="right-align">Grand Total including Tender Premium</td>
-            <td>{data["summary"]["grand_total_f"]}</td>
-            <td>{data["summary"]["grand_total_h"]}</td>
-            <td></td>
-            <td>{data["summary"]["grand_total_j"]}</td>
-            <td></td>
-            <td>{data["summary"]["grand_total_l"]}</td>
-        </tr>
+    path = os.environ.get("WKHTMLTOPDF_PATH")
+    if not path and platform.system() == "Windows":
+        path = r"C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe"  # raw string is important here.
+    import pdfkit
+    return pdfkit.configuration(wkhtmltopdf=path) if path else pdfkit.configuration()
+
+class PdfRenderer:
     """
-    
-    if data["summary"]["net_difference"] > 0:
-        html += f"""
-        <tr class="bold">
-            <td colspan="7" class="right-align">Overall Excess With Respect to the Work Order Amount Rs.</td>
-            <td colspan="2">{round(data["summary"]["net_difference"])}</td>
-            <td colspan="2">{data["summary"]["net_difference_percent"]:.2f}%</td>
-        </tr>
+    Bounded wkhtmltopdf backend shared by every session of the server.
+
+    wkhtmltopdf cannot stay resident between documents, so its startup cost is
+    amortized instead: render() accepts all pages of a bill and passes them to
+    a single wkhtmltopdf invocation. A semaphore caps how many invocations run
+    at once; further requests queue until a renderer is free.
+    """
+
+    def __init__(self, max_workers: int = MAX_PDF_RENDERERS, queue_timeout: Optional[float] = PDF_QUEUE_TIMEOUT, configuration=None):
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        self.max_workers = max_workers
+        self.queue_timeout = queue_timeout
+        self._configuration = configuration
+        self._slots = threading.BoundedSemaphore(max_workers)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.waiting = 0
+
+    @property
+    def configuration(self):
+        # Resolved on first render so importing the app does not require wkhtmltopdf
+        if self._configuration is None:
+            self._configuration = wkhtmltopdf_configuration()
+        return self._configuration
+
+    def render(self, html_files: Union[str, List[str]], pdf_file: str, options: Optional[Dict[str, Any]] = None) -> str:
         """
-    else:
-        html += f"""
-        <tr class="bold">
-            <td colspan="7" class="right-align">Overall Saving With Respect to the Work Order Amount Rs.</td>
-            <td colspan="2">{round(-data["summary"]["net_difference"])}</td>
-            <td colspan="2">{data["summary"]["net_difference_percent"]:.2f}%</td>
-        </tr>
+        Render one or more HTML files into a single PDF with one wkhtmltopdf process.
+
+        Args:
+            html_files: HTML file path, or list of paths rendered in order as consecutive pages
+            pdf_file: Output PDF path
+            options: wkhtmltopdf options passed through pdfkit
+
+        Returns:
+            str: The output PDF path
+
+        Raises:
+            BillGenerationError: If no renderer became free within queue_timeout
         """
-    
-    html += """
-        </table>
-    </body>
-    </html>
-    """
-    return html
-
-def get_note_sheet_html(data):
-    html = """
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <style>
-            body {
-                font-family: Arial, sans-serif;
-                font-size: 14px;
-                padding: 20px;
-            }
-            p {
-                margin-bottom: 10px;
-            }
-            .signature {
-                margin-top: 50px;
-                text-align: right;
-            }
-        </style>
-    </head>
-    <body>
+        import pdfkit
+        with self._slot():
+            pdfkit.from_file(html_files, pdf_file, configuration=self.configuration, options=options)
+        return pdf_file
+
+    def render_bytes(
+        self,
+        html: Union[str, Iterable[str]],
+        options: Optional[Dict[str, Any]] = None,
+        max_memory_bytes: Optional[int] = None
+    ) -> bytes:
+        """
+        Render an HTML document to PDF bytes, piping it to wkhtmltopdf's stdin
+        and reading the PDF back from its stdout.
+
+        Chunks are collected up to max_memory_bytes; a larger document is
+        spilled to a temporary file, its remaining chunks written straight
+        to disk, and rendered from there.
+
+        Args:
+            html: The HTML document, as a string or chunks
+            options: wkhtmltopdf options passed through pdfkit
+            max_memory_bytes: Size above which the document is spilled;
+                defaults to IN_MEMORY_MAX_BYTES
+
+        Returns:
+            bytes: The PDF
+
+        Raises:
+            BillGenerationError: If no renderer became free within queue_timeout
+        """
+        import pdfkit
+        if max_memory_bytes is None:
+            max_memory_bytes = IN_MEMORY_MAX_BYTES
+        # The document is produced before taking a slot, so templates render
+        # while other bills hold the renderers
+        chunks = iter([html] if isinstance(html, str) else html)
+        buffered, size = [], 0
+        for chunk in chunks:
+            buffered.append(chunk)
+            size += len(chunk)
+            if size > max_memory_bytes:
+                break
+        else:
+            with self._slot():
+                return pdfkit.from_string("".join(buffered), False, configuration=self.configuration, options=options)
+        with tempfile.NamedTemporaryFile("w", suffix=".html", encoding="utf-8", dir=SPOOL_DIR, delete=False) as f:
+            f.writelines(buffered)
+            del buffered
+            f.writelines(chunks)
+        try:
+            with self._slot():
+                return pdfkit.from_file(f.name, False, configuration=self.configuration, options=options)
+        finally:
+            os.remove(f.name)
+
+    @contextmanager
+    def _slot(self):
+        # Wait for one of the max_workers renderer slots, giving up after queue_timeout
+        with self._lock:
+            self.waiting += 1
+            if self.active >= self.max_workers:
+                logger.info(f"PDF render queued: {self.active} running, {self.waiting} waiting")
+        acquired = self._slots.acquire(timeout=self.queue_timeout) if self.queue_timeout is not None else self._slots.acquire()
+        with self._lock:
+            self.waiting -= 1
+            if acquired:
+                self.active += 1
+        if not acquired:
+            raise BillGenerationError(f"No PDF renderer became available within {self.queue_timeout}s")
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+            self._slots.release()
+
+@shared_resource
+def default_pdf_renderer() -> PdfRenderer:
+    return PdfRenderer()
+
+# Shared by all sessions so concurrent users queue for the same renderers
+PDF_RENDERER = default_pdf_renderer()
+
+# How the bill PDF is produced; see bill_output_stages. The default pipes one
+# composed document to wkhtmltopdf without touching disk.
+PDF_RENDER_MODES = ("sections", "batch", "document")
+PDF_RENDER_MODE = os.environ.get("BILL_PDF_MODE", "document")
+
+# Sections laid out for a landscape page
+LANDSCAPE_SECTIONS = {"Deviation Statement"}
+
+# A4 portrait printable width over landscape printable width
+LANDSCAPE_ZOOM = 0.68
+
+# Document-level tags dropped when a section is embedded in the combined document
+_DOCUMENT_TAG_RE = re.compile(r"<!DOCTYPE[^>]*>|</?(?:html|head|body)\b[^>]*>", re.I)
+
+# A section's style blocks, rewritten by scope_section_css when it is embedded
+_STYLE_BLOCK_RE = re.compile(r"(<style\b[^>]*>)(.*?)(</style>)", re.I | re.S)
+_CSS_COMMENT_RE = re.compile(r"/\*.*?\*/", re.S)
+
+def _section_chunks(content: Union[str, Iterable[str]]) -> Iterable[str]:
+    return [content] if isinstance(content, str) else content
+
+def _css_block_end(css: str, start: int) -> int:
+    """Index just past the brace closing the block opened at css[start]"""
+    depth = 0
+    for index in range(start, len(css)):
+        if css[index] == "{":
+            depth += 1
+        elif css[index] == "}":
+            depth -= 1
+            if depth == 0:
+                return index + 1
+    return len(css)
+
+def scope_section_css(css: str, scope: str) -> str:
     """
-    
-    for note in data["notes"]:
-        html += f"<p>{note}</p>"
-    
-    html += """
-        <div class="signature">
-            <p>Signature: ______________________</p>
-            <p>Date: {data["current_date"]}</p>
-        </div>
-    </body>
-    </html>
-    """
-    return html
-
-def get_certificate_iii_html(data):
-    html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <style>
-            body {{
-                font-family: Arial, sans-serif;
-                font-size: 14px;
-                padding: 20px;
-            }}
-            .bold {{
-                font-weight: bold;
-            }}
-        </style>
-    </head>
-    <body>
-        <p class="bold">Payable Amount: {data["payable_amount"]}</p>
-        <p class="bold">Total in Words: {data["amount_words"]}</p>
-    </body>
-    </html>
+    Restrict a section's stylesheet to the elements under scope.
+
+    Every selector is prefixed with scope, and html/body selectors are
+    replaced by it, so one section's body, table and container rules do not
+    apply to the others once they share a document. Rules inside @media are
+    scoped the same way; @page rules are dropped because they would set the
+    page box of the whole document.
+
+    Args:
+        css: Contents of a style block
+        scope: Selector matching the section's wrapper element
+
+    Returns:
+        str: The scoped stylesheet
+    """
+    css = _CSS_COMMENT_RE.sub("", css)
+    scoped = []
+    position = 0
+    while True:
+        brace = css.find("{", position)
+        if brace == -1:
+            break
+        end = _css_block_end(css, brace)
+        prelude = css[position:brace].strip()
+        body = css[brace + 1:end - 1]
+        if prelude.lower().startswith("@media"):
+            scoped.append(f"{prelude} {{{scope_section_css(body, scope)}}}")
+        elif prelude.startswith("@"):
+            if not prelude.lower().startswith("@page"):
+                scoped.append(css[position:end].strip())
+        else:
+            selectors = []
+            for selector in prelude.split(","):
+                selector = selector.strip()
+                root = selector.split(None, 1)
+                if root and root[0].lower() in ("html", "body"):
+                    selectors.append(" ".join([scope] + root[1:]))
+                else:
+                    selectors.append(f"{scope} {selector}")
+            scoped.append(f"{', '.join(selectors)} {{{body}}}")
+        position = end
+    return "\n".join(scoped)
+
+def _embedded_section_chunks(content: Union[str, Iterable[str]], scope: str) -> Iterator[str]:
+    """A section's chunks without document tags and with its styles scoped"""
+    pending = ""
+    for chunk in _section_chunks(content):
+        chunk = pending + chunk
+        # Hold back a style block until its closing tag arrives
+        opening = chunk.lower().rfind("<style")
+        if opening != -1 and chunk.lower().find("</style>", opening) == -1:
+            pending = chunk
+            continue
+        pending = ""
+        chunk = _STYLE_BLOCK_RE.sub(lambda m: m.group(1) + scope_section_css(m.group(2), scope) + m.group(3), chunk)
+        yield _DOCUMENT_TAG_RE.sub("", chunk)
+    if pending:
+        yield _DOCUMENT_TAG_RE.sub("", pending)
+
+def compose_bill_document(sections: List[Tuple[str, Union[str, Iterable[str]]]]) -> Iterator[str]:
     """
-    return html
+    Stream the HTML of every bill section as one document.
 
-def generate_pdf_files(html_files, output_dir):
-    """Generate PDF files in parallel"""
+    Each section is wrapped in a div that starts a new page; its own
+    document, head and body tags are dropped chunk by chunk and its styles
+    are scoped to that div (see scope_section_css). wkhtmltopdf applies a single orientation to a whole
+    document, so sections in LANDSCAPE_SECTIONS are zoomed to fit the portrait
+    page width instead of being rotated, which keeps long tables paginating.
+
+    Args:
+        sections: (sheet name, HTML string or chunks) pairs in page order
+
+    Yields:
+        str: Chunks of a single HTML document containing all sections
+    """
+    yield f"""<!DOCTYPE html><html><head><meta charset="UTF-8"><style>
+        .bill-section {{ page-break-before: always; }}
+        .bill-section:first-child {{ page-break-before: avoid; }}
+        .bill-section.landscape {{ zoom: {LANDSCAPE_ZOOM}; }}
+    </style></head><body>"""
+    for sheet_name, content in sections:
+        orientation = "landscape" if sheet_name in LANDSCAPE_SECTIONS else "portrait"
+        yield f'<div class="bill-section {orientation}" data-section="{sheet_name}">'
+        yield from _embedded_section_chunks(content, f'.bill-section[data-section="{sheet_name}"]')
+        yield "</div>"
+    yield "</body></html>"
+
+def write_bill_html(sections: List[Tuple[str, Union[str, Iterable[str]]]], output_dir: str) -> List[str]:
+    """
+    Write each bill section to its own HTML file, the inputs of a batch render.
+
+    Args:
+        sections: (sheet name, HTML string or chunks) pairs in page order;
+            chunks are written to disk as they are produced
+        output_dir: Directory for the HTML files
+
+    Returns:
+        List[str]: HTML file paths in page order
+    """
+    html_files = []
+    for sheet_name, content in sections:
+        html_file = os.path.join(output_dir, f"{sheet_name.replace(' ', '_')}.html")
+        with open(html_file, "w", encoding="utf-8") as f:
+            f.writelines(_section_chunks(content))
+        html_files.append(html_file)
+    return html_files
+
+def render_bill_pdf(
+    sections: List[Tuple[str, Union[str, Iterable[str]]]],
+    output_dir: str,
+    renderer: Optional[PdfRenderer] = None
+) -> str:
+    """
+    Render the bill sections into output_dir/output.pdf in one wkhtmltopdf
+    run that takes every section file as an input, so each section keeps
+    its own page setup.
+
+    Args:
+        sections: (sheet name, HTML string or chunks) pairs in page order;
+            chunks are written to disk as they are produced
+        output_dir: Directory for the section HTML files and the output
+        renderer: Renderer to use; defaults to the shared PDF_RENDERER
+
+    Returns:
+        str: Path of the rendered PDF
+    """
+    started = time.perf_counter()
+    html_files = write_bill_html(sections, output_dir)
+    pdf_output = (renderer or PDF_RENDERER).render(html_files, os.path.join(output_dir, "output.pdf"))
+    logger.info(f"Rendered {len(html_files)} bill sections in {time.perf_counter() - started:.2f}s")
+    return pdf_output
+
+def user_cache_dir(name: str) -> str:
+    """Per-user location for cached data, under XDG_CACHE_HOME (or ~/.cache) rather than the shared temp dir"""
+    base = os.environ.get("XDG_CACHE_HOME") or os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "rajbill", name)
+
+def private_directory(path: str) -> str:
+    """
+    Create a directory only the current user can use, or check an existing one.
+
+    Cached results are unpickled when read, so a directory someone else could
+    write to would let them run code in this process.
+
+    Args:
+        path: Directory to create or check
+
+    Returns:
+        str: The same path
+
+    Raises:
+        PermissionError: If the directory is a symlink, is owned by another
+            user or is open to group or other users
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if os.path.islink(path) or not os.path.isdir(path):
+        raise PermissionError(f"Refusing to use {path}: not a plain directory")
+    # Owners and mode bits are not meaningful on Windows
+    if hasattr(os, "getuid"):
+        info = os.lstat(path)
+        if info.st_uid != os.getuid():
+            raise PermissionError(f"Refusing to use {path}: owned by uid {info.st_uid}, not {os.getuid()}")
+        if info.st_mode & 0o077:
+            raise PermissionError(f"Refusing to use {path}: mode {info.st_mode & 0o777:o} is open to other users; expected 700")
+    return path
+
+# Generated artifacts are cached on disk by content hash; 0 disables the cache
+RESULT_CACHE_DIR = os.environ.get("BILL_CACHE_DIR") or user_cache_dir("results")
+RESULT_CACHE_MAX_BYTES = int(float(os.environ.get("BILL_CACHE_MAX_MB", 512)) * 1024 * 1024)
+
+# Bump when process_bill or the Word writer change what they produce for the same inputs
+RESULT_CACHE_VERSION = "5"
+
+class ResultCache:
+    """
+    Content-addressed store for parsed workbooks, processed bills and the
+    PDF/DOCX files built from them.
+
+    Entries are files named by a hash of everything that went into them, so a
+    changed input simply misses. Reads refresh an entry's mtime and writes
+    evict the least recently used entries once the directory grows past
+    max_bytes.
+    """
+
+    def __init__(self, directory: str = RESULT_CACHE_DIR, max_bytes: int = RESULT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        private_directory(directory)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def lookup(self, key: str) -> Optional[str]:
+        """Return the path of a cached file and mark it recently used, or None"""
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        """Return a cached file's contents, or None"""
+        path = self.lookup(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put_bytes(self, key: str, data: bytes) -> None:
+        """Store data under key"""
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, self.path(key))
+        self.evict()
+
+    def load(self, key: str) -> Any:
+        """Return a cached object, or None"""
+        data = self.get_bytes(key)
+        if data is None:
+            return None
+        try:
+            return pickle.loads(data)
+        except (EOFError, pickle.UnpicklingError):
+            return None
+
+    def save(self, key: str, value: Any) -> None:
+        """Pickle an object into the cache under key"""
+        self.put_bytes(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def evict(self) -> None:
+        """Delete least recently used entries until the cache fits in max_bytes"""
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+def _cache_json_default(value: Any) -> Any:
+    if isinstance(value, ItemColumns):
+        return {"columns": {field: value.column(field) for field in value.FIELDS}, "total": getattr(value, "total", None)}
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"Cannot hash {type(value).__name__}")
+
+def cache_key(*parts: Any) -> str:
+    """Hash JSON-serializable parts (plus item stores, NumPy values and dates) into a cache key"""
+    payload = json.dumps([RESULT_CACHE_VERSION, *parts], sort_keys=True, default=_cache_json_default)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def template_digest(template_dir: str = TEMPLATE_DIR) -> str:
+    """Hash of the section templates, so edited templates miss cached PDFs"""
+    digest = hashlib.sha256()
+    for name in sorted(SECTION_TEMPLATES.values()):
+        with open(os.path.join(template_dir, name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def bill_cache_keys(section_data: Dict[str, Dict[str, Any]], mode: str = PDF_RENDER_MODE) -> Dict[str, str]:
+    """
+    Cache keys of the files built from a processed bill: "docx:<section>" for
+    each Word section, and "pdf:<section>" per section in sections mode or a
+    single "pdf" for the whole bill otherwise.
+    """
+    sections = {name: cache_key("section", name, section_data[name]) for name in BILL_SECTIONS}
+    templates = template_digest()
+    keys = {f"docx:{name}": cache_key("docx", sections[name]) for name in WORD_SECTIONS}
+    if mode == "sections":
+        keys.update({f"pdf:{name}": cache_key("pdf", sections[name], templates) for name in BILL_SECTIONS})
+    else:
+        keys["pdf"] = cache_key("pdf", mode, [sections[name] for name in BILL_SECTIONS], templates)
+    return keys
+
+@shared_resource
+def default_result_cache() -> Optional[ResultCache]:
+    if RESULT_CACHE_MAX_BYTES <= 0:
+        return None
     try:
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = []
-            for html_file in html_files:
-                pdf_file = os.path.join(output_dir, f"{os.path.splitext(os.path.basename(html_file))[0]}.pdf")
-                futures.append(executor.submit(pdfkit.from_file, html_file, pdf_file, configuration=config))
-            
-            # Wait for all PDFs to be generated
-            concurrent.futures.wait(futures)
-            
-            # Check for any errors
-            for future in futures:
+        return ResultCache()
+    except OSError as e:
+        logger.warning(f"Result cache disabled: {e}")
+        return None
+
+RESULT_CACHE = default_result_cache()
+
+# Threads per pipeline run; these stages mostly wait on wkhtmltopdf or disk
+PIPELINE_THREADS = int(os.environ.get("BILL_PIPELINE_THREADS", 8))
+
+# Size of the shared process pool for CPU-bound stages (DOCX building);
+# 0 runs every stage in threads
+PIPELINE_PROCESSES = int(os.environ.get("BILL_PIPELINE_PROCESSES", min(4, os.cpu_count() or 1)))
+
+class PipelineStage:
+    """
+    One unit of work in an output pipeline.
+
+    The stage runs as func(*dependency_results, *args, **kwargs), with the
+    results of depends_on passed first, in order.
+
+    Args:
+        name: Unique stage name, used for dependencies, results and timings
+        func: Callable to run; CPU-bound stages need a module-level function
+        args: Positional arguments for func, after the dependency results
+        kwargs: Keyword arguments for func
+        depends_on: Names of the stages that must finish first
+        cpu_bound: Run in the process pool instead of a thread
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable,
+        args: Sequence[Any] = (),
+        kwargs: Optional[Dict[str, Any]] = None,
+        depends_on: Sequence[str] = (),
+        cpu_bound: bool = False
+    ):
+        self.name = name
+        self.func = func
+        self.args = tuple(args)
+        self.kwargs = kwargs or {}
+        self.depends_on = tuple(depends_on)
+        self.cpu_bound = cpu_bound
+
+@shared_resource
+def _shared_process_pool(workers: int) -> concurrent.futures.Executor:
+    # spawn: the server is multi-threaded, and forking it is unsafe
+    return concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+def get_process_pool() -> Optional[concurrent.futures.Executor]:
+    """Shared process pool for CPU-bound stages, started on first use"""
+    if PIPELINE_PROCESSES < 1:
+        return None
+    return _shared_process_pool(PIPELINE_PROCESSES)
+
+def _picklable(func: Callable) -> bool:
+    # Functions from the script Streamlit executes live in its __main__, which a
+    # spawned worker cannot import; those stages stay in threads
+    if getattr(func, "__module__", None) == "__main__":
+        return False
+    try:
+        pickle.dumps(func)
+        return True
+    except (pickle.PicklingError, AttributeError, TypeError):
+        return False
+
+def run_pipeline(
+    stages: List[PipelineStage],
+    max_workers: int = PIPELINE_THREADS,
+    process_pool: Optional[concurrent.futures.Executor] = None,
+    on_complete: Optional[Callable[[str, Any], None]] = None
+) -> Tuple[Dict[str, Any], Dict[str, float]]:
+    """
+    Run stages as a dependency graph, starting each one as soon as its
+    dependencies have finished, so the wall-clock time is that of the longest
+    chain rather than the sum of the stages.
+
+    Args:
+        stages: Stages to run
+        max_workers: Thread pool size for stages that are not CPU bound
+        process_pool: Executor for CPU-bound stages; defaults to the shared
+            process pool, or threads when process workers are disabled
+        on_complete: Called as on_complete(name, result) on the calling
+            thread as each stage finishes
+
+    Returns:
+        Tuple of stage results and stage timings in seconds, both keyed by
+        stage name; timings also hold the pipeline wall-clock time under "total".
+        Each stage's wall time, CPU time and peak RSS are also recorded with
+        record_stage_metrics
+
+    Raises:
+        ValueError: If stage names repeat or the dependencies are unknown or cyclic
+        Exception: The first error raised by a stage; stages not yet started are skipped
+    """
+    by_name = {stage.name: stage for stage in stages}
+    if len(by_name) != len(stages):
+        raise ValueError("Pipeline stage names must be unique")
+    for stage in stages:
+        missing = [dep for dep in stage.depends_on if dep not in by_name]
+        if missing:
+            raise ValueError(f"Stage '{stage.name}' depends on unknown stages: {', '.join(missing)}")
+    # Reject cycles up front rather than deadlocking on them
+    order, visiting, done = [], set(), set()
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"Pipeline stages form a cycle through '{name}'")
+        visiting.add(name)
+        for dep in by_name[name].depends_on:
+            visit(dep)
+        visiting.discard(name)
+        done.add(name)
+        order.append(name)
+    for stage in stages:
+        visit(stage.name)
+
+    profile = _active_profile.get()
+    if profile is not None:
+        # A profiled run keeps every stage in this process, where it can be captured
+        process_pool = None
+    elif process_pool is None:
+        process_pool = get_process_pool()
+    results, timings = {}, {}
+    pending = list(order)
+    running = {}
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as threads:
+        try:
+            while pending or running:
+                for name in [n for n in pending if all(dep in results for dep in by_name[n].depends_on)]:
+                    stage = by_name[name]
+                    executor = process_pool if stage.cpu_bound and process_pool is not None and _picklable(stage.func) else threads
+                    args = tuple(results[dep] for dep in stage.depends_on) + stage.args
+                    # Thread stages run in a copy of this context, so metrics
+                    # recorded inside them reach collect_stage_metrics
+                    call = (_measure,) if executor is process_pool else (contextvars.copy_context().run, _measure)
+                    func = stage.func if profile is None else partial(profile.run, stage.func)
+                    running[executor.submit(*call, func, args, stage.kwargs, name)] = name
+                    pending.remove(name)
+                finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    results[name], metrics = future.result()
+                    timings[name] = metrics["wall_s"]
+                    record_stage_metrics(metrics)
+                    if on_complete is not None:
+                        on_complete(name, results[name])
+        except Exception:
+            for future in running:
+                future.cancel()
+            raise
+    timings["total"] = time.perf_counter() - started
+    logger.info(f"Pipeline finished {len(stages)} stages in {timings['total']:.2f}s")
+    return results, timings
+
+# Sections in page order; Certificate III only goes into the PDF
+BILL_SECTIONS = ("First Page", "Last Page", "Extra Items", "Deviation Statement", "Note Sheet", "Certificate III")
+WORD_SECTIONS = ("First Page", "Last Page", "Extra Items", "Deviation Statement", "Note Sheet")
+
+def bill_section_data(first_page_data, last_page_data, deviation_data, extra_items_data, note_sheet_data, certificate_iii_data) -> Dict[str, Dict[str, Any]]:
+    """Map each section name to the data its template and Word writer take, from process_bill's results"""
+    return {
+        "First Page": first_page_data,
+        "Last Page": last_page_data,
+        "Extra Items": {"items": extra_items_data},
+        "Deviation Statement": deviation_data,
+        "Note Sheet": note_sheet_data,
+        "Certificate III": certificate_iii_data
+    }
+
+def bill_document_chunks(section_data: Dict[str, Dict[str, Any]]) -> Iterator[str]:
+    """Chunks of every section composed into one HTML document (see compose_bill_document)"""
+    return compose_bill_document([(name, stream_section_html(name, section_data[name])) for name in BILL_SECTIONS])
+
+def _render_section_pdf(sheet_name: str, data: Dict[str, Any], renderer: Optional[PdfRenderer]) -> bytes:
+    return (renderer or PDF_RENDERER).render_bytes(stream_section_html(sheet_name, data))
+
+def _render_document_pdf(section_data: Dict[str, Dict[str, Any]], renderer: Optional[PdfRenderer]) -> bytes:
+    return (renderer or PDF_RENDERER).render_bytes(bill_document_chunks(section_data))
+
+def _render_batch_pdf(section_data: Dict[str, Dict[str, Any]], renderer: Optional[PdfRenderer]) -> bytes:
+    # wkhtmltopdf reads several inputs only from files, so the sections are
+    # streamed to a scratch directory removed once the PDF is read back
+    with tempfile.TemporaryDirectory(dir=SPOOL_DIR) as output_dir:
+        sections = [(name, stream_section_html(name, section_data[name])) for name in BILL_SECTIONS]
+        with open(render_bill_pdf(sections, output_dir, renderer), "rb") as f:
+            return f.read()
+
+def _merge_pdf_bytes(*pdfs: bytes) -> bytes:
+    output = io.BytesIO()
+    merge_pdfs([io.BytesIO(pdf) for pdf in pdfs], output)
+    return output.getvalue()
+
+# Files of a bill's output ZIP, as bill_output_stages stage names
+BILL_ARTIFACTS = ("pdf",) + tuple(f"docx:{name}" for name in WORD_SECTIONS)
+
+# PDF and DOCX are already compressed, so by default members are stored as-is;
+# BILL_ZIP_COMPRESSION=deflated trades CPU for a slightly smaller archive
+ZIP_COMPRESSION_METHODS = {"stored": zipfile.ZIP_STORED, "deflated": zipfile.ZIP_DEFLATED}
+ZIP_COMPRESSION = os.environ.get("BILL_ZIP_COMPRESSION", "stored")
+ZIP_COMPRESSLEVEL = int(os.environ.get("BILL_ZIP_LEVEL", 6))
+
+# Bytes per chunk handed out by stream_bill_outputs
+ZIP_STREAM_CHUNK_BYTES = 64 * 1024
+
+def output_file_name(artifact: str) -> str:
+    """Name in the output ZIP of a bill_output_stages artifact ("pdf" or "docx:<section>")"""
+    kind, _, section = artifact.partition(":")
+    return f"{section.replace(' ', '_')}.{kind}" if section else "output.pdf"
+
+def bill_output_stages(
+    section_data: Dict[str, Dict[str, Any]],
+    mode: str = PDF_RENDER_MODE,
+    renderer: Optional[PdfRenderer] = None,
+    cached: Optional[Dict[str, bytes]] = None
+) -> List[PipelineStage]:
+    """
+    Stages producing a bill's files in memory: the bill PDF and one DOCX per
+    Word section, named by BILL_ARTIFACTS.
+
+    Modes:
+        sections: each section is piped to wkhtmltopdf by its own
+            "pdf:<section>" stage and the PDFs are merged by the "pdf" stage
+        batch: one wkhtmltopdf run taking every section's HTML file as an
+            input (see render_bill_pdf)
+        document: the sections composed into one HTML document (see
+            compose_bill_document) and piped to a single run
+
+    Section HTML is streamed into the renderer chunk by chunk rather than
+    joined into one string.
+
+    Args:
+        section_data: Section name to data, as returned by bill_section_data
+        mode: One of PDF_RENDER_MODES
+        renderer: Renderer to use; defaults to the shared PDF_RENDERER
+        cached: Contents of files already built, keyed like bill_cache_keys;
+            their stages return these instead of rebuilding
+
+    Returns:
+        List[PipelineStage]: Stages for run_pipeline; the BILL_ARTIFACTS
+        stages return their file's bytes
+    """
+    if mode not in PDF_RENDER_MODES:
+        raise ValueError(f"PDF render mode must be one of: {', '.join(PDF_RENDER_MODES)}")
+    cached = cached or {}
+
+    def stage(name, func, args=(), **kwargs):
+        if name in cached:
+            return PipelineStage(name, bytes, (cached[name],))
+        return PipelineStage(name, func, args, **kwargs)
+
+    if "pdf" in cached:
+        stages = [stage("pdf", None)]
+    elif mode == "sections":
+        stages = [stage(f"pdf:{name}", _render_section_pdf, (name, section_data[name], renderer)) for name in BILL_SECTIONS]
+        stages.append(PipelineStage("pdf", _merge_pdf_bytes, depends_on=[f"pdf:{name}" for name in BILL_SECTIONS]))
+    elif mode == "batch":
+        stages = [PipelineStage("pdf", _render_batch_pdf, (section_data, renderer))]
+    else:
+        stages = [PipelineStage("pdf", _render_document_pdf, (section_data, renderer))]
+    stages.extend(
+        stage(f"docx:{name}", word_doc_bytes, (name, section_data[name]), cpu_bound=True)
+        for name in WORD_SECTIONS
+    )
+    return stages
+
+def _workbook_bytes(source: Union[pd.ExcelFile, str, Any]) -> Optional[bytes]:
+    # Uploaded files and paths can be hashed; an already opened pd.ExcelFile cannot
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            return f.read()
+    if hasattr(source, "getvalue"):
+        return source.getvalue()
+    if hasattr(source, "read"):
+        data = source.read()
+        source.seek(0)
+        return data
+    return None
+
+def process_workbook(
+    source: Union[pd.ExcelFile, str, Any],
+    user_inputs: Dict[str, Any],
+    cache: Optional[ResultCache]
+) -> Tuple[Tuple[Dict[str, Any], ...], Dict[str, float]]:
+    """
+    Parse a workbook and run process_bill on it, the steps ahead of the
+    output pipeline.
+
+    Args:
+        source: Workbook path, file-like object or pd.ExcelFile
+        user_inputs: Inputs already checked by validate_user_inputs
+        cache: Result cache to read and fill, if any
+
+    Returns:
+        Tuple of (process_bill's output, {"parse": seconds, "process": seconds})
+
+    Raises:
+        BillGenerationError: If the workbook lacks a required sheet or column
+        ValueError: If pandas cannot read the workbook
+    """
+    # Parsed sheets are cached per workbook, processed bills per workbook,
+    # inputs and alignment. Bills are stored undated and dated on the way out.
+    started = time.perf_counter()
+    data = _workbook_bytes(source) if cache is not None else None
+    if data is None:
+        sheets, _ = read_excel_sheets(source)
+        parsed = time.perf_counter()
+    else:
+        workbook_key = hashlib.sha256(data).hexdigest()
+        bill_key = cache_key("bill", workbook_key, user_inputs, QUANTITY_ALIGNMENT)
+        bill = cache.load(bill_key)
+        if bill is not None:
+            logger.info("Reusing processed bill from the result cache")
+            return dated_bill(bill), {"parse": 0.0, "process": time.perf_counter() - started}
+        sheets_key = cache_key("sheets", workbook_key)
+        sheets = cache.load(sheets_key)
+        if sheets is None:
+            sheets, _ = read_excel_sheets(io.BytesIO(data))
+            cache.save(sheets_key, sheets)
+        parsed = time.perf_counter()
+    bill = process_bill(
+        sheets["Work Order"],
+        sheets["Bill Quantity"],
+        sheets["Extra Items"],
+        user_inputs["premium_percent"],
+        user_inputs["premium_type"],
+        user_inputs["amount_paid_last_bill"],
+        user_inputs["is_first_bill"],
+        user_inputs
+    )
+    if data is not None:
+        cache.save(bill_key, dated_bill(bill, ""))
+    return bill, {"parse": parsed - started, "process": time.perf_counter() - parsed}
+
+def write_bill_archive(
+    source: Union[pd.ExcelFile, str, Any],
+    user_inputs: Dict[str, Any],
+    sink: BinaryIO,
+    mode: str = PDF_RENDER_MODE,
+    renderer: Optional[PdfRenderer] = None,
+    cache: Optional[ResultCache] = None,
+    compression: str = ZIP_COMPRESSION,
+    bill: Optional[Tuple[Dict[str, Any], ...]] = None
+) -> Dict[str, float]:
+    """
+    Generate a bill from its workbook and write its output ZIP to sink:
+    parse, process_bill, then the output pipeline, with each PDF/DOCX added
+    to the archive as soon as its stage finishes.
+
+    With a cache, a workbook seen before is not parsed again, identical
+    inputs skip process_bill, and only the PDFs and Word documents of
+    sections whose data changed are rebuilt.
+
+    Args:
+        source: Workbook path, file-like object or pd.ExcelFile
+        user_inputs: Inputs already checked by validate_user_inputs
+        sink: Writable binary stream; it need not be seekable
+        mode: One of PDF_RENDER_MODES
+        renderer: Renderer to use; defaults to the shared PDF_RENDERER
+        cache: Result cache to read and fill, if any
+        compression: One of ZIP_COMPRESSION_METHODS
+        bill: process_bill's output for source and user_inputs, if already
+            computed; the workbook is then neither parsed nor processed, and
+            the bill is dated today
+
+    Returns:
+        Dict[str, float]: Stage timings in seconds, including "parse" and
+        "process" ahead of the pipeline stages and "zip" for writing the members
+    """
+    if compression not in ZIP_COMPRESSION_METHODS:
+        raise ValueError(f"ZIP compression must be one of: {', '.join(ZIP_COMPRESSION_METHODS)}")
+    started = time.perf_counter()
+    if bill is None:
+        bill, timings = process_workbook(source, user_inputs, cache)
+    else:
+        bill = dated_bill(bill)
+        timings = {"parse": 0.0, "process": 0.0}
+    section_data = bill_section_data(*bill)
+    keys, cached = {}, {}
+    if cache is not None:
+        keys = bill_cache_keys(section_data, mode)
+        cached = {name: data for name, key in keys.items() if (data := cache.get_bytes(key)) is not None}
+        logger.info(f"Result cache: {len(cached)} of {len(keys)} files reused")
+
+    # Members are written as their stages finish; their time adds up to one "zip" stage
+    zip_metrics = {"stage": "zip", "status": "ok", "wall_s": 0.0, "cpu_s": 0.0}
+    with zipfile.ZipFile(sink, "w", ZIP_COMPRESSION_METHODS[compression], compresslevel=ZIP_COMPRESSLEVEL) as zipf:
+        def add_member(name, data):
+            if name in BILL_ARTIFACTS:
+                _, metrics = _measure(zipf.writestr, (output_file_name(name), data), {}, "zip")
+                zip_metrics["wall_s"] += metrics["wall_s"]
+                zip_metrics["cpu_s"] += metrics["cpu_s"]
+            # Files are cached as they are built, so a retry after a failed
+            # stage only rebuilds what is missing
+            if name in keys and name not in cached:
                 try:
-                    future.result()
-                except Exception as e:
-                    logger.error(f"Error generating PDF: {str(e)}")
-                    raise Exception(f"Error generating PDF: {str(e)}")
-                    
-            logger.info("All PDF files generated successfully")
-    except Exception as e:
-        logger.error(f"Error in PDF generation process: {str(e)}")
+                    cache.put_bytes(keys[name], data)
+                except OSError as e:
+                    logger.warning(f"Could not cache {output_file_name(name)}: {str(e)}")
+        _, pipeline_timings = run_pipeline(bill_output_stages(section_data, mode, renderer, cached), on_complete=add_member)
+    zip_metrics.update(wall_s=round(zip_metrics["wall_s"], 4), cpu_s=round(zip_metrics["cpu_s"], 4),
+                       peak_rss_mb=peak_rss_mb(), pid=os.getpid())
+    record_stage_metrics(zip_metrics)
+
+    timings.update(pipeline_timings)
+    timings["zip"] = zip_metrics["wall_s"]
+    timings["total"] = time.perf_counter() - started
+    return timings
+
+def generate_bill_outputs(
+    source: Union[pd.ExcelFile, str, Any],
+    user_inputs: Dict[str, Any],
+    mode: str = PDF_RENDER_MODE,
+    renderer: Optional[PdfRenderer] = None,
+    cache: Optional[ResultCache] = None,
+    compression: str = ZIP_COMPRESSION,
+    bill: Optional[Tuple[Dict[str, Any], ...]] = None
+) -> Tuple[BinaryIO, Dict[str, float]]:
+    """
+    Generate a bill's output ZIP in memory; see write_bill_archive.
+
+    Returns:
+        Tuple of the ZIP as a file object positioned at its start (spilled to
+        disk past IN_MEMORY_MAX_BYTES) and stage timings in seconds
+    """
+    archive = tempfile.SpooledTemporaryFile(max_size=IN_MEMORY_MAX_BYTES, dir=SPOOL_DIR)
+    try:
+        timings = write_bill_archive(source, user_inputs, archive, mode, renderer, cache, compression, bill)
+    except Exception:
+        archive.close()
         raise
+    archive.seek(0)
+    return archive, timings
+
+class _ChunkSink:
+    # Write-only stream for ZipFile that hands the bytes written to a queue in chunks
+    def __init__(self, chunks: "queue.Queue", chunk_size: int, cancelled: threading.Event):
+        self._chunks = chunks
+        self._chunk_size = chunk_size
+        self._cancelled = cancelled
+        self._buffer = bytearray()
+
+    def write(self, data) -> int:
+        self._buffer += data
+        if len(self._buffer) >= self._chunk_size:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        if self._buffer:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+
+    def _put(self, item) -> None:
+        # Bounded queue: wait for the reader, unless it has gone away
+        while True:
+            if self._cancelled.is_set():
+                raise BillGenerationError("Archive stream was closed by the reader")
+            try:
+                self._chunks.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+def stream_bill_outputs(
+    source: Union[pd.ExcelFile, str, Any],
+    user_inputs: Dict[str, Any],
+    mode: str = PDF_RENDER_MODE,
+    renderer: Optional[PdfRenderer] = None,
+    cache: Optional[ResultCache] = None,
+    compression: str = ZIP_COMPRESSION,
+    chunk_size: int = ZIP_STREAM_CHUNK_BYTES,
+    bill: Optional[Tuple[Dict[str, Any], ...]] = None
+) -> Iterator[bytes]:
+    """
+    Generate a bill's output ZIP as a stream of chunks, e.g. for an HTTP
+    response body; see write_bill_archive.
+
+    The bill is built on a background thread and each member is streamed
+    as soon as its stage finishes, so only a few chunks are held in memory
+    at a time. Closing the iterator early stops the build. Passing bill
+    (see process_workbook) streams its outputs without parsing source again.
+
+    Yields:
+        bytes: Consecutive chunks of the ZIP
+
+    Raises:
+        Exception: Whatever the build raised, after the chunks written before it
+    """
+    chunks = queue.Queue(maxsize=8)
+    cancelled = threading.Event()
+    done = object()
+
+    def build():
+        sink = _ChunkSink(chunks, chunk_size, cancelled)
+        try:
+            write_bill_archive(source, user_inputs, sink, mode, renderer, cache, compression, bill)
+            sink.close()
+            outcome = done
+        except Exception as e:
+            outcome = e
+        try:
+            _ChunkSink(chunks, chunk_size, cancelled)._put(outcome)
+        except BillGenerationError:
+            pass
+
+    worker = threading.Thread(target=build, name="bill-archive-stream", daemon=True)
+    worker.start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        cancelled.set()
 
 def sanitize_input(value: Any, field_type: str) -> Any:
     """
@@ -1169,6 +2699,266 @@ def validate_user_inputs(user_inputs: Dict[str, Any]) -> Dict[str, Any]:
     except Exception as e:
         raise ValueError(f"Error validating user inputs: {str(e)}")
 
+# Seconds the page keeps parsed workbooks, processed bills and finished ZIPs in memory
+SESSION_CACHE_TTL = float(os.environ.get("BILL_SESSION_CACHE_TTL", 3600))
+
+# Parsed workbooks and processed bills kept in memory, across sessions
+SESSION_CACHE_ENTRIES = int(os.environ.get("BILL_SESSION_CACHE_ENTRIES", 16))
+
+# Total size of the finished ZIPs one session keeps for downloading again
+SESSION_ARCHIVE_MAX_BYTES = int(float(os.environ.get("BILL_SESSION_ARCHIVE_MAX_MB", 64)) * 1024 * 1024)
+
+@st.cache_data(ttl=SESSION_CACHE_TTL, max_entries=SESSION_CACHE_ENTRIES, show_spinner=False)
+def parse_uploaded_workbook(workbook_hash: str, _workbook: bytes) -> Dict[str, pd.DataFrame]:
+    """
+    Parse an uploaded workbook once per content hash.
+
+    Args:
+        workbook_hash: sha256 of the workbook, the cache key
+        _workbook: The workbook file contents (not hashed by Streamlit)
+    """
+    sheets, _ = read_excel_sheets(io.BytesIO(_workbook))
+    return sheets
+
+@st.cache_data(ttl=SESSION_CACHE_TTL, max_entries=SESSION_CACHE_ENTRIES, show_spinner=False)
+def process_uploaded_bill(workbook_hash: str, user_inputs: Dict[str, Any], _workbook: bytes) -> Tuple[Dict[str, Any], ...]:
+    """
+    process_bill's output for an uploaded workbook, once per content hash and inputs.
+
+    Args:
+        workbook_hash: sha256 of the workbook
+        user_inputs: Inputs already checked by validate_user_inputs
+        _workbook: The workbook file contents (not hashed by Streamlit)
+    """
+    sheets = parse_uploaded_workbook(workbook_hash, _workbook)
+    return process_bill(
+        sheets["Work Order"],
+        sheets["Bill Quantity"],
+        sheets["Extra Items"],
+        user_inputs["premium_percent"],
+        user_inputs["premium_type"],
+        user_inputs["amount_paid_last_bill"],
+        user_inputs["is_first_bill"],
+        user_inputs
+    )
+
+class SessionArchiveCache:
+    """
+    Finished output ZIPs of one browser session, so a rerun or a second
+    download reuses the archive instead of building it again.
+
+    Entries expire after ttl seconds and the least recently used are
+    dropped once the ZIPs add up to more than max_bytes.
+    """
+
+    def __init__(self, max_bytes: int = SESSION_ARCHIVE_MAX_BYTES, ttl: float = SESSION_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """The entry stored under key ("data", "timings", "metrics"), or None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry["stored_at"] > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, data: bytes, timings: Dict[str, float], metrics: List[Dict[str, Any]]) -> None:
+        self._entries[key] = {"data": data, "timings": timings, "metrics": metrics, "stored_at": time.time()}
+        self._entries.move_to_end(key)
+        total = sum(len(entry["data"]) for entry in self._entries.values())
+        # The newest archive is kept even when it alone is over the limit
+        while total > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            total -= len(evicted["data"])
+
+def session_archives() -> SessionArchiveCache:
+    """This browser session's SessionArchiveCache"""
+    if "bill_archives" not in st.session_state:
+        st.session_state["bill_archives"] = SessionArchiveCache()
+    return st.session_state["bill_archives"]
+
+def show_bill_result(entry: Dict[str, Any], show_timings: bool) -> None:
+    """Download button and optional timing breakdown for a finished bill"""
+    st.download_button(
+        label="Download Output Files",
+        data=entry["data"],
+        file_name="bill_output.zip",
+        mime="application/zip"
+    )
+    if show_timings:
+        with st.expander(f"Timing breakdown ({entry['timings']['total']:.2f}s)", expanded=True):
+            breakdown = stage_metrics_frame(entry["metrics"])
+            st.bar_chart(breakdown.set_index("stage")[["wall_s", "cpu_s"]])
+            st.dataframe(breakdown, hide_index=True)
+
+# Item rows per page of the in-browser preview
+PREVIEW_PAGE_ROWS = int(os.environ.get("BILL_PREVIEW_ROWS", 50))
+
+# Columns of the previewed item tables: (item key, heading as in the section's template)
+PREVIEW_COLUMNS = {
+    "First Page": (("serial_no", "Serial No."), ("description", "Description"), ("unit", "Unit"),
+                   ("quantity", "Quantity"), ("rate", "Rate"), ("amount", "Amount"), ("remark", "Remark")),
+    "Deviation Statement": (("serial_no", "Serial No."), ("description", "Description"), ("unit", "Unit"),
+                            ("qty_wo", "Qty WO"), ("rate", "Rate"), ("amt_wo", "Amt WO"), ("qty_bill", "Qty Bill"),
+                            ("amt_bill", "Amt Bill"), ("excess_qty", "Excess Qty"), ("excess_amt", "Excess Amt"),
+                            ("saving_qty", "Saving Qty"), ("saving_amt", "Saving Amt"))
+}
+
+def preview_page_count(rows: int, page_rows: int = PREVIEW_PAGE_ROWS) -> int:
+    """Pages needed to preview rows items; an empty list still has one (empty) page"""
+    return max(1, -(-rows // page_rows))
+
+def preview_items_page(
+    sheet_name: str,
+    items: Union[LineItems, Sequence[Dict[str, Any]]],
+    page: int,
+    page_rows: int = PREVIEW_PAGE_ROWS
+) -> pd.DataFrame:
+    """
+    One page of a section's items as a table, building only that page's rows.
+
+    Args:
+        sheet_name: A section in PREVIEW_COLUMNS
+        items: The section's LineItems or list of item dicts
+        page: 1-based page number; clamped to the pages there are
+        page_rows: Rows per page
+    """
+    page = min(max(page, 1), preview_page_count(len(items), page_rows))
+    rows = items[(page - 1) * page_rows:page * page_rows]
+    columns = PREVIEW_COLUMNS[sheet_name]
+    return pd.DataFrame([[row.get(key, "") for key, _ in columns] for row in rows],
+                        columns=[heading for _, heading in columns], dtype=object)
+
+def _show_items_preview(sheet_name: str, items: Union[LineItems, Sequence[Dict[str, Any]]]) -> None:
+    pages = preview_page_count(len(items))
+    page = 1
+    if pages > 1:
+        page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, key=f"preview_page:{sheet_name}")
+    st.dataframe(preview_items_page(sheet_name, items, page), hide_index=True, use_container_width=True)
+    st.caption(f"{len(items)} rows")
+
+def show_bill_preview(bill: Tuple[Dict[str, Any], ...]) -> None:
+    """Figures and items of the First Page, Deviation Statement and Certificate III, without building any file"""
+    first_page_data, _, deviation_data, _, _, certificate_iii_data = bill
+    first_page, deviation, certificate = st.tabs(["First Page", "Deviation Statement", "Certificate III"])
+    with first_page:
+        totals = first_page_data["totals"]
+        premium = totals["premium"]
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Grand Total", f"{totals['grand_total']:,}")
+        col2.metric(f"Premium ({format_percent(premium['percent'])} {premium['type']})", f"{premium['amount']:,}")
+        col3.metric("Payable", f"{totals['payable']:,}")
+        _show_items_preview("First Page", first_page_data["items"])
+    with deviation:
+        summary = deviation_data["summary"]
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Work Order Total", f"{summary['work_order_total']:,}")
+        col2.metric("Executed Total", f"{summary['executed_total']:,}")
+        col3.metric("Overall Excess", f"{summary['overall_excess']:,}")
+        col4.metric("Overall Saving", f"{summary['overall_saving']:,}")
+        st.write(f"Net difference: {summary['net_difference']:,} ({format_percent(summary['net_difference_percent'])})")
+        _show_items_preview("Deviation Statement", deviation_data["items"])
+        if deviation_data.get("rejected"):
+            with st.expander(f"{len(deviation_data['rejected'])} rows left out of the deviation statement"):
+                rejected = pd.DataFrame(deviation_data["rejected"], columns=["row", "serial_no", "reason"])
+                st.dataframe(rejected.rename(columns={"row": "Row", "serial_no": "Serial No.", "reason": "Reason"}), hide_index=True)
+    with certificate:
+        col1, col2 = st.columns(2)
+        col1.metric("Payable Amount", f"{certificate_iii_data['payable_amount']:,}")
+        col2.metric("By Cheque", f"{certificate_iii_data['by_cheque']:,}")
+        st.write(f"Rupees {certificate_iii_data['cheque_amount_words']}")
+        certificate_items = pd.DataFrame(certificate_iii_data["certificate_items"], columns=["name", "percentage", "value"])
+        st.dataframe(certificate_items.rename(columns={"name": "Item", "percentage": "Percentage", "value": "Value"}), hide_index=True)
+
+def export_bill(workbook: bytes, user_inputs: Dict[str, Any]) -> None:
+    """
+    Build a bill's output ZIP, or reuse this session's copy, and make it the
+    bill the page offers for download.
+
+    Runs profiled when BILL_PROFILE is set or the page has ?profile=1; the
+    caches are skipped so the capture covers the full build, and the
+    profile is offered for download too.
+    """
+    profiling = profiling_requested() or st.query_params.get("profile") == "1"
+    workbook_hash = hashlib.sha256(workbook).hexdigest()
+    archive_key = cache_key("archive", workbook_hash, user_inputs, PDF_RENDER_MODE, ZIP_COMPRESSION)
+
+    # The same upload and inputs reuse this session's finished ZIP
+    if not profiling and session_archives().get(archive_key) is not None:
+        logger.info("Reusing this session's output files")
+        st.session_state["last_bill"] = archive_key
+        return
+
+    with (profile_bill() if profiling else nullcontext()) as profile:
+        # Parse, process and build every output in memory; PDF rendering, the
+        # Word documents and the ZIP run as one dependency graph
+        with collect_stage_metrics() as stage_metrics:
+            if profiling:
+                archive, timings = generate_bill_outputs(io.BytesIO(workbook), user_inputs, cache=None)
+            else:
+                bill = process_uploaded_bill(workbook_hash, user_inputs, workbook)
+                archive, timings = generate_bill_outputs(io.BytesIO(workbook), user_inputs, cache=RESULT_CACHE, bill=bill)
+    with archive:
+        session_archives().put(archive_key, archive.read(), timings, stage_metrics)
+    st.session_state["last_bill"] = archive_key
+
+    if profile is not None:
+        profile_zip = io.BytesIO()
+        with zipfile.ZipFile(profile_zip, "w", zipfile.ZIP_DEFLATED) as zipf:
+            for name, data in profile.files("bill_output").items():
+                zipf.writestr(name, data)
+        st.download_button(
+            label="Download Profile",
+            data=profile_zip.getvalue(),
+            file_name="bill_profile.zip",
+            mime="application/zip"
+        )
+
+    logger.info("Bill generation completed successfully")
+
+def job_queue():
+    """The process's background bill queue, imported on first use"""
+    # bill_jobs imports this module, so it cannot be imported at the top
+    from bill_jobs import get_job_queue
+    return get_job_queue()
+
+def session_job_user() -> str:
+    """Queue user for this browser session, so its jobs count towards one per-user limit"""
+    if "job_user" not in st.session_state:
+        st.session_state["job_user"] = f"streamlit-{uuid.uuid4().hex}"
+    return st.session_state["job_user"]
+
+def show_background_jobs() -> None:
+    """List this session's queued bills with their status and download buttons"""
+    if "job_user" not in st.session_state:
+        return
+    queue = job_queue()
+    jobs = queue.jobs(session_job_user())
+    if not jobs:
+        return
+    st.subheader("Background Jobs")
+    st.button("Refresh")
+    for job in jobs:
+        created = datetime.fromtimestamp(job["created_at"]).strftime("%H:%M:%S")
+        if job["status"] == "done":
+            with open(queue.result_path(job["id"]), "rb") as f:
+                st.download_button(
+                    label=f"Download bill queued at {created}",
+                    data=f.read(),
+                    file_name="bill_output.zip",
+                    mime="application/zip",
+                    key=f"job-{job['id']}"
+                )
+        elif job["status"] == "failed":
+            st.error(f"Bill queued at {created} failed: {job['error']}")
+        else:
+            st.write(f"Bill queued at {created}: {job['status']} (attempt {job['attempts']} of {job['max_attempts']})")
+
 def main():
     st.title("Contractor Bill Generator")
     
@@ -1277,143 +3067,81 @@ def main():
                 help="Upload an Excel file containing Work Order, Bill Quantity, and Extra Items sheets"
             )
 
-            # Submit button
+            show_timings = st.checkbox("Show timing breakdown", value=SHOW_TIMINGS)
+            queue_job = st.checkbox(
+                "Queue in background",
+                help="Generate the bill in the background and download it from the Background Jobs list when it is ready"
+            )
+
+            # Submit buttons
+            preview_button = st.form_submit_button("Preview Bill")
             submit_button = st.form_submit_button("Generate Bill")
 
         # Process the bill when submitted
-        if submit_button:
+        if submit_button or preview_button:
             if uploaded_file is None:
                 st.error("Please upload an Excel file first")
                 return
 
+            raw_inputs = {
+                "start_date": start_date,
+                "completion_date": completion_date,
+                "work_name": work_name or "",  # Make optional
+                "bill_serial": bill_serial or "",  # Make optional
+                "agreement_no": agreement_no or "",  # Make optional
+                "work_order_ref": work_order_ref or "",  # Make optional
+                "work_order_amount": work_order_amount,
+                "premium_percent": premium_percent,
+                "premium_type": premium_type,
+                "amount_paid_last_bill": amount_paid_last_bill,
+                "is_first_bill": is_first_bill
+            }
+
+            if queue_job and submit_button:
+                try:
+                    job_queue().submit(uploaded_file.getvalue(), raw_inputs, user=session_job_user())
+                    st.info("Bill queued; it will appear under Background Jobs when it is ready")
+                except ValueError as e:
+                    st.error(f"Error processing file: {str(e)}")
+                show_background_jobs()
+                return
+
             try:
                 # Validate and sanitize user inputs
-                user_inputs = validate_user_inputs({
-                    "start_date": start_date,
-                    "completion_date": completion_date,
-                    "work_name": work_name or "",  # Make optional
-                    "bill_serial": bill_serial or "",  # Make optional
-                    "agreement_no": agreement_no or "",  # Make optional
-                    "work_order_ref": work_order_ref or "",  # Make optional
-                    "work_order_amount": work_order_amount,
-                    "premium_percent": premium_percent,
-                    "premium_type": premium_type,
-                    "amount_paid_last_bill": amount_paid_last_bill,
-                    "is_first_bill": is_first_bill
-                })
-                
-                # Create a new temporary directory for this run
-                temp_dir = tempfile.mkdtemp()
-                logger.info(f"Created temporary directory: {temp_dir}")
-                
-                # Read and validate the uploaded file
-                with pd.ExcelFile(uploaded_file) as xls:
-                    validate_excel_sheets(xls)
-                    ws_wo = pd.read_excel(xls, "Work Order", header=None)
-                    ws_bq = pd.read_excel(xls, "Bill Quantity", header=None)
-                    ws_extra = pd.read_excel(xls, "Extra Items", header=None)
-
-                # Process the bill
-                first_page_data, last_page_data, deviation_data, extra_items_data, note_sheet_data, certificate_iii_data = process_bill(
-                    ws_wo,
-                    ws_bq,
-                    ws_extra,
-                    user_inputs["premium_percent"],
-                    user_inputs["premium_type"],
-                    user_inputs["amount_paid_last_bill"],
-                    user_inputs["is_first_bill"],
-                    user_inputs
-                )
-
-                # Generate PDFs
-                pdf_files = []
-                word_files = []
-                
-                # Mapping of sheet names to their HTML generation functions
-                html_generators = {
-                    "First Page": get_first_page_html,
-                    "Last Page": get_last_page_html,
-                    "Extra Items": get_extra_items_html,
-                    "Deviation Statement": get_deviation_statement_html,
-                    "Note Sheet": get_note_sheet_html,
-                    "Certificate III": get_certificate_iii_html
-                }
-
-                # Generate HTML files
-                html_files = []
-                for sheet_name, data in [
-                    ("First Page", first_page_data),
-                    ("Last Page", last_page_data),
-                    ("Extra Items", {"items": extra_items_data}),
-                    ("Deviation Statement", deviation_data),
-                    ("Note Sheet", note_sheet_data),
-                    ("Certificate III", certificate_iii_data)
-                ]:
-                    html_file = os.path.join(temp_dir, f"{sheet_name.replace(' ', '_')}.html")
-                    html_generator = html_generators.get(sheet_name)
-                    if html_generator:
-                        html_content = html_generator(data)
-                        with open(html_file, "w", encoding="utf-8") as f:
-                            f.write(html_content)
-                        html_files.append(html_file)
-                    else:
-                        logger.error(f"No HTML generator found for sheet: {sheet_name}")
-                        raise ValueError(f"No HTML generator found for sheet: {sheet_name}")
-
-                # Generate PDFs in parallel
-                generate_pdf_files(html_files, temp_dir)
-                
-                # Merge PDFs
-                merger = PdfMerger()
-                for pdf_file in [os.path.join(temp_dir, f"{os.path.splitext(os.path.basename(f))[0]}.pdf") for f in html_files]:
-                    merger.append(pdf_file)
-                pdf_output = os.path.join(temp_dir, "output.pdf")
-                merger.write(pdf_output)
-                merger.close()
-
-                # Generate Word documents
-                for sheet_name, data in [
-                    ("First Page", first_page_data),
-                    ("Last Page", last_page_data),
-                    ("Extra Items", {"items": extra_items_data}),
-                    ("Deviation Statement", deviation_data),
-                    ("Note Sheet", note_sheet_data)
-                ]:
-                    doc_path = os.path.join(temp_dir, f"{sheet_name.replace(' ', '_')}.docx")
-                    create_word_doc(sheet_name, data, doc_path)
-                    word_files.append(doc_path)
-
-                # Create ZIP file
-                zip_path = os.path.join(temp_dir, "output.zip")
-                with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
-                    zipf.write(pdf_output, os.path.basename(pdf_output))
-                    for word_file in word_files:
-                        zipf.write(word_file, os.path.basename(word_file))
-
-                # Provide download link
-                with open(zip_path, "rb") as f:
-                    bytes_data = f.read()
-                st.download_button(
-                    label="Download Output Files",
-                    data=bytes_data,
-                    file_name="bill_output.zip",
-                    mime="application/zip"
-                )
-                
-                logger.info("Bill generation completed successfully")
-                
+                user_inputs = validate_user_inputs(raw_inputs)
+                workbook = uploaded_file.getvalue()
+                if preview_button:
+                    # Only process_bill runs; files are built on export
+                    workbook_hash = hashlib.sha256(workbook).hexdigest()
+                    bill = process_uploaded_bill(workbook_hash, user_inputs, workbook)
+                    st.session_state["bill_preview"] = {"workbook": workbook, "user_inputs": user_inputs, "bill": bill}
+                    st.session_state.pop("last_bill", None)
+                else:
+                    st.session_state.pop("bill_preview", None)
+                    export_bill(workbook, user_inputs)
             except Exception as e:
                 logger.error(f"Error processing file: {str(e)}")
                 st.error(f"Error processing file: {str(e)}")
                 st.stop()
-            finally:
-                # Clean up temporary files
-                if os.path.exists(temp_dir):
-                    try:
-                        shutil.rmtree(temp_dir)
-                        logger.info(f"Cleaned up temporary directory: {temp_dir}")
-                    except Exception as e:
-                        logger.error(f"Error cleaning up temporary directory: {str(e)}")
+
+        preview = st.session_state.get("bill_preview")
+        if preview is not None:
+            st.subheader("Preview")
+            show_bill_preview(preview["bill"])
+            if st.button("Export PDF and Word files"):
+                try:
+                    export_bill(preview["workbook"], preview["user_inputs"])
+                except Exception as e:
+                    logger.error(f"Error processing file: {str(e)}")
+                    st.error(f"Error processing file: {str(e)}")
+                    st.stop()
+
+        # Reruns (a download, paging the preview) keep offering the last bill
+        last_bill = session_archives().get(st.session_state["last_bill"]) if "last_bill" in st.session_state else None
+        if last_bill is not None:
+            show_bill_result(last_bill, show_timings)
+
+        show_background_jobs()
 
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
@@ -2,9 +2,37 @@ import os
 import pytest
 import pandas as pd
 import sys
-import os
+import threading
+import time
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from streamlit_app import process_bill, number_to_words
+import streamlit_app
+from streamlit_app import (process_bill, number_to_words, read_excel_sheets, BillGenerationError, PdfRenderer,
+                           compose_bill_document, render_bill_pdf, create_template_environment,
+                           warm_templates, render_section_html, stream_section_html,
+                           SECTION_TEMPLATES, LineItems, create_word_doc, PipelineStage,
+                           run_pipeline, bill_output_stages, bill_section_data, ResultCache,
+                           generate_bill_outputs, validate_user_inputs, stream_bill_outputs,
+                           build_deviation, build_quantity_index, collect_stage_metrics,
+                           stage_metrics_frame, rupees_to_words)
+from docx import Document
+import app as bill_api
+import batch_generate
+import bill_jobs
+import base64
+import benchmark_bills
+from benchmark_bills import benchmark_number_words
+import zipfile
+import json
+import pstats
+import io
+import hashlib
+import tracemalloc
+import re
+import tempfile
+import pdfkit
+from pypdf import PdfReader, PdfWriter
+
+TEST_FILES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test_files")
 
 def test_number_to_words():
     assert number_to_words(123456) == "One Lakh Twenty Three Thousand Four Hundred And Fifty Six"
@@ -197,6 +225,42 @@ def test_process_bill_edge_cases():
     
     assert result["totals"]["grand_total"] == 1e18
 
+def test_number_to_words_matches_num2words_without_punctuation():
+    assert number_to_words(100005) == "One Lakh And Five"
+    assert number_to_words(123456789.99) == "Twelve Crore Thirty Four Lakh Fifty Six Thousand Seven Hundred And Eighty Nine"
+    result = benchmark_number_words(2000, seed=1)
+    assert result["mismatches"] == [] and set(result["seconds"]) == {"number_to_words", "num2words"}
+
+def test_rupees_to_words():
+    assert rupees_to_words(1205.5) == "Rupees One Thousand Two Hundred And Five And Paise Fifty Only"
+    assert rupees_to_words("0.295") == "Paise Thirty Only"
+    assert rupees_to_words(0) == "Rupees Zero Only"
+    assert rupees_to_words(99.999) == "Rupees One Hundred Only"
+    with pytest.raises(ValueError):
+        rupees_to_words(-0.5)
+    with pytest.raises(ValueError, match="not a number"):
+        rupees_to_words("ten")
+
+# Seconds a cold import of streamlit_app may take once Streamlit and pandas are loaded
+IMPORT_BUDGET_SECONDS = float(os.environ.get("BILL_IMPORT_BUDGET_S", 0.5))
+
+def test_streamlit_app_import_stays_within_budget():
+    result = benchmark_bills.measure_import(repeat=2)
+    assert not set(streamlit_app.LAZY_IMPORTS) & {name.split(".")[0] for name in result["modules"]}
+    assert result["seconds"] < IMPORT_BUDGET_SECONDS, f"import took {result['seconds']:.3f}s"
+
+def test_shared_resource_is_created_once_per_process():
+    made = []
+    @streamlit_app.shared_resource
+    def resource(name):
+        made.append(name)
+        return object()
+    assert resource("a") is resource("a") and resource("a") is not resource("b")
+    resource.clear()
+    resource("a")
+    assert made == ["a", "b", "a"]
+    assert streamlit_app.template_environment() is streamlit_app.template_environment()
+
 def test_number_to_words_edge_cases():
     # Test with zero
     assert number_to_words(0) == "Zero"
@@ -208,5 +272,943 @@ def test_number_to_words_edge_cases():
     with pytest.raises(ValueError):
         number_to_words(-100)
 
+def _work_order_sheets(rows, bill_quantities, extra_rows=()):
+    """Build sheets in the uploaded layout: 21 header rows on Work Order and
+    Bill Quantity, 6 header rows on Extra Items."""
+    ws_wo = pd.DataFrame([[None] * 7] * 21 + [list(row) for row in rows], dtype=object)
+    ws_bq = pd.DataFrame([[None] * 4] * 21 + [[None, None, None, qty] for qty in bill_quantities], dtype=object)
+    ws_extra = pd.DataFrame([[None] * 6] * 6 + [list(row) for row in extra_rows], dtype=object)
+    return ws_wo, ws_bq, ws_extra
+
+def test_process_bill_columnar_line_items():
+    ws_wo, ws_bq, ws_extra = _work_order_sheets(
+        rows=[
+            [1, "Item 1", "Nos", 5, 100, None, "ok"],
+            [2, "Item 2", "Mtr", 10, "1,250.50", None, None],
+            [3, "Item 3", "Nos", 1, "n/a", None, None],  # invalid rate, skipped
+            [4, "Item 4", "Nos", 1, 2.5, None, None],  # 2.5 rounds half-to-even
+        ],
+        bill_quantities=[2, " 3 ", 1, 1],
+        extra_rows=[[1, "Extra", "Extra item", 4, "Nos", 25.5]],
+    )
+    first_page, _, _, extra_items, note_sheet, _ = process_bill(
+        ws_wo, ws_bq, ws_extra, 10, "above", 0, True,
+        {"start_date": "2024-01-01", "completion_date": "2024-12-31", "work_order_amount": 100000}
+    )
+
+    items = list(first_page["items"])
+    assert [item["serial_no"] for item in items] == ["1", "2", "4", "", "1"]
+    assert [item["amount"] for item in items] == [200, 3752, 2, 0, 102]
+    assert items[3]["is_divider"] and items[3]["bold"]
+    assert items[0]["remark"] == "ok" and items[1]["remark"] == ""
+    assert first_page["totals"]["grand_total"] == 4056
+    assert first_page["totals"]["premium"]["amount"] == 406
+    assert first_page["totals"]["payable"] == 4462
+    assert list(extra_items) == items[4:]
+
+def test_read_excel_sheets_parses_each_sheet_once(monkeypatch):
+    parsed = []
+    original_parse = pd.ExcelFile.parse
+    def counting_parse(self, sheet_name, *args, **kwargs):
+        parsed.append(sheet_name)
+        return original_parse(self, sheet_name, *args, **kwargs)
+    monkeypatch.setattr(pd.ExcelFile, "parse", counting_parse)
+
+    sheets, parse_times = read_excel_sheets(os.path.join(TEST_FILES, "SAMPLE BILL INPUT- WITH EXTRA ITEMS.xlsx"))
+
+    assert parsed == ["Work Order", "Bill Quantity", "Extra Items"]
+    assert set(sheets) == set(parse_times) == set(parsed)
+    assert sheets["Work Order"].shape[1] >= 7
+    assert all(seconds >= 0 for seconds in parse_times.values())
+
+def test_read_excel_sheets_missing_sheet(tmp_path):
+    path = tmp_path / "missing.xlsx"
+    with pd.ExcelWriter(path) as writer:
+        pd.DataFrame([[1] * 7]).to_excel(writer, sheet_name="Work Order", header=False, index=False)
+    with pytest.raises(BillGenerationError, match="Missing required sheets: Bill Quantity, Extra Items"):
+        read_excel_sheets(str(path))
+
+def test_pdf_renderer_bounds_concurrent_renders(monkeypatch):
+    running = []
+    peak = []
+    calls = []
+    lock = threading.Lock()
+    def fake_from_file(html_files, pdf_file, configuration=None, options=None):
+        with lock:
+            running.append(pdf_file)
+            peak.append(len(running))
+            calls.append(html_files)
+        time.sleep(0.05)
+        with lock:
+            running.remove(pdf_file)
+    monkeypatch.setattr(pdfkit, "from_file", fake_from_file)
+
+    renderer = PdfRenderer(max_workers=2, configuration=object())
+    threads = [
+        threading.Thread(target=renderer.render, args=([f"{n}_a.html", f"{n}_b.html"], f"{n}.pdf"))
+        for n in range(6)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert max(peak) == 2
+    assert len(calls) == 6  # one wkhtmltopdf invocation per bill, not per page
+    assert all(len(pages) == 2 for pages in calls)
+    assert renderer.active == 0 and renderer.waiting == 0
+
+def test_pdf_renderer_queue_timeout(monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(pdfkit, "from_file", lambda *args, **kwargs: release.wait(1))
+
+    renderer = PdfRenderer(max_workers=1, queue_timeout=0.05, configuration=object())
+    busy = threading.Thread(target=renderer.render, args=("a.html", "a.pdf"))
+    busy.start()
+    time.sleep(0.01)
+    with pytest.raises(BillGenerationError, match="No PDF renderer became available"):
+        renderer.render("b.html", "b.pdf")
+    release.set()
+    busy.join()
+
+SECTION_HTML = "<html><head><style>table {{ width: 100%; }}</style></head><body><p>{}</p></body></html>"
+
+def test_compose_bill_document_one_section_per_page():
+    html = "".join(compose_bill_document([
+        ("First Page", SECTION_HTML.format("first")),
+        ("Deviation Statement", iter(["<html><body>", "<p>deviation</p>", "</body></html>"])),
+    ]))
+    assert html.count("<html") == 1 and html.count("<body") == 1 and html.count("</body>") == 1
+    assert '<div class="bill-section portrait" data-section="First Page">' in html
+    assert '<div class="bill-section landscape" data-section="Deviation Statement"><p>deviation</p></div>' in html
+    assert "table { width: 100%; }" in html
+    assert "page-break-before: always" in html
+
+def test_compose_bill_document_scopes_section_styles():
+    portrait = "<html><head><style>body { margin: 0; } .container { width: 190mm; } @page { size: A4; }</style></head><body></body></html>"
+    landscape = ["<html><head><style>", ".container { width: 277mm; }\nth, td { padding: 5px; }", "</style></head>", "<body></body></html>"]
+    html = "".join(compose_bill_document([("First Page", portrait), ("Deviation Statement", iter(landscape))]))
+
+    first, deviation = '.bill-section[data-section="First Page"]', '.bill-section[data-section="Deviation Statement"]'
+    assert f"{first} {{ margin: 0; }}" in html
+    assert f"{first} .container {{ width: 190mm; }}" in html
+    assert f"{deviation} .container {{ width: 277mm; }}" in html
+    assert f"{deviation} th, {deviation} td {{ padding: 5px; }}" in html
+    assert "@page" not in html
+
+    # Every rule of the real templates applies to its own section only
+    styles = re.findall(r"<style[^>]*>(.*?)</style>", "".join(compose_bill_document(
+        [(name, open(os.path.join(streamlit_app.TEMPLATE_DIR, template), encoding="utf-8").read())
+         for name, template in SECTION_TEMPLATES.items()]
+    )), re.S)[1:]
+    assert len(styles) == len(SECTION_TEMPLATES)
+    for (name, _), css in zip(SECTION_TEMPLATES.items(), styles):
+        selectors = [s.strip() for rule in re.findall(r"([^{}]+)\{", css) for s in rule.split(",")]
+        assert selectors and all(s.startswith(f'.bill-section[data-section="{name}"]') for s in selectors)
+
+class RecordingRenderer:
+    max_workers = 1
+    def __init__(self):
+        self.calls = []
+    def render(self, html_files, pdf_file, options=None):
+        self.calls.append(html_files)
+        return pdf_file
+
+def _blank_pdf():
+    writer = PdfWriter()
+    writer.add_blank_page(width=72, height=72)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+class PipeRenderer(RecordingRenderer):
+    """Records the HTML documents rendered through stdin (or the input files) and returns one-page PDFs"""
+    def render(self, html_files, pdf_file, options=None):
+        self.calls.append(html_files)
+        with open(pdf_file, "wb") as f:
+            f.write(_blank_pdf())
+        return pdf_file
+    def render_bytes(self, html, options=None, max_memory_bytes=None):
+        self.calls.append(html if isinstance(html, str) else "".join(html))
+        return _blank_pdf()
+
+def test_render_bill_pdf_single_wkhtmltopdf_run(tmp_path):
+    renderer = RecordingRenderer()
+    sections = [("First Page", SECTION_HTML.format("a")), ("Last Page", iter(["<p>", "b", "</p>"]))]
+
+    pdf = render_bill_pdf(sections, str(tmp_path), renderer=renderer)
+
+    assert pdf == str(tmp_path / "output.pdf")
+    assert len(renderer.calls) == 1
+    assert [os.path.basename(f) for f in renderer.calls[0]] == ["First_Page.html", "Last_Page.html"]
+    with open(renderer.calls[0][1], encoding="utf-8") as f:
+        assert f.read() == "<p>b</p>"
+
+def test_bill_output_stages_unknown_mode():
+    with pytest.raises(ValueError, match="PDF render mode must be one of"):
+        bill_output_stages({}, mode="fast")
+
+def test_template_environment_caches_compiled_templates(tmp_path):
+    environment = create_template_environment(cache_dir=str(tmp_path))
+    warm_templates(environment)
+
+    assert not environment.auto_reload
+    assert len(os.listdir(tmp_path)) == len(SECTION_TEMPLATES)
+
+def test_template_environment_defaults_to_jinja_private_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    environment = create_template_environment(cache_dir=None)
+    warm_templates(environment)
+
+    cache_dir, = os.listdir(tmp_path)
+    assert cache_dir == f"_jinja2-cache-{os.getuid()}"
+    assert os.stat(tmp_path / cache_dir).st_mode & 0o777 == 0o700
+    assert len(os.listdir(tmp_path / cache_dir)) == len(SECTION_TEMPLATES)
+
+def test_sections_render_through_templates():
+    ws_wo, ws_bq, ws_extra = _work_order_sheets(
+        rows=[[1, "Cable & conduit", "Mtr", 10, 50, None, None]],
+        bill_quantities=[12],
+        extra_rows=[[1, "Extra", "Extra item", 4, "Nos", 25]],
+    )
+    first_page, last_page, deviation, extra_items, note_sheet, certificate_iii = process_bill(
+        ws_wo, ws_bq, ws_extra, 4.5, "above", 0, True,
+        {"start_date": "2024-01-01", "completion_date": "2024-12-31", "work_order_amount": 1000}
+    )
+
+    html = render_section_html("First Page", first_page)
+    assert "Cable &amp; conduit" in html
+    assert "Extra Items (With Premium)" in html
+    assert "Tender Premium @ 4.50% above" in html
+    assert "<td>700</td>" in html
+    assert "Payable Amount: 732" in render_section_html("Last Page", last_page)
+    assert "Extra item" in render_section_html("Extra Items", {"items": extra_items})
+    assert "Quality Control (QC) test reports attached." in render_section_html("Note Sheet", note_sheet)
+    assert "Add Tender Premium (4.50% above)" in render_section_html("Deviation Statement", deviation)
+    assert "Pay Rs. 732" in render_section_html("Certificate III", certificate_iii)
+
+def test_stream_section_html_yields_rows_incrementally(tmp_path):
+    items = LineItems({
+        "serial_no": [str(n) for n in range(500)],
+        "description": [f"Item {n}" for n in range(500)],
+        "unit": ["Nos"] * 500,
+        "quantity": [1.0] * 500,
+        "rate": [2.0] * 500,
+        "remark": [""] * 500,
+        "amount": [2] * 500,
+        "is_divider": [False] * 500,
+    }, total=1000)
+
+    chunks = stream_section_html("Extra Items", {"items": items})
+    assert not isinstance(chunks, str)
+    chunks = list(chunks)
+    assert len(chunks) > 500
+    assert max(len(chunk) for chunk in chunks) < 1000
+
+    renderer = RecordingRenderer()
+    render_bill_pdf([("Extra Items", stream_section_html("Extra Items", {"items": items}))], str(tmp_path), renderer=renderer)
+    with open(renderer.calls[0][0], encoding="utf-8") as f:
+        assert f.read() == "".join(chunks)
+
+def test_create_word_doc_bulk_tables(tmp_path):
+    ws_wo, ws_bq, ws_extra = _work_order_sheets(
+        rows=[[n, f"Item {n} & <sub>\nsecond line", "Nos", 2, 10, None, None] for n in range(1, 1201)],
+        bill_quantities=[3] * 1200,
+        extra_rows=[[1, "Extra", "Extra item", 4, "Nos", 25]],
+    )
+    first_page, _, deviation, _, _, _ = process_bill(
+        ws_wo, ws_bq, ws_extra, 5, "above", 0, True,
+        {"start_date": "2024-01-01", "completion_date": "2024-12-31", "work_order_amount": 100000}
+    )
+
+    create_word_doc("First Page", first_page, str(tmp_path / "first.docx"))
+    table = Document(str(tmp_path / "first.docx")).tables[0]
+    assert table.style.name == "Table Grid"
+    assert len(table.rows) == len(first_page["items"]) + 3
+    assert [cell.text for cell in table.rows[0].cells] == ["Nos", "", "3.0", "1", "Item 1 & <sub>\nsecond line", "10.0", "30", "", ""]
+    divider = table.rows[1200].cells[4]
+    assert divider.text == "Extra Items (With Premium)" and divider.paragraphs[0].runs[0].bold
+    assert table.rows[-3].cells[4].text == "Grand Total"
+    assert table.rows[-3].cells[6].text == str(first_page["totals"]["grand_total"])
+
+    create_word_doc("Deviation Statement", deviation, str(tmp_path / "deviation.docx"))
+    table = Document(str(tmp_path / "deviation.docx")).tables[0]
+    assert len(table.rows) == len(deviation["items"]) + 5
+    assert table.rows[0].cells[11].text == "Saving Amt"
+    assert table.rows[-4].cells[1].text == "Grand Total"
+    assert table.rows[-4].cells[5].text == str(deviation["summary"]["work_order_total"])
+
+def _sleep_then(value, seconds=0.3):
+    time.sleep(seconds)
+    return value
+
+def test_run_pipeline_overlaps_independent_stages(monkeypatch):
+    monkeypatch.setattr(streamlit_app, "PIPELINE_PROCESSES", 0)
+    results, timings = run_pipeline([
+        PipelineStage("zip", lambda pdf, docx: pdf + docx, depends_on=("pdf", "docx")),
+        PipelineStage("pdf", _sleep_then, ("pdf",)),
+        PipelineStage("docx", _sleep_then, ("docx",), cpu_bound=True),
+    ])
+    assert results == {"pdf": "pdf", "docx": "docx", "zip": "pdfdocx"}
+    assert set(timings) == {"pdf", "docx", "zip", "total"}
+    assert timings["pdf"] >= 0.3 and timings["docx"] >= 0.3
+    assert timings["total"] < 0.55
+
+def test_run_pipeline_rejects_bad_graphs():
+    with pytest.raises(ValueError, match="cycle"):
+        run_pipeline([PipelineStage("a", str, depends_on=("b",)), PipelineStage("b", str, depends_on=("a",))])
+    with pytest.raises(ValueError, match="unknown stages: missing"):
+        run_pipeline([PipelineStage("a", str, depends_on=("missing",))])
+
+def test_run_pipeline_stops_after_failed_stage(monkeypatch):
+    monkeypatch.setattr(streamlit_app, "PIPELINE_PROCESSES", 0)
+    ran = []
+    def fail():
+        raise BillGenerationError("render failed")
+    with pytest.raises(BillGenerationError, match="render failed"):
+        run_pipeline([PipelineStage("pdf", fail), PipelineStage("zip", ran.append, depends_on=("pdf",))])
+    assert ran == []
+
+def test_bill_output_stages_build_every_file_in_memory(tmp_path, monkeypatch):
+    ws_wo, ws_bq, ws_extra = _work_order_sheets(
+        rows=[[1, "Item 1", "Nos", 10, 50, None, None]],
+        bill_quantities=[12],
+        extra_rows=[[1, "Extra", "Extra item", 4, "Nos", 25]],
+    )
+    section_data = bill_section_data(*process_bill(
+        ws_wo, ws_bq, ws_extra, 5, "above", 0, True,
+        {"start_date": "2024-01-01", "completion_date": "2024-12-31", "work_order_amount": 1000}
+    ))
+    renderer = PipeRenderer()
+
+    monkeypatch.setattr(streamlit_app, "SPOOL_DIR", str(tmp_path))
+
+    results, timings = run_pipeline(bill_output_stages(section_data, mode="document", renderer=renderer))
+
+    assert len(renderer.calls) == 1
+    assert renderer.calls[0].count('<div class="bill-section') == 6
+    assert not list(tmp_path.iterdir())
+    assert [streamlit_app.output_file_name(name) for name in streamlit_app.BILL_ARTIFACTS] == [
+        "output.pdf", "First_Page.docx", "Last_Page.docx", "Extra_Items.docx",
+        "Deviation_Statement.docx", "Note_Sheet.docx"
+    ]
+    assert all(isinstance(results[name], bytes) for name in streamlit_app.BILL_ARTIFACTS)
+    assert Document(io.BytesIO(results["docx:Deviation Statement"])).tables
+    assert "docx:Deviation Statement" in timings and "pdf" in timings
+
+    # Batch mode passes one file per section to a single run and removes them afterwards
+    renderer = PipeRenderer()
+    results, _ = run_pipeline(bill_output_stages(section_data, mode="batch", renderer=renderer))
+    assert len(renderer.calls) == 1
+    assert [os.path.basename(f) for f in renderer.calls[0]] == [f"{name.replace(' ', '_')}.html" for name in streamlit_app.BILL_SECTIONS]
+    assert results["pdf"] == _blank_pdf() and not list(tmp_path.iterdir())
+
+def test_batch_manifest_jobs_fall_back_to_cli_options(tmp_path):
+    manifest = tmp_path / "bills.csv"
+    manifest.write_text(
+        "workbook,premium_percent,premium_type,bill_serial\n"
+        "a/bill.xlsx,4.5,below,\n"
+        "b/bill.xlsx,,,7\n",
+        encoding="utf-8"
+    )
+    args = batch_generate.parse_args([
+        "--manifest", str(manifest), "--output", str(tmp_path / "out"),
+        "--premium-percent", "10", "--premium-type", "above", "--work-order-amount", "1000",
+        "--start-date", "2024-01-01", "--completion-date", "2024-12-31"
+    ])
+
+    jobs = batch_generate.load_jobs(args)
+
+    assert [job["name"] for job in jobs] == ["bill", "bill_2"]
+    assert jobs[0]["workbook"] == os.path.join(str(tmp_path), "a/bill.xlsx")
+    assert jobs[0]["inputs"]["premium_percent"] == "4.5" and jobs[0]["inputs"]["premium_type"] == "below"
+    assert jobs[1]["inputs"]["premium_percent"] == "10" and jobs[1]["inputs"]["bill_serial"] == "7"
+    assert jobs[1]["inputs"]["is_first_bill"] == "false"
+
+def test_batch_generate_bill_writes_zip_and_reports_failures(tmp_path, monkeypatch):
+    monkeypatch.setattr(streamlit_app, "PDF_RENDERER", PipeRenderer())
+    monkeypatch.setattr(streamlit_app, "PIPELINE_PROCESSES", 0)
+    inputs = {"start_date": "2024-01-01", "completion_date": "2024-12-31", "work_order_amount": "100000",
+              "premium_percent": "5", "premium_type": "above", "amount_paid_last_bill": "0", "is_first_bill": "true"}
+    workbook = os.path.join(TEST_FILES, "SAMPLE BILL INPUT- WITH EXTRA ITEMS.xlsx")
+
+    ok = batch_generate.generate_bill({"workbook": workbook, "name": "march", "inputs": inputs}, str(tmp_path), "batch")
+    failed = batch_generate.generate_bill(
+        {"workbook": workbook, "name": "bad", "inputs": dict(inputs, premium_type="fixed")}, str(tmp_path), "batch"
+    )
+    batch_generate.write_summary([ok, failed], str(tmp_path / "summary.csv"))
+
+    assert ok["status"] == "ok" and ok["output"] == str(tmp_path / "march.zip")
+    assert "Deviation_Statement.docx" in zipfile.ZipFile(ok["output"]).namelist()
+    assert ok["total"] >= ok["process"] > 0
+    assert failed["status"] == "failed" and "Premium type" in failed["error"]
+    summary = (tmp_path / "summary.csv").read_text(encoding="utf-8").splitlines()
+    assert summary[0].startswith("bill,workbook,status,error,output,total,parse,process")
+    assert len(summary) == 3
+
+def test_generate_bill_outputs_rebuilds_only_changed_sections(tmp_path, monkeypatch):
+    monkeypatch.setattr(streamlit_app, "PIPELINE_PROCESSES", 0)
+    built = []
+    original_create_word_doc = streamlit_app.create_word_doc
+    def recording_create_word_doc(sheet_name, data, doc_path):
+        built.append(sheet_name)
+        return original_create_word_doc(sheet_name, data, doc_path)
+    monkeypatch.setattr(streamlit_app, "create_word_doc", recording_create_word_doc)
+    parsed = []
+    original_read_excel_sheets = streamlit_app.read_excel_sheets
+    def recording_read_excel_sheets(source):
+        if not isinstance(source, pd.ExcelFile):
+            parsed.append(source)
+        return original_read_excel_sheets(source)
+    monkeypatch.setattr(streamlit_app, "read_excel_sheets", recording_read_excel_sheets)
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=10 ** 8)
+    workbook = os.path.join(TEST_FILES, "SAMPLE BILL INPUT- WITH EXTRA ITEMS.xlsx")
+    user_inputs = validate_user_inputs({"start_date": "2024-01-01", "completion_date": "2024-12-31", "work_order_amount": 100000,
+                                        "premium_percent": 5, "premium_type": "above", "amount_paid_last_bill": 0, "is_first_bill": True})
+
+    def generate(inputs):
+        renderer = PipeRenderer()
+        archive, _ = generate_bill_outputs(workbook, inputs, mode="sections", renderer=renderer, cache=cache)
+        with zipfile.ZipFile(archive) as zipf:
+            assert len(zipf.namelist()) == 6
+            assert len(PdfReader(io.BytesIO(zipf.read("output.pdf"))).pages) == 6
+        return len(renderer.calls)
+
+    assert generate(user_inputs) == 6 and len(built) == 5
+    built.clear()
+    assert generate(user_inputs) == 0 and built == []
+    assert generate(dict(user_inputs, start_date=user_inputs["start_date"].replace(month=2))) == 1
+    assert built == ["First Page"]
+    assert len(parsed) == 1
+
+def test_cached_bill_is_dated_today_and_keyed_on_alignment(tmp_path, monkeypatch):
+    cache = ResultCache(str(tmp_path))
+    workbook = os.path.join(TEST_FILES, "SAMPLE BILL INPUT- WITH EXTRA ITEMS.xlsx")
+    user_inputs = validate_user_inputs(SAMPLE_INPUTS)
+    processed = []
+    original_process_bill = streamlit_app.process_bill
+    monkeypatch.setattr(streamlit_app, "process_bill", lambda *args: processed.append(1) or original_process_bill(*args))
+
+    streamlit_app.process_workbook(workbook, user_inputs, cache)
+    monkeypatch.setattr(streamlit_app, "bill_date", lambda: "01-01-2030")
+    bill, _ = streamlit_app.process_workbook(workbook, user_inputs, cache)
+    assert len(processed) == 1
+    assert [part["current_date"] for part in bill if isinstance(part, dict) and "current_date" in part] == ["01-01-2030"] * 4
+
+    monkeypatch.setattr(streamlit_app, "QUANTITY_ALIGNMENT", "position")
+    streamlit_app.process_workbook(workbook, user_inputs, cache)
+    assert len(processed) == 2
+
+def test_result_cache_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=250)
+    for key in ("a", "b"):
+        cache.save(key, b"x" * 80)
+        os.utime(cache.path(key), (time.time() - 60, time.time() - 60))
+    assert cache.lookup("a") is not None
+    cache.save("c", b"x" * 80)
+    assert cache.load("b") is None
+    assert cache.load("a") == b"x" * 80 and cache.load("c") == b"x" * 80
+    assert cache.hits == 3 and cache.misses == 1
+
+def test_result_cache_refuses_directories_other_users_can_write(tmp_path):
+    cache = ResultCache(str(tmp_path / "fresh"))
+    assert os.stat(cache.directory).st_mode & 0o777 == 0o700
+
+    shared = tmp_path / "shared"
+    shared.mkdir()
+    shared.chmod(0o777)
+    with pytest.raises(PermissionError):
+        ResultCache(str(shared))
+
+    link = tmp_path / "link"
+    link.symlink_to(tmp_path / "fresh")
+    with pytest.raises(PermissionError):
+        ResultCache(str(link))
+
+def test_pdf_renderer_pipes_small_documents_and_spills_large_ones(monkeypatch):
+    calls = []
+    monkeypatch.setattr(pdfkit, "from_string", lambda html, output, **kwargs: calls.append(("stdin", output)) or b"%PDF")
+    def fake_from_file(path, output, **kwargs):
+        with open(path, encoding="utf-8") as f:
+            calls.append(("file", output, len(f.read())))
+        return b"%PDF"
+    monkeypatch.setattr(pdfkit, "from_file", fake_from_file)
+    renderer = PdfRenderer(max_workers=1, configuration=object())
+
+    assert renderer.render_bytes("<p>small</p>", max_memory_bytes=100) == b"%PDF"
+    assert renderer.render_bytes("x" * 101, max_memory_bytes=100) == b"%PDF"
+    assert calls == [("stdin", False), ("file", False, 101)]
+    assert renderer.render_bytes(iter(["<p>", "chunked", "</p>"]), max_memory_bytes=100) == b"%PDF"
+    assert renderer.render_bytes(iter(["x" * 60, "y" * 60, "z"]), max_memory_bytes=100) == b"%PDF"
+    assert calls[2:] == [("stdin", False), ("file", False, 121)]
+    assert renderer.active == 0
+
+SAMPLE_INPUTS = {"start_date": "2024-01-01", "completion_date": "2024-12-31", "work_order_amount": 100000,
+                 "premium_percent": 5, "premium_type": "above", "amount_paid_last_bill": 0, "is_first_bill": True}
+
+def test_stream_bill_outputs_adds_members_as_they_finish(monkeypatch):
+    monkeypatch.setattr(streamlit_app, "PIPELINE_PROCESSES", 0)
+    release_pdf = threading.Event()
+    class SlowRenderer(PipeRenderer):
+        def render_bytes(self, html, options=None, max_memory_bytes=None):
+            assert release_pdf.wait(timeout=10), "no ZIP data was streamed before the PDF finished"
+            return super().render_bytes(html, options, max_memory_bytes)
+    workbook = os.path.join(TEST_FILES, "SAMPLE BILL INPUT- WITH EXTRA ITEMS.xlsx")
+
+    stream = stream_bill_outputs(workbook, validate_user_inputs(SAMPLE_INPUTS), mode="document",
+                                 renderer=SlowRenderer(), chunk_size=1024)
+    chunks = [next(stream)]
+    release_pdf.set()
+    chunks.extend(stream)
+
+    assert len(chunks) > 2
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as zipf:
+        assert zipf.namelist()[0] != "output.pdf"
+        assert len(zipf.namelist()) == 6
+        assert {info.compress_type for info in zipf.infolist()} == {zipfile.ZIP_STORED}
+        assert zipf.testzip() is None
+
+def test_stream_bill_outputs_raises_build_errors():
+    stream = stream_bill_outputs(os.path.join(TEST_FILES, "missing.xlsx"), validate_user_inputs(SAMPLE_INPUTS))
+    with pytest.raises(FileNotFoundError):
+        list(stream)
+
+def test_generate_bill_outputs_deflated_archive(monkeypatch):
+    monkeypatch.setattr(streamlit_app, "PIPELINE_PROCESSES", 0)
+    workbook = os.path.join(TEST_FILES, "SAMPLE BILL INPUT- NO EXTRA ITEMS.xlsx")
+    archive, _ = generate_bill_outputs(workbook, validate_user_inputs(SAMPLE_INPUTS), renderer=PipeRenderer(), compression="deflated")
+    with zipfile.ZipFile(archive) as zipf:
+        assert {info.compress_type for info in zipf.infolist()} == {zipfile.ZIP_DEFLATED}
+    with pytest.raises(ValueError, match="ZIP compression must be one of"):
+        generate_bill_outputs(workbook, validate_user_inputs(SAMPLE_INPUTS), compression="lzma")
+
+def test_process_bill_reuses_steps_unaffected_by_an_edit(monkeypatch):
+    calls = []
+    for step in ("build_line_items", "build_bill_totals", "build_deviation", "generate_bill_notes"):
+        original = getattr(streamlit_app, step)
+        monkeypatch.setattr(streamlit_app, step, lambda *args, _step=step, _original=original: calls.append(_step) or _original(*args))
+    ws_wo, ws_bq, ws_extra = _work_order_sheets(
+        rows=[[1, "Memo item", "Nos", 3, 75.25, None, None]],
+        bill_quantities=[4],
+        extra_rows=[[1, "Extra", "Memo extra", 2, "Nos", 12.5]],
+    )
+    user_inputs = {"start_date": "2024-01-01", "completion_date": "2024-12-31", "work_order_amount": 1000, "work_name": "Road"}
+
+    first = process_bill(ws_wo, ws_bq, ws_extra, 5, "above", 0, True, dict(user_inputs))
+    assert sorted(calls) == ["build_bill_totals", "build_deviation", "build_line_items", "generate_bill_notes"]
+
+    calls.clear()
+    renamed = process_bill(ws_wo.copy(), ws_bq.copy(), ws_extra.copy(), 5, "above", 0, True, dict(user_inputs, work_name="Bridge"))
+    assert calls == []
+    assert ["Work Name:", "Bridge"] in renamed[0]["header"]
+    # Reused steps share their arrays read-only but hand out their own containers
+    assert renamed[0]["items"].columns["amount"] is first[0]["items"].columns["amount"]
+    assert renamed[2]["items"].columns["amt_wo"] is first[2]["items"].columns["amt_wo"]
+    assert renamed[0]["totals"] == first[0]["totals"] and renamed[0]["totals"] is not first[0]["totals"]
+    with pytest.raises(ValueError):
+        renamed[0]["items"].columns["amount"][0] = 0
+    renamed[0]["totals"]["premium"]["amount"] = -1
+    renamed[2]["summary"].clear()
+    again = process_bill(ws_wo, ws_bq, ws_extra, 5, "above", 0, True, dict(user_inputs))
+    assert again[0]["totals"] == first[0]["totals"] and again[2]["summary"] == first[2]["summary"]
+    calls.clear()
+
+    process_bill(ws_wo, ws_bq, ws_extra, 7.5, "above", 0, True, dict(user_inputs))
+    assert sorted(calls) == ["build_bill_totals", "build_deviation", "generate_bill_notes"]
+
+    calls.clear()
+    ws_bq.iloc[21, 3] = 5
+    process_bill(ws_wo, ws_bq, ws_extra, 5, "above", 0, True, dict(user_inputs))
+    assert "build_line_items" in calls
+
+def test_memoized_steps_show_their_warnings_again(monkeypatch):
+    shown = []
+    monkeypatch.setattr(streamlit_app.st, "warning", shown.append)
+    ws_wo, ws_bq, ws_extra = _work_order_sheets(
+        rows=[[1, "Good", "Nos", 3, 10, None, None], [2, "Bad rate", "Nos", 1, "n/a", None, None]],
+        bill_quantities=[4, 1],
+        extra_rows=[[1, "Extra", "Warned extra", "lots", "Nos", 12.5]],
+    )
+    user_inputs = {"start_date": "2024-01-01", "completion_date": "2024-12-31", "work_order_amount": 1000}
+
+    process_bill(ws_wo, ws_bq, ws_extra, 5, "above", 0, True, dict(user_inputs))
+    first = list(shown)
+    shown.clear()
+    process_bill(ws_wo, ws_bq, ws_extra, 5, "above", 0, True, dict(user_inputs, work_name="Renamed"))
+    assert any("Skipping invalid rate at Work Order" in warning for warning in first)
+    assert any("Skipping invalid quantity at Extra Items" in warning for warning in first)
+    assert shown == first
+
+def test_build_deviation_columns_and_premiums():
+    ws_wo, ws_bq, _ = _work_order_sheets(
+        rows=[
+            [1, "Excess", "Nos", 2.675, 100, None, None],  # rounds to 2.67, as round() does
+            [2, "Saving", "Mtr", 10, 12.5, None, None],
+            [3, "Blank", "Nos", None, None, None, None],
+            [4, "Bad rate", "Nos", 1, "n/a", None, None],
+            [5, "Not billed", "Nos", 1, 10, None, None],
+        ],
+        bill_quantities=[3, "7.5", None, 1],
+    )
+    deviation = build_deviation(ws_wo, ws_bq, 10, "below")
+    excess, saving, blank = deviation["items"]
+    assert (excess["qty_wo"], excess["amt_wo"], excess["amt_bill"]) == (2.67, 267, 300)
+    assert (excess["excess_qty"], excess["excess_amt"], excess["saving_qty"], excess["saving_amt"]) == (0.33, 33, "", "")
+    assert (saving["amt_bill"], saving["saving_qty"], saving["saving_amt"], saving["excess_amt"]) == (94, 2.5, 31, "")
+    assert (blank["qty_wo"], blank["rate"], blank["qty_bill"], blank["excess_qty"]) == (0, 0, 0, "")
+
+    summary = deviation["summary"]
+    assert (summary["work_order_total"], summary["executed_total"]) == (392, 394)
+    assert (summary["overall_excess"], summary["overall_saving"]) == (33, 31)
+    assert (summary["tender_premium_f"], summary["tender_premium_j"], summary["tender_premium_l"]) == (-39.2, -3.3, -3.1)
+    assert (summary["grand_total_f"], summary["grand_total_j"], summary["grand_total_l"]) == (353, 30, 28)
+    assert summary["net_difference"] == 2
+
+    assert deviation["rejected"] == [
+        {"row": 25, "serial_no": "4", "reason": "rate is not a number: 'n/a'"},
+        {"row": 26, "serial_no": "5", "reason": "no matching Bill Quantity row"},
+    ]
+
+def test_quantity_index_matches_reordered_bill_quantity_by_serial():
+    ws_wo = pd.DataFrame([[None] * 7] * 21 + [
+        [1, "Parent", None, None, None, None, None],
+        [None, "Sub-item a", "Nos", 2, 10, None, None],
+        [None, "Sub-item b", "Nos", 2, 10, None, None],
+        [2, "Second", "Nos", 2, 10, None, None],
+        [3, "Third", "Nos", 2, 10, None, None],
+        [3, "Third again", "Nos", 2, 10, None, None],
+    ], dtype=object)
+    # Rows inserted and moved around, serials typed as text and floats
+    ws_bq = pd.DataFrame([[None] * 4] * 21 + [
+        ["2", None, None, 5],
+        [9, "Not in the work order", None, 4],
+        [1.0, None, None, None],
+        [None, None, None, 1],
+        [None, None, None, 3],
+        [3, None, None, 6],
+    ], dtype=object)
+
+    index = build_quantity_index(ws_wo, ws_bq)
+    assert index.align == "serial"
+    assert index.quantities.tolist()[1:5] == [1, 3, 5, 6]
+    assert index.matched.tolist() == [True, True, True, True, True, False]
+    assert [(issue["sheet"], issue["row"], issue["serial_no"], issue["reason"]) for issue in index.issues] == [
+        ("Work Order", 27, "3", "no Bill Quantity row for this item"),
+        ("Work Order", 27, "3", "serial number repeats an earlier item"),
+        ("Bill Quantity", 23, "9", "no Work Order item for this row; quantity ignored"),
+    ]
+
+    deviation = build_deviation(ws_wo, ws_bq, 0, "above", index)
+    assert [item["qty_bill"] for item in deviation["items"]] == [0, 1.0, 3.0, 5.0, 6.0]
+    assert deviation["rejected"] == [{"row": 27, "serial_no": "3", "reason": "no matching Bill Quantity row"}]
+    work_order_items, _ = streamlit_app.build_line_items(ws_wo, ws_bq, None, index)
+    assert work_order_items.column("quantity").tolist() == [0.0, 1.0, 3.0, 5.0, 6.0, 0.0]
+
+    # By position the same sheets pair quantities row for row
+    assert build_quantity_index(ws_wo, ws_bq, "position").quantities.tolist()[:3] == [5, 4, None]
+    with pytest.raises(ValueError):
+        build_quantity_index(ws_wo, ws_bq, "nearest")
+
+def test_quantity_index_auto_alignment_matches_sample_workbooks():
+    for name in ("SAMPLE BILL INPUT- NO EXTRA ITEMS.xlsx", "SAMPLE BILL INPUT- WITH EXTRA ITEMS.xlsx"):
+        sheets, _ = read_excel_sheets(os.path.join(TEST_FILES, name))
+        ws_wo, ws_bq = sheets["Work Order"], sheets["Bill Quantity"]
+        by_serial = build_deviation(ws_wo, ws_bq, 4, "above", build_quantity_index(ws_wo, ws_bq, "serial"))
+        by_position = build_deviation(ws_wo, ws_bq, 4, "above", build_quantity_index(ws_wo, ws_bq, "position"))
+        assert build_quantity_index(ws_wo, ws_bq).align == "serial"
+        assert by_serial == by_position
+
+def test_benchmark_synthetic_workbook_stages(tmp_path):
+    sheets = benchmark_bills.synthetic_sheets(12)
+    assert sheets["Work Order"].shape == (33, 7) and sheets["Extra Items"].shape == (7, 6)
+    assert sheets["Work Order"].iloc[21, 0] == 1 and sheets["Work Order"].iloc[22, 0] is None
+
+    record = benchmark_bills.benchmark_workbook(12, directory=str(tmp_path))
+    assert set(record["seconds"]) == set(benchmark_bills.STAGES) and record["seconds"]["pdf"] is None
+    assert set(record["peak_bytes"]) == set(benchmark_bills.STAGES)
+    assert record["zip_bytes"] > 0
+
+    results = str(tmp_path / "results.jsonl")
+    benchmark_bills.save_results([dict(record, commit="abc1234")], results)
+    current = dict(record, commit="def5678")
+    assert benchmark_bills.previous_record(benchmark_bills.load_results(results), current)["commit"] == "abc1234"
+    assert "vs abc1234" in benchmark_bills.format_record(current, dict(record, commit="abc1234"))
+
+def test_stage_metrics_logged_as_json_and_collected(monkeypatch, caplog):
+    monkeypatch.setattr(streamlit_app, "PIPELINE_PROCESSES", 0)
+    workbook = os.path.join(TEST_FILES, "SAMPLE BILL INPUT- NO EXTRA ITEMS.xlsx")
+    with caplog.at_level("INFO", logger="bill_metrics"), collect_stage_metrics() as records:
+        _, timings = generate_bill_outputs(workbook, validate_user_inputs(SAMPLE_INPUTS), mode="document", renderer=PipeRenderer())
+
+    stages = [record["stage"] for record in records]
+    for stage in ("read_excel_sheets", "validate_excel_sheets", "process_bill", "pdf", "create_word_doc", "zip"):
+        assert stage in stages
+    assert [stage for stage in stages if stage.startswith("html:")] == [f"html:{name}" for name in streamlit_app.BILL_SECTIONS]
+    assert stages.count("create_word_doc") == len(streamlit_app.WORD_SECTIONS)
+    assert all(record["wall_s"] >= 0 and record["cpu_s"] >= 0 and record["status"] == "ok" for record in records)
+    assert timings["zip"] == next(record["wall_s"] for record in records if record["stage"] == "zip")
+    logged = [json.loads(entry.getMessage()) for entry in caplog.records if entry.name == "bill_metrics"]
+    assert [entry["stage"] for entry in logged] == stages
+
+    breakdown = stage_metrics_frame(records)
+    assert list(breakdown.columns) == ["stage", "calls", "wall_s", "cpu_s", "peak_rss_mb"]
+    assert breakdown.set_index("stage").loc["create_word_doc", "calls"] == len(streamlit_app.WORD_SECTIONS)
+    assert stage_metrics_frame([]).empty
+
+def test_instrumented_records_failed_calls():
+    @streamlit_app.instrumented("failing")
+    def fail():
+        raise ValueError("boom")
+    with collect_stage_metrics() as records:
+        with pytest.raises(ValueError):
+            fail()
+    assert [(record["stage"], record["status"]) for record in records] == [("failing", "failed")]
+
+def test_batch_profile_captures_pipeline_threads(tmp_path, monkeypatch):
+    monkeypatch.setattr(streamlit_app, "PDF_RENDERER", PipeRenderer())
+    # Profiled runs keep CPU-bound stages out of worker processes
+    monkeypatch.setattr(streamlit_app, "get_process_pool", lambda: pytest.fail("profiled run used the process pool"))
+    workbook = os.path.join(TEST_FILES, "SAMPLE BILL INPUT- NO EXTRA ITEMS.xlsx")
+    result = batch_generate.generate_bill(
+        {"workbook": workbook, "name": "slow", "inputs": dict(SAMPLE_INPUTS)}, str(tmp_path), "batch", profile=True
+    )
+    assert result["status"] == "ok"
+    assert sorted(os.listdir(tmp_path)) == ["slow.allocations.txt", "slow.prof", "slow.zip"]
+
+    profiled = {function for _, _, function in pstats.Stats(str(tmp_path / "slow.prof")).stats}
+    assert {"process_bill", "word_doc_bytes", "create_word_doc", "run_pipeline"} <= profiled
+    allocations = (tmp_path / "slow.allocations.txt").read_text(encoding="utf-8").splitlines()
+    assert allocations[0].startswith(f"Top {streamlit_app.PROFILE_TOP_N} of")
+    assert allocations[1].startswith("#1: ")
+
+def test_overlapping_profiles_share_tracemalloc_and_skip_the_memo(monkeypatch):
+    ws_wo, ws_bq, ws_extra = _work_order_sheets(
+        rows=[[1, "Profiled item", "Nos", 3, 10, None, None]],
+        bill_quantities=[4],
+        extra_rows=[[1, "Extra", "Profiled extra", 2, "Nos", 12.5]],
+    )
+    user_inputs = {"start_date": "2024-01-01", "completion_date": "2024-12-31", "work_order_amount": 1000}
+    process_bill(ws_wo, ws_bq, ws_extra, 5, "above", 0, True, dict(user_inputs))
+    built = []
+    original = streamlit_app.build_line_items
+    monkeypatch.setattr(streamlit_app, "build_line_items", lambda *args: built.append(1) or original(*args))
+
+    first_entered, first_done = threading.Event(), threading.Event()
+    errors, profiles = [], {}
+    def run(name, enter, leave):
+        try:
+            with streamlit_app.profile_bill() as profile:
+                enter.set() if name == "first" else enter.wait(10)
+                process_bill(ws_wo, ws_bq, ws_extra, 5, "above", 0, True, dict(user_inputs))
+                if name == "second":
+                    leave.wait(10)
+            profiles[name] = profile
+        except Exception as e:
+            errors.append(e)
+        finally:
+            if name == "first":
+                leave.set()
+    threads = [threading.Thread(target=run, args=(name, first_entered, first_done)) for name in ("first", "second")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    # The second run takes its snapshot after the first stopped profiling
+    assert errors == []
+    assert all(profiles[name].snapshot is not None for name in ("first", "second"))
+    assert not tracemalloc.is_tracing()
+    assert len(built) == 2
+
+def test_bills_api_returns_zip_for_multipart_and_json(monkeypatch):
+    monkeypatch.setattr(streamlit_app, "PDF_RENDERER", PipeRenderer())
+    monkeypatch.setattr(streamlit_app, "PIPELINE_PROCESSES", 0)
+    monkeypatch.setattr(streamlit_app, "RESULT_CACHE", None)
+    client = bill_api.app.test_client()
+    with open(os.path.join(TEST_FILES, "SAMPLE BILL INPUT- NO EXTRA ITEMS.xlsx"), "rb") as f:
+        workbook = f.read()
+    fields = {name: str(value).lower() if isinstance(value, bool) else str(value) for name, value in SAMPLE_INPUTS.items()}
+
+    response = client.post("/bills", data=dict(fields, workbook=(io.BytesIO(workbook), "march.xlsx")),
+                           content_type="multipart/form-data")
+    assert response.status_code == 200 and response.mimetype == "application/zip"
+    assert response.is_streamed and "Content-Length" not in response.headers
+    assert response.headers["Content-Disposition"] == "attachment; filename=bill_output.zip"
+    assert "Deviation_Statement.docx" in zipfile.ZipFile(io.BytesIO(response.data)).namelist()
+    assert "process;dur=" in response.headers["Server-Timing"]
+
+    response = client.post("/bills?compression=deflated", json=dict(fields, workbook=base64.b64encode(workbook).decode()))
+    assert response.status_code == 200
+    assert {info.compress_type for info in zipfile.ZipFile(io.BytesIO(response.data)).infolist()} == {zipfile.ZIP_DEFLATED}
+
+def test_bills_api_rejects_bad_requests():
+    client = bill_api.app.test_client()
+    fields = dict(SAMPLE_INPUTS, is_first_bill="true")
+    assert client.post("/bills", json=fields).get_json() == {"error": "Missing workbook"}
+    response = client.post("/bills", json=dict(fields, workbook="not base64!"))
+    assert response.status_code == 400
+    response = client.post("/bills", json=dict(fields, premium_type="fixed", workbook=base64.b64encode(b"x").decode()))
+    assert response.status_code == 400 and "Premium type" in response.get_json()["error"]
+    response = client.post("/bills", json=dict(fields, workbook=base64.b64encode(b"not a workbook").decode()))
+    assert response.status_code == 422
+    assert client.post("/bills?pdf_mode=fast", json=fields).status_code == 400
+    assert client.get("/health").get_json() == {"status": "ok"}
+
+def test_session_archive_cache_expires_and_caps_bytes(monkeypatch):
+    archives = streamlit_app.SessionArchiveCache(max_bytes=10, ttl=60)
+    archives.put("a", b"12345", {"total": 1.0}, [])
+    archives.put("b", b"12345", {"total": 1.0}, [])
+    assert archives.get("a")["data"] == b"12345"
+    archives.put("c", b"123", {"total": 1.0}, [])
+    # b was the least recently used
+    assert archives.get("b") is None and archives.get("a") is not None and archives.get("c") is not None
+    archives.put("big", b"x" * 20, {"total": 1.0}, [])
+    assert archives.get("big") is not None and archives.get("a") is None
+    now = time.time()
+    monkeypatch.setattr(streamlit_app.time, "time", lambda: now + 61)
+    assert archives.get("big") is None
+
+def test_generate_bill_outputs_reuses_processed_bill(monkeypatch):
+    monkeypatch.setattr(streamlit_app, "PIPELINE_PROCESSES", 0)
+    with open(os.path.join(TEST_FILES, "SAMPLE BILL INPUT- WITH EXTRA ITEMS.xlsx"), "rb") as f:
+        workbook = f.read()
+    user_inputs = validate_user_inputs(SAMPLE_INPUTS)
+    workbook_hash = hashlib.sha256(workbook).hexdigest()
+    bill = streamlit_app.process_uploaded_bill(workbook_hash, user_inputs, workbook)
+    assert set(streamlit_app.parse_uploaded_workbook(workbook_hash, workbook)) == {"Work Order", "Bill Quantity", "Extra Items"}
+    monkeypatch.setattr(streamlit_app, "read_excel_sheets", lambda *args: pytest.fail("the workbook was parsed again"))
+
+    archive, timings = generate_bill_outputs(io.BytesIO(workbook), user_inputs, renderer=PipeRenderer(), bill=bill)
+
+    assert timings["parse"] == timings["process"] == 0.0
+    with zipfile.ZipFile(archive) as zipf:
+        assert len(zipf.namelist()) == 6
+
+def test_preview_items_page_builds_only_the_visible_rows():
+    items = LineItems({field: [] for field in LineItems.FIELDS})
+    for i in range(120):
+        for field, value in zip(LineItems.FIELDS, (str(i + 1), f"Item {i + 1}", "Nos", 2.0, 10.0, "", 20, False)):
+            items.columns[field].append(value)
+    read = []
+    class CountingItems(LineItems):
+        def _row(self, index):
+            read.append(index)
+            return super()._row(index)
+    items = CountingItems(items.columns)
+
+    page = streamlit_app.preview_items_page("First Page", items, 2, page_rows=50)
+    assert list(page.columns) == ["Serial No.", "Description", "Unit", "Quantity", "Rate", "Amount", "Remark"]
+    assert page["Serial No."].tolist() == [str(i) for i in range(51, 101)]
+    assert read == list(range(50, 100))
+    assert len(streamlit_app.preview_items_page("First Page", items, 99, page_rows=50)) == 20
+    assert streamlit_app.preview_page_count(120, 50) == 3 and streamlit_app.preview_page_count(0, 50) == 1
+
+    deviation = [{"serial_no": "1", "qty_wo": 5, "qty_bill": 7, "excess_qty": 2}]
+    page = streamlit_app.preview_items_page("Deviation Statement", deviation, 1)
+    assert page.loc[0, "Qty Bill"] == 7 and page.loc[0, "Saving Qty"] == ""
+
+def test_bill_sections_share_item_columns(tmp_path):
+    sheets, _ = read_excel_sheets(os.path.join(TEST_FILES, "SAMPLE BILL INPUT- WITH EXTRA ITEMS.xlsx"))
+    user_inputs = validate_user_inputs(SAMPLE_INPUTS)
+    first_page, _, deviation, extra_items, _, _ = process_bill(
+        sheets["Work Order"], sheets["Bill Quantity"], sheets["Extra Items"], 5, "above", 0, True, user_inputs
+    )
+    items = first_page["items"]
+
+    # Extra Items are a view of the First Page columns, not a copy
+    assert extra_items.columns is items.columns
+    assert len(extra_items) > 0 and extra_items[0] == items[len(items) - len(extra_items)]
+    assert extra_items.total == sum(item["amount"] for item in extra_items)
+    # The Deviation Statement holds the First Page's description strings, not copies
+    rows = deviation["items"]
+    assert isinstance(rows, streamlit_app.DeviationItems)
+    assert rows.column("description")[0] is items.column("description")[0]
+    assert isinstance(rows[0]["amt_wo"], int) and isinstance(rows[0]["description"], str)
+
+    doc_path = tmp_path / "deviation.docx"
+    streamlit_app.create_word_doc("Deviation Statement", deviation, str(doc_path))
+    assert rows[0]["description"] in [cell.text for cell in Document(str(doc_path)).tables[0].rows[1].cells]
+
+def test_job_queue_claims_by_priority_within_user_limit(tmp_path):
+    queue = bill_jobs.JobQueue(str(tmp_path), user_limit=1)
+    low = queue.submit(b"workbook", SAMPLE_INPUTS, user="a")
+    high = queue.submit(b"workbook", SAMPLE_INPUTS, user="a", priority=5)
+    other = queue.submit(b"workbook", SAMPLE_INPUTS, user="b")
+
+    assert queue.claim()["id"] == high
+    # User a is at the limit until their running job finishes
+    assert queue.claim()["id"] == other
+    assert queue.claim() is None
+    queue._finish(high, "done")
+    assert queue.claim()["id"] == low
+    assert [job["id"] for job in queue.jobs("a")] == [high, low]
+    assert queue.status(low)["status"] == "running" and queue.status("missing") is None
+    with pytest.raises(ValueError, match="Premium type"):
+        queue.submit(b"workbook", dict(SAMPLE_INPUTS, premium_type="fixed"))
+
+def test_job_queue_retries_rendering_without_reprocessing(tmp_path, monkeypatch):
+    monkeypatch.setattr(streamlit_app, "PIPELINE_PROCESSES", 0)
+    monkeypatch.setattr(bill_jobs, "JOB_RETRY_DELAY", 0)
+    processed = []
+    real_process_bill = streamlit_app.process_bill
+    monkeypatch.setattr(streamlit_app, "process_bill", lambda *args: processed.append(1) or real_process_bill(*args))
+    class FlakyRenderer(PipeRenderer):
+        def render_bytes(self, html, options=None, max_memory_bytes=None):
+            if not self.calls:
+                self.calls.append(None)
+                raise RuntimeError("wkhtmltopdf crashed")
+            return super().render_bytes(html, options, max_memory_bytes)
+    queue = bill_jobs.JobQueue(str(tmp_path), renderer=FlakyRenderer())
+    with open(os.path.join(TEST_FILES, "SAMPLE BILL INPUT- WITH EXTRA ITEMS.xlsx"), "rb") as f:
+        job_id = queue.submit(f.read(), SAMPLE_INPUTS, mode="document")
+
+    assert queue.run_pending() == 2
+    job = queue.status(job_id)
+    assert job["status"] == "done" and job["attempts"] == 2 and "pdf" in job["timings"]
+    assert len(processed) == 1
+    with zipfile.ZipFile(queue.result_path(job_id)) as zipf:
+        assert "output.pdf" in zipf.namelist() and zipf.testzip() is None
+
+    broken = queue.submit(b"not a workbook", SAMPLE_INPUTS)
+    assert queue.run_pending() == 1
+    assert queue.status(broken)["status"] == "failed" and queue.status(broken)["attempts"] == 1
+    assert queue.retry(broken) and not queue.retry(job_id)
+
+def test_job_queue_refuses_a_shared_directory(tmp_path):
+    queue = bill_jobs.JobQueue(str(tmp_path / "jobs"))
+    for name in ("", "workbooks", "results", "cache"):
+        assert os.stat(os.path.join(queue.directory, name)).st_mode & 0o777 == 0o700
+
+    shared = tmp_path / "shared"
+    shared.mkdir()
+    shared.chmod(0o1777)
+    with pytest.raises(PermissionError):
+        bill_jobs.JobQueue(str(shared))
+    assert os.listdir(shared) == []
+
+def test_jobs_api_queues_and_serves_results(tmp_path, monkeypatch):
+    monkeypatch.setattr(streamlit_app, "PIPELINE_PROCESSES", 0)
+    queue = bill_jobs.JobQueue(str(tmp_path), renderer=PipeRenderer())
+    monkeypatch.setattr(bill_api, "get_job_queue", lambda: queue)
+    client = bill_api.app.test_client()
+    with open(os.path.join(TEST_FILES, "SAMPLE BILL INPUT- NO EXTRA ITEMS.xlsx"), "rb") as f:
+        workbook = base64.b64encode(f.read()).decode()
+
+    response = client.post("/jobs?priority=2", json=dict(SAMPLE_INPUTS, workbook=workbook), headers={"X-User": "ee"})
+    assert response.status_code == 202
+    job = response.get_json()
+    assert job["status"] == "queued" and job["user"] == "ee" and job["priority"] == 2
+    assert client.get(f"{job['status_url']}/result").status_code == 409
+
+    queue.run_pending()
+    job = client.get(job["status_url"]).get_json()
+    assert job["status"] == "done"
+    response = client.get(job["result_url"])
+    assert response.status_code == 200 and response.mimetype == "application/zip"
+    assert "Deviation_Statement.docx" in zipfile.ZipFile(io.BytesIO(response.data)).namelist()
+    assert client.post(f"/jobs/{job['id']}/retry").status_code == 409
+    assert client.get("/jobs/missing").status_code == 404
+    assert client.post("/jobs?priority=high", json=dict(SAMPLE_INPUTS, workbook=workbook)).status_code == 400
+
 if __name__ == "__main__":
     pytest.main(["-v", "-s", "test_bill_generator.py"])